@@ -1,10 +1,22 @@
 import os
 import tarfile
+from argparse import ArgumentParser
 
 import gdown
 
 
+def parse_args():
+    parser = ArgumentParser()
+    # Keep data.tar.bz2 as is; the readers can stream from it with
+    # --documents_path data.tar.bz2::data/documents
+    parser.add_argument("--no_extract", action="store_true")
+
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+
     url = ("https://drive.google.com/u/0/uc?"
     "id=1ZcKZ1is0VEkY9kNfPxIG19qEIqHE5LIO&export=download"
     )
@@ -15,6 +27,9 @@ def main():
     os.makedirs(path, exist_ok=True)
     gdown.cached_download(url, archive_path)
 
+    if args.no_extract:
+        return
+
     with tarfile.open(archive_path, "r:bz2") as f:
         f.extractall(os.path.dirname(archive_path))
 
@@ -1,4 +1,27 @@
-from .base import BaseCandidateEntityGenerator
+from .base import BaseCandidateEntityGenerator, apply_entity_delta
+from .bm25_candidate_generator import Bm25CandidateGenerator
+from .cached_candidate_generator import CachedCandidateGenerator
+from .cascade_candidate_generator import CascadeCandidateGenerator
+from .dense_candidate_generator import DenseCandidateGenerator
+from .fusion_candidate_generator import FusionCandidateGenerator
+from .factory import CANDIDATE_GENERATORS, get_candidate_generator
 from .tfidf_candidate_generator import TfidfCandidateGenerator
+from .title_index import TitleIndex
+from .title_match_candidate_generator import TitleMatchCandidateGenerator
+from .truncated_candidate_generator import TruncatedCandidateGenerator
 
-__all__ = ["BaseCandidateEntityGenerator", "TfidfCandidateGenerator"]
+__all__ = [
+    "BaseCandidateEntityGenerator",
+    "Bm25CandidateGenerator",
+    "CANDIDATE_GENERATORS",
+    "CachedCandidateGenerator",
+    "CascadeCandidateGenerator",
+    "DenseCandidateGenerator",
+    "FusionCandidateGenerator",
+    "TfidfCandidateGenerator",
+    "TitleIndex",
+    "TitleMatchCandidateGenerator",
+    "TruncatedCandidateGenerator",
+    "apply_entity_delta",
+    "get_candidate_generator",
+]
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List
 
+from src.data.delta import EntityDelta, VersionedEntityDict
 from src.data.entity import Entity
 from src.data.mention import Mention
 
@@ -12,3 +13,26 @@ class BaseCandidateEntityGenerator(ABC):
     @abstractmethod
     def generate(self, mention: Mention) -> List[Entity]:
         pass
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        # Generators that can score many mentions at once override this
+        return [self.generate(mention) for mention in mentions]
+
+    def apply_delta(self, delta: EntityDelta):
+        # Called after the delta was applied to a VersionedEntityDict
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support incremental updates"
+        )
+
+
+def apply_entity_delta(
+    entity_dict: VersionedEntityDict,
+    candidate_generator: BaseCandidateEntityGenerator,
+    delta: EntityDelta,
+) -> int:
+    # The entities are updated first, so that the generator's new state
+    # captures a snapshot that already contains them; calls in flight keep
+    # using the generator's previous state and snapshot
+    version = entity_dict.apply(delta)
+    candidate_generator.apply_delta(delta)
+    return version
@@ -0,0 +1,208 @@
+import json
+import os
+import resource
+import time
+from argparse import ArgumentParser
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from src.candidate_generators.base import (
+    BaseCandidateEntityGenerator,
+    apply_entity_delta,
+)
+from src.candidate_generators.cascade_candidate_generator import (
+    CascadeCandidateGenerator,
+)
+from src.candidate_generators.factory import (
+    CANDIDATE_GENERATORS,
+    get_candidate_generator,
+)
+from src.data.delta import VersionedEntityDict, read_delta
+from src.data.entity import EntityReader
+from src.data.mention import Mention, MentionReader
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--mentions_path", type=str, default="data/mentions")
+    parser.add_argument("--filename", type=str, default="val.json")
+    parser.add_argument("--documents_path", type=str, default="data/documents")
+    parser.add_argument("--lazy_entities", action="store_true")
+    parser.add_argument("--entity_workers", type=int, default=1)
+    parser.add_argument("--partition_by_corpus", action="store_true")
+    parser.add_argument("--entity_deltas", type=str, nargs="*", default=[])
+    parser.add_argument(
+        "--candidate_generator",
+        type=str,
+        default="tfidf",
+        choices=CANDIDATE_GENERATORS,
+    )
+    parser.add_argument("--top_k_candidates", type=int, default=64)
+    parser.add_argument(
+        "--k", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument("--cascade_top_k", type=int, default=0)
+    parser.add_argument("--mention_window_size", type=int, default=16)
+    parser.add_argument("--entity_length", type=int, default=32)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--output", type=str)
+
+    args = parser.parse_args()
+
+    return args
+
+
+def peak_memory_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values: np.ndarray, q: float) -> float:
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def benchmark(
+    candidate_generator: BaseCandidateEntityGenerator,
+    mentions: Iterable[Mention],
+    ks: List[int],
+    batch_size: int = 1,
+) -> Dict[str, object]:
+    # Every mention is retrieved exactly once; recall at all k, per-world
+    # recall and timings are derived from that one pass
+    gold_ranks: List[int] = []
+    corpora: List[str] = []
+    latencies: List[float] = []
+    num_candidates = 0
+
+    mentions = iter(mentions)
+    total_start = time.perf_counter()
+    while True:
+        batch = list(islice(mentions, batch_size))
+        if not batch:
+            break
+
+        start = time.perf_counter()
+        candidates = candidate_generator.generate_batch(batch)
+        latencies.append((time.perf_counter() - start) / len(batch))
+
+        for mention, candidate_entities in zip(batch, candidates):
+            document_ids = [e.document_id for e in candidate_entities]
+            rank = -1
+            if mention.label_document_id in document_ids:
+                rank = document_ids.index(mention.label_document_id)
+            gold_ranks.append(rank)
+            corpora.append(mention.corpus)
+            num_candidates += len(document_ids)
+    total_seconds = time.perf_counter() - total_start
+
+    ranks = np.array(gold_ranks, dtype=np.int64)
+    found = ranks >= 0
+    corpora_array = np.array(corpora)
+    num_mentions = len(ranks)
+
+    def recall(mask: np.ndarray) -> Dict[int, float]:
+        if not mask.any():
+            return {k: 0.0 for k in ks}
+        return {k: float((found[mask] & (ranks[mask] < k)).mean()) for k in ks}
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "mentions": num_mentions,
+        "recall": recall(np.ones(num_mentions, dtype=bool)),
+        "recall_by_world": {
+            corpus: recall(corpora_array == corpus)
+            for corpus in sorted(set(corpora))
+        },
+        "mean_candidates": num_candidates / max(num_mentions, 1),
+        "mentions_per_second": num_mentions / max(total_seconds, 1e-9),
+        "latency_p50_ms": percentile(latencies_ms, 50),
+        "latency_p99_ms": percentile(latencies_ms, 99),
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+def print_report(report: Dict[str, object], setup_seconds: Optional[float]):
+    print(f"Mentions: {report['mentions']}")
+    if setup_seconds is not None:
+        print(f"Setup: {setup_seconds:.2f}s")
+    print(f"Mean candidates: {report['mean_candidates']:.2f}")
+    for k, value in report["recall"].items():
+        print(f"Recall@{k}: {value * 100:.3f}")
+    for corpus, recalls in report["recall_by_world"].items():
+        values = " ".join(
+            f"@{k}={value * 100:.2f}" for k, value in recalls.items()
+        )
+        print(f"Recall[{corpus}]: {values}")
+    print(f"Mentions/s: {report['mentions_per_second']:.1f}")
+    print(
+        f"Latency per mention p50/p99: {report['latency_p50_ms']:.3f}/"
+        f"{report['latency_p99_ms']:.3f} ms"
+    )
+    print(f"Peak memory: {report['peak_memory_mb']:.1f} MB")
+
+
+def main():
+    args = parse_args()
+
+    mention_reader = MentionReader(
+        os.path.join(args.mentions_path, args.filename)
+    )
+
+    corpora = None
+    if args.partition_by_corpus:
+        corpora = mention_reader.corpora()
+
+    setup_start = time.perf_counter()
+    entity_reader = EntityReader(
+        args.documents_path,
+        num_workers=args.entity_workers,
+        corpora=corpora,
+    )
+    if args.lazy_entities:
+        entity_dict = entity_reader.read_store()
+    else:
+        entity_dict = entity_reader.read_all()
+    if args.entity_deltas:
+        entity_dict = VersionedEntityDict(entity_dict)
+
+    candidate_generator = get_candidate_generator(
+        args.candidate_generator,
+        entity_dict=entity_dict,
+        top_k=args.top_k_candidates,
+        filename=args.filename,
+    )
+    for delta_path in args.entity_deltas:
+        apply_entity_delta(
+            entity_dict, candidate_generator, read_delta(delta_path)
+        )
+
+    if args.cascade_top_k > 0:
+        candidate_generator = CascadeCandidateGenerator(
+            candidate_generator,
+            top_k=args.cascade_top_k,
+            context_window=args.mention_window_size,
+            entity_length=args.entity_length,
+        )
+    setup_seconds = time.perf_counter() - setup_start
+
+    report = benchmark(
+        candidate_generator,
+        mention_reader,
+        ks=sorted(args.k),
+        batch_size=args.batch_size,
+    )
+    report["setup_seconds"] = setup_seconds
+    if isinstance(candidate_generator, CascadeCandidateGenerator):
+        report["cascade"] = candidate_generator.stats()
+    print_report(report, setup_seconds)
+    if "cascade" in report:
+        print(f"Cascade: {report['cascade']}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
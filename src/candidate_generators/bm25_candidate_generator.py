@@ -0,0 +1,478 @@
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.candidate_generators.utils import (
+    content_fingerprint,
+    group_by_corpus,
+    mention_context,
+    tokenize,
+    top_k_indices,
+)
+from src.data.delta import EntityDelta, entity_snapshot
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+cd = os.path.dirname(os.path.abspath(__file__))
+
+# Bumped whenever the saved index layout changes
+INDEX_VERSION = 3
+
+
+def count_terms(
+    offset: int, texts: List[str]
+) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    # Term counts for one chunk of documents, against a chunk-local
+    # vocabulary that the parent process maps onto the global one
+    vocabulary: Dict[str, int] = {}
+    documents, terms, counts = [], [], []
+
+    for i, text in enumerate(texts):
+        for term, count in Counter(tokenize(text)).items():
+            documents.append(offset + i)
+            terms.append(vocabulary.setdefault(term, len(vocabulary)))
+            counts.append(count)
+
+    return (
+        list(vocabulary),
+        np.array(documents, dtype=np.int32),
+        np.array(terms, dtype=np.int32),
+        np.array(counts, dtype=np.float32),
+    )
+
+
+class Bm25CandidateGenerator(BaseCandidateEntityGenerator):
+    def __init__(
+        self,
+        entity_dict: Dict[str, Entity],
+        top_k: int = 64,
+        context_window: int = 16,
+        k1: float = 1.2,
+        b: float = 0.75,
+        num_workers: int = 1,
+        chunk_size: int = 10000,
+        block_size: int = 1 << 22,
+        path: Optional[str] = os.path.join(cd, "artifacts", "bm25.npz"),
+    ):
+        BaseCandidateEntityGenerator.__init__(self, entity_dict)
+        self.top_k = top_k
+        self.context_window = context_window
+        self.k1 = k1
+        self.b = b
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        # Maximum number of scores held at once when scoring a batch
+        self.block_size = block_size
+        self.path = path
+        self.load_or_build_index()
+        # Entities, tombstones over the base documents and the segment of
+        # documents added since the base index was built; apply_delta
+        # replaces the tuple in one assignment
+        self.state: Tuple[
+            Mapping[str, Entity], Optional[np.ndarray], Optional[Bm25Segment]
+        ] = (entity_snapshot(entity_dict), None, None)
+        self.document_rows: Optional[Dict[str, int]] = None
+
+    def load_or_build_index(self):
+        index_fingerprint = content_fingerprint(
+            self.entity_dict, self.k1, self.b, INDEX_VERSION
+        )
+
+        index_path = self.index_path(index_fingerprint)
+        if index_path is not None and os.path.isfile(index_path):
+            with np.load(index_path) as index:
+                if str(index["fingerprint"]) == index_fingerprint:
+                    self.set_index(index)
+                    return
+
+        index = self.build_index()
+        index["fingerprint"] = np.array(index_fingerprint)
+        self.set_index(index)
+
+        if index_path is not None:
+            os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+            tmp_path = f"{index_path}.{os.getpid()}.tmp.npz"
+            try:
+                np.savez(tmp_path, **index)
+                os.replace(tmp_path, index_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def index_path(self, index_fingerprint: str) -> Optional[str]:
+        # One index per entity set, e.g. artifacts/bm25.<fingerprint>.npz,
+        # so that switching between datasets or worlds does not rebuild
+        if self.path is None:
+            return None
+        root, extension = os.path.splitext(self.path)
+        return f"{root}.{index_fingerprint[:16]}{extension}"
+
+    def set_index(self, index):
+        self.document_ids: List[str] = index["document_ids"].tolist()
+        self.vocabulary: Dict[str, int] = {
+            term: i for i, term in enumerate(index["terms"].tolist())
+        }
+        self.term_pointers: np.ndarray = index["term_pointers"]
+        self.posting_documents: np.ndarray = index["posting_documents"]
+        self.posting_weights: np.ndarray = index["posting_weights"]
+        self.average_length = float(index["average_length"])
+        self.corpus_ranges: Dict[str, Tuple[int, int]] = {
+            corpus: (int(start), int(end))
+            for corpus, start, end in zip(
+                index["corpora"].tolist(),
+                index["corpus_starts"],
+                index["corpus_ends"],
+            )
+        }
+
+    def build_index(self) -> Dict[str, np.ndarray]:
+        document_ids, corpus_ranges = group_by_corpus(
+            self.entity_dict.values()
+        )
+        texts = []
+        for document_id in document_ids:
+            entity = self.entity_dict[document_id]
+            texts.append(f"{entity.title} {entity.text}")
+
+        chunks = [
+            (offset, texts[offset : offset + self.chunk_size])
+            for offset in range(0, len(texts), self.chunk_size)
+        ]
+        if self.num_workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                results = list(executor.map(count_terms, *zip(*chunks)))
+        else:
+            results = [count_terms(*chunk) for chunk in chunks]
+
+        vocabulary: Dict[str, int] = {}
+        documents, terms, counts = [], [], []
+        for chunk_vocabulary, *chunk_postings in results:
+            global_terms = np.array(
+                [
+                    vocabulary.setdefault(term, len(vocabulary))
+                    for term in chunk_vocabulary
+                ],
+                dtype=np.int32,
+            )
+            chunk_documents, chunk_terms, chunk_counts = chunk_postings
+            documents.append(chunk_documents)
+            terms.append(global_terms[chunk_terms])
+            counts.append(chunk_counts)
+
+        num_documents = len(document_ids)
+        documents = np.concatenate(documents or [np.zeros(0, np.int32)])
+        terms = np.concatenate(terms or [np.zeros(0, np.int32)])
+        counts = np.concatenate(counts or [np.zeros(0, np.float32)])
+
+        # BM25 term weights, precomputed per (term, document) posting
+        document_frequencies = np.bincount(terms, minlength=len(vocabulary))
+        idf = np.log1p(
+            (num_documents - document_frequencies + 0.5)
+            / (document_frequencies + 0.5)
+        )
+        document_lengths = np.bincount(
+            documents, weights=counts, minlength=num_documents
+        )
+        average_length = (
+            float(document_lengths.mean()) if num_documents > 0 else 0.0
+        )
+        length_norm = (
+            1 - self.b + self.b * document_lengths / max(average_length, 1.0)
+        )
+        weights = (
+            idf[terms]
+            * counts
+            * (self.k1 + 1)
+            / (counts + self.k1 * length_norm[documents])
+        )
+
+        # Postings grouped by term, sorted by document within each term
+        order = np.lexsort((documents, terms))
+        term_pointers = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(document_frequencies, out=term_pointers[1:])
+
+        corpora = list(corpus_ranges)
+        return {
+            "document_ids": np.array(document_ids),
+            "terms": np.array(list(vocabulary)),
+            "term_pointers": term_pointers,
+            "posting_documents": documents[order],
+            "posting_weights": weights[order].astype(np.float32),
+            "average_length": np.array(average_length),
+            "corpora": np.array(corpora),
+            "corpus_starts": np.array(
+                [corpus_ranges[c][0] for c in corpora], dtype=np.int64
+            ),
+            "corpus_ends": np.array(
+                [corpus_ranges[c][1] for c in corpora], dtype=np.int64
+            ),
+        }
+
+    def query_counts(self, mention: Mention) -> Counter:
+        context = mention_context(
+            mention, self.entity_dict, self.context_window
+        )
+        # The mention itself is counted on top of its context window
+        return Counter(tokenize(f"{mention.text} {context}"))
+
+    def query_terms(self, mention: Mention) -> Counter:
+        return Counter(
+            {
+                self.vocabulary[term]: count
+                for term, count in self.query_counts(mention).items()
+                if term in self.vocabulary
+            }
+        )
+
+    def idf(self, term: str) -> float:
+        # Deltas are weighted with the statistics of the base index
+        document_frequency = 0
+        if term in self.vocabulary:
+            i = self.vocabulary[term]
+            document_frequency = int(
+                self.term_pointers[i + 1] - self.term_pointers[i]
+            )
+        return float(
+            np.log1p(
+                (len(self.document_ids) - document_frequency + 0.5)
+                / (document_frequency + 0.5)
+            )
+        )
+
+    def document_range(self, mention: Mention) -> Tuple[int, int]:
+        # Mentions of a world that is not indexed are scored against all
+        # documents, in blocks of rows (see generate_batch)
+        return self.corpus_ranges.get(
+            mention.corpus, (0, len(self.document_ids))
+        )
+
+    def postings(
+        self, term: int, start: int, end: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # Postings of one term restricted to documents in [start, end)
+        lo, hi = self.term_pointers[term], self.term_pointers[term + 1]
+        documents = self.posting_documents[lo:hi]
+        i, j = np.searchsorted(documents, [start, end])
+        return documents[i:j], self.posting_weights[lo + i : lo + j]
+
+    def score(self, mention: Mention) -> Tuple[np.ndarray, int]:
+        # Sparse query vector times the sparse term-document matrix,
+        # accumulated with a single bincount
+        start, end = self.document_range(mention)
+        documents, weights = [], []
+        for term, count in self.query_terms(mention).items():
+            term_documents, term_weights = self.postings(term, start, end)
+            documents.append(term_documents - start)
+            weights.append(term_weights * count)
+
+        if not documents:
+            return np.zeros(end - start, dtype=np.float64), start
+
+        scores = np.bincount(
+            np.concatenate(documents),
+            weights=np.concatenate(weights),
+            minlength=end - start,
+        )
+        return scores, start
+
+    def score_batch(
+        self, mentions: List[Mention], start: int, end: int
+    ) -> np.ndarray:
+        # Same product for a batch of mentions sharing one document range:
+        # postings are keyed by (row, document) so that one bincount fills
+        # the whole [len(mentions), end - start] score matrix
+        width = end - start
+        keys, weights = [], []
+        for row, mention in enumerate(mentions):
+            for term, count in self.query_terms(mention).items():
+                term_documents, term_weights = self.postings(term, start, end)
+                keys.append(term_documents - start + row * width)
+                weights.append(term_weights * count)
+
+        if not keys:
+            return np.zeros((len(mentions), width), dtype=np.float64)
+
+        scores = np.bincount(
+            np.concatenate(keys),
+            weights=np.concatenate(weights),
+            minlength=len(mentions) * width,
+        )
+        return scores.reshape(len(mentions), width)
+
+    def generate(self, mention: Mention) -> List[Entity]:
+        entities, tombstones, segment = self.state
+        if tombstones is not None or segment is not None:
+            return self.generate_batch([mention])[0]
+
+        scores, offset = self.score(mention)
+        indices = top_k_indices(scores, self.top_k) + offset
+
+        return [entities[self.document_ids[i]] for i in indices.tolist()]
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        # One state for the whole batch, even if a delta is applied while
+        # it is scored
+        state = self.state
+
+        rows_by_range = defaultdict(list)
+        for row, mention in enumerate(mentions):
+            rows_by_range[self.document_range(mention)].append(row)
+
+        candidates: List[List[Entity]] = [[] for _ in mentions]
+        for (start, end), range_rows in rows_by_range.items():
+            # Bounds the dense [rows, documents] score matrix, which matters
+            # when the range spans all worlds
+            rows_per_block = max(1, self.block_size // max(end - start, 1))
+            for block in range(0, len(range_rows), rows_per_block):
+                rows = range_rows[block : block + rows_per_block]
+                block_candidates = self.generate_block(
+                    [mentions[i] for i in rows], start, end, state
+                )
+                for row, row_entities in zip(rows, block_candidates):
+                    candidates[row] = row_entities
+
+        return candidates
+
+    def generate_block(
+        self,
+        mentions: List[Mention],
+        start: int,
+        end: int,
+        state: Tuple[
+            Mapping[str, Entity],
+            Optional[np.ndarray],
+            Optional["Bm25Segment"],
+        ],
+    ) -> List[List[Entity]]:
+        entities, tombstones, segment = state
+
+        scores = self.score_batch(mentions, start, end)
+        if tombstones is not None:
+            scores[:, tombstones[start:end]] = -np.inf
+
+        indices = top_k_indices(scores, self.top_k)
+        top_scores = np.take_along_axis(scores, indices, axis=1)
+        indices += start
+
+        candidates = []
+        for mention, row_indices, row_scores in zip(
+            mentions, indices, top_scores
+        ):
+            valid = row_scores > -np.inf
+            row_entities = [
+                entities[self.document_ids[i]]
+                for i in row_indices[valid].tolist()
+            ]
+            if segment is not None:
+                row_entities = self.merge_segment(
+                    mention, segment, row_entities, row_scores[valid]
+                )
+            candidates.append(row_entities)
+
+        return candidates
+
+    def merge_segment(
+        self,
+        mention: Mention,
+        segment: "Bm25Segment",
+        base_entities: List[Entity],
+        base_scores: np.ndarray,
+    ) -> List[Entity]:
+        corpus = None
+        if mention.corpus in self.corpus_ranges:
+            corpus = mention.corpus
+        segment_scores = segment.score(self.query_counts(mention), corpus)
+
+        scores = np.concatenate([base_scores, segment_scores])
+        indices = [
+            i
+            for i in top_k_indices(scores, self.top_k).tolist()
+            if scores[i] > -np.inf
+        ]
+        all_entities = base_entities + segment.entities
+        return [all_entities[i] for i in indices]
+
+    def apply_delta(self, delta: EntityDelta):
+        # Changed and deleted base documents are tombstoned; the current
+        # versions of all documents added since the base index was built
+        # are kept in a small segment that is rebuilt on every delta
+        _, tombstones, segment = self.state
+        changed = delta.changed_ids()
+
+        if self.document_rows is None:
+            self.document_rows = {
+                document_id: i
+                for i, document_id in enumerate(self.document_ids)
+            }
+        if tombstones is None:
+            tombstones = np.zeros(len(self.document_ids), dtype=bool)
+        else:
+            tombstones = tombstones.copy()
+        rows = [
+            self.document_rows[i] for i in changed if i in self.document_rows
+        ]
+        tombstones[rows] = True
+
+        upserts = {
+            entity.document_id: entity
+            for entity in (segment.entities if segment is not None else [])
+            if entity.document_id not in changed
+        }
+        upserts.update((e.document_id, e) for e in delta.upserts)
+
+        segment = None
+        if upserts:
+            segment = Bm25Segment(
+                list(upserts.values()),
+                self.idf,
+                self.average_length,
+                self.k1,
+                self.b,
+            )
+
+        self.state = (entity_snapshot(self.entity_dict), tombstones, segment)
+
+
+class Bm25Segment:
+    def __init__(
+        self,
+        entities: List[Entity],
+        idf: Callable[[str], float],
+        average_length: float,
+        k1: float,
+        b: float,
+    ):
+        self.entities = entities
+        self.corpora = np.array([entity.corpus or "" for entity in entities])
+
+        postings: Dict[str, Tuple[List[int], List[float]]] = {}
+        for i, entity in enumerate(entities):
+            counts = Counter(tokenize(f"{entity.title} {entity.text}"))
+            length_norm = (
+                1 - b + b * sum(counts.values()) / max(average_length, 1.0)
+            )
+            for term, count in counts.items():
+                documents, weights = postings.setdefault(term, ([], []))
+                documents.append(i)
+                weights.append(
+                    idf(term) * count * (k1 + 1) / (count + k1 * length_norm)
+                )
+
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            term: (np.array(documents), np.array(weights))
+            for term, (documents, weights) in postings.items()
+        }
+
+    def score(self, query: Counter, corpus: Optional[str]) -> np.ndarray:
+        scores = np.zeros(len(self.entities), dtype=np.float64)
+        for term, count in query.items():
+            if term in self.postings:
+                documents, weights = self.postings[term]
+                scores[documents] += weights * count
+
+        if corpus is not None:
+            scores[self.corpora != corpus] = -np.inf
+        return scores
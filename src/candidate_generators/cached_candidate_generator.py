@@ -0,0 +1,197 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.candidate_generators.utils import (
+    generator_settings,
+    mention_context,
+    tokenize,
+)
+from src.data.delta import EntityDelta
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+KEY_TYPES = ("mention_id", "context")
+
+
+class CachedCandidateGenerator(BaseCandidateEntityGenerator):
+    # Where the cache is saved does not change the candidates, so that
+    # generator_settings leaves it out
+    excluded_settings = ("path",)
+
+    def __init__(
+        self,
+        candidate_generator: BaseCandidateEntityGenerator,
+        max_size: int = 100000,
+        key_type: str = "mention_id",
+        context_window: int = 16,
+        path: Optional[str] = None,
+        settings: Optional[Dict[str, object]] = None,
+    ):
+        BaseCandidateEntityGenerator.__init__(
+            self, candidate_generator.entity_dict
+        )
+        if key_type not in KEY_TYPES:
+            raise ValueError(f"Unknown cache key type: {key_type}")
+
+        self.candidate_generator = candidate_generator
+        self.max_size = max_size
+        self.key_type = key_type
+        self.context_window = context_window
+        self.path = path
+        # Settings the cache cannot see itself, e.g. where the entities and
+        # mentions were read from, that a saved cache must match
+        self.settings = settings or {}
+
+        # Only candidate document ids are cached, entities are looked up
+        # again on every hit
+        self.cache: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Fingerprints of the deltas applied, in order
+        self.applied_deltas: List[str] = []
+
+        if self.path is not None and os.path.isfile(self.path):
+            self.load()
+
+    @property
+    def top_k(self) -> Optional[int]:
+        return getattr(self.candidate_generator, "top_k", None)
+
+    def key(self, mention: Mention) -> str:
+        if self.key_type == "mention_id":
+            return mention.mention_id
+
+        context = mention_context(
+            mention, self.entity_dict, self.context_window
+        )
+        normalized = "\t".join(
+            [
+                mention.corpus,
+                " ".join(tokenize(mention.text)),
+                " ".join(tokenize(context)),
+            ]
+        )
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def generate(self, mention: Mention) -> List[Entity]:
+        return self.generate_batch([mention])[0]
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        keys = [self.key(mention) for mention in mentions]
+        results: Dict[str, Tuple[str, ...]] = {}
+        missing: Dict[str, Mention] = {}
+
+        with self.lock:
+            for key, mention in zip(keys, mentions):
+                # Repeats within a batch are served by the same lookup
+                if key in results or key in missing:
+                    self.hits += 1
+                elif key in self.cache:
+                    self.cache.move_to_end(key)
+                    results[key] = self.cache[key]
+                    self.hits += 1
+                else:
+                    missing[key] = mention
+                    self.misses += 1
+
+        if missing:
+            generated = self.candidate_generator.generate_batch(
+                list(missing.values())
+            )
+            with self.lock:
+                for key, candidate_entities in zip(missing, generated):
+                    document_ids = tuple(
+                        entity.document_id for entity in candidate_entities
+                    )
+                    results[key] = document_ids
+                    self.store(key, document_ids)
+
+        return [
+            [self.entity_dict[document_id] for document_id in results[key]]
+            for key in keys
+        ]
+
+    def apply_delta(self, delta: EntityDelta):
+        self.candidate_generator.apply_delta(delta)
+        # Added entities can change any cached list, so nothing is kept;
+        # a cache saved after the same deltas can be loaded again
+        with self.lock:
+            self.cache.clear()
+            self.applied_deltas = self.applied_deltas + [delta.fingerprint()]
+
+        if self.path is not None and os.path.isfile(self.path):
+            self.load()
+
+    def store(self, key: str, document_ids: Tuple[str, ...]):
+        self.cache[key] = document_ids
+        self.cache.move_to_end(key)
+
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def __getstate__(self):
+        # Copies sent to DataLoader workers (pickled under spawn, forked
+        # otherwise) start from this cache, but the entries and counts they
+        # add stay in the worker: stats() and save() only cover lookups
+        # made in this process
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.cache),
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    def metadata(self) -> Dict[str, object]:
+        # Entries are only valid for the same wrapped generator settings,
+        # entities and deltas; normalized through JSON like the saved copy
+        metadata = {
+            "generator": generator_settings(self.candidate_generator),
+            "key_type": self.key_type,
+            "context_window": self.context_window,
+            "applied_deltas": self.applied_deltas,
+            **self.settings,
+        }
+        return json.loads(json.dumps(metadata, default=str))
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        with self.lock:
+            entries = list(self.cache.items())
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"metadata": self.metadata(), "entries": entries}, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: Optional[str] = None):
+        with open(path or self.path, "r") as f:
+            data = json.load(f)
+
+        if data.get("metadata") != self.metadata():
+            return
+
+        with self.lock:
+            for key, document_ids in data["entries"]:
+                self.store(key, tuple(document_ids))
+            # Entries dropped while loading are not evictions of this run
+            self.evictions = 0
@@ -0,0 +1,103 @@
+from typing import Dict, List
+
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.candidate_generators.utils import mention_context, tokenize
+from src.data.delta import EntityDelta
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+
+class CascadeCandidateGenerator(BaseCandidateEntityGenerator):
+    def __init__(
+        self,
+        candidate_generator: BaseCandidateEntityGenerator,
+        top_k: int = 16,
+        context_window: int = 16,
+        entity_length: int = 32,
+        title_weight: float = 2.0,
+    ):
+        BaseCandidateEntityGenerator.__init__(
+            self, candidate_generator.entity_dict
+        )
+        self.candidate_generator = candidate_generator
+        self.top_k = top_k
+        self.context_window = context_window
+        self.entity_length = entity_length
+        self.title_weight = title_weight
+
+        # Pruned lists, and how many of them had the gold entity before and
+        # after pruning; a mention pruned twice is counted twice, which
+        # leaves the recall ratios unchanged
+        self.pruned = 0
+        self.retrieved = 0
+        self.kept = 0
+
+    def score(
+        self, mention: Mention, candidate_entities: List[Entity]
+    ) -> List[float]:
+        # Lexical overlap of the mention and its context window with what
+        # ESCHER would see of each candidate: the title and the first
+        # entity_length words of its text
+        mention_tokens = set(tokenize(mention.text))
+        context_tokens = set(
+            tokenize(
+                mention_context(mention, self.entity_dict, self.context_window)
+            )
+        )
+
+        scores = []
+        for entity in candidate_entities:
+            title_tokens = set(tokenize(entity.title))
+            text_tokens = set(
+                tokenize(
+                    " ".join(entity.text.split(" ")[: self.entity_length])
+                )
+            )
+            title_score = len(mention_tokens & title_tokens) / max(
+                len(title_tokens), 1
+            )
+            context_score = len(context_tokens & text_tokens) / max(
+                len(text_tokens), 1
+            )
+            scores.append(self.title_weight * title_score + context_score)
+
+        return scores
+
+    def prune(
+        self, mention: Mention, candidate_entities: List[Entity]
+    ) -> List[Entity]:
+        scores = self.score(mention, candidate_entities)
+        # Stable sort, so the generator's ranking breaks ties
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])
+        kept = [candidate_entities[i] for i in order[: self.top_k]]
+
+        gold = mention.label_document_id
+        self.pruned += 1
+        self.retrieved += any(
+            entity.document_id == gold for entity in candidate_entities
+        )
+        self.kept += any(entity.document_id == gold for entity in kept)
+
+        return kept
+
+    def generate(self, mention: Mention) -> List[Entity]:
+        return self.generate_batch([mention])[0]
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        candidates = self.candidate_generator.generate_batch(mentions)
+        return [
+            self.prune(mention, candidate_entities)
+            for mention, candidate_entities in zip(mentions, candidates)
+        ]
+
+    def apply_delta(self, delta: EntityDelta):
+        self.candidate_generator.apply_delta(delta)
+
+    def stats(self) -> Dict[str, float]:
+        mentions, retrieved, kept = self.pruned, self.retrieved, self.kept
+        return {
+            "mentions": mentions,
+            "recall_before": retrieved / mentions if mentions else 0.0,
+            "recall_after": kept / mentions if mentions else 0.0,
+            "recall_cost": (retrieved - kept) / mentions if mentions else 0.0,
+        }
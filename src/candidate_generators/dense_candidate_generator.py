@@ -0,0 +1,458 @@
+from collections import defaultdict
+import hashlib
+import math
+import os
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+import torch
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.candidate_generators.nearest_neighbours import ExactIndex, IvfIndex
+from src.candidate_generators.utils import (
+    content_fingerprint,
+    group_by_corpus,
+    mention_context,
+    top_k_indices,
+)
+from src.data.delta import EntityDelta, entity_snapshot
+from src.data.entity import Entity
+from src.data.mention import Mention
+from transformers import AutoModel, AutoTokenizer
+
+cd = os.path.dirname(os.path.abspath(__file__))
+
+
+class DenseCandidateGenerator(BaseCandidateEntityGenerator):
+    def __init__(
+        self,
+        entity_dict: Dict[str, Entity],
+        top_k: int = 64,
+        encoder_model: str = "sentence-transformers/all-MiniLM-L6-v2",
+        context_window: int = 16,
+        max_length: int = 128,
+        batch_size: int = 64,
+        index_type: str = "exact",
+        num_clusters: Optional[int] = None,
+        num_probes: int = 8,
+        block_size: int = 65536,
+        device: str = "cpu",
+        path: str = os.path.join(cd, "artifacts", "dense"),
+        max_delta_states: int = 64,
+    ):
+        BaseCandidateEntityGenerator.__init__(self, entity_dict)
+        if index_type not in ("exact", "ivf"):
+            raise ValueError(f"Unknown index type: {index_type}")
+
+        self.top_k = top_k
+        self.encoder_model = encoder_model
+        self.context_window = context_window
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.index_type = index_type
+        self.num_clusters = num_clusters
+        self.num_probes = num_probes
+        self.block_size = block_size
+        self.device = torch.device(device)
+        self.path = os.path.join(path, encoder_model.replace("/", "__"))
+        # Every chain of deltas applied leaves a file under deltas/; only
+        # the max_delta_states most recently used are kept
+        self.max_delta_states = max_delta_states
+
+        self.tokenizer = AutoTokenizer.from_pretrained(encoder_model)
+        self.encoder = AutoModel.from_pretrained(encoder_model)
+        self.encoder.to(self.device).eval()
+
+        self.load_or_build_index()
+        # Entities, tombstones over the indexed rows and the segment of
+        # entities added since the index was built (entities, embeddings,
+        # corpora); apply_delta replaces the tuple in one assignment
+        self.state: Tuple[
+            Mapping[str, Entity],
+            Optional[np.ndarray],
+            Optional[Tuple[List[Entity], np.ndarray, np.ndarray]],
+        ] = (entity_snapshot(entity_dict), None, None)
+        self.document_rows: Optional[Dict[str, int]] = None
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # Mean-pooled, L2-normalized embeddings so that inner product is
+        # cosine similarity
+        embeddings = []
+        with torch.no_grad():
+            for start in range(0, len(texts), self.batch_size):
+                inputs = self.tokenizer(
+                    texts[start : start + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="pt",
+                ).to(self.device)
+                hidden_states = self.encoder(**inputs).last_hidden_state
+
+                mask = inputs["attention_mask"].unsqueeze(-1).float()
+                pooled = (hidden_states * mask).sum(1) / mask.sum(1).clamp(
+                    min=1
+                )
+                pooled = torch.nn.functional.normalize(pooled, dim=-1)
+                embeddings.append(pooled.float().cpu().numpy())
+
+        if not embeddings:
+            return np.zeros((0, self.encoder.config.hidden_size), np.float32)
+
+        return np.concatenate(embeddings)
+
+    def index_paths(self) -> Dict[str, str]:
+        return {
+            "embeddings": os.path.join(self.path, "embeddings.npy"),
+            "metadata": os.path.join(self.path, "metadata.npz"),
+        }
+
+    def load_or_build_index(self):
+        paths = self.index_paths()
+        index_fingerprint = content_fingerprint(
+            self.entity_dict, self.encoder_model, self.max_length
+        )
+
+        metadata = None
+        if all(os.path.isfile(path) for path in paths.values()):
+            with np.load(paths["metadata"]) as f:
+                if str(f["fingerprint"]) == index_fingerprint:
+                    metadata = dict(f)
+
+        if metadata is None:
+            metadata = self.build_embeddings()
+            metadata["fingerprint"] = np.array(index_fingerprint)
+            self.save_metadata(metadata)
+
+        # Identifies the index and the deltas applied on top of it, in order
+        self.delta_key = index_fingerprint
+
+        self.document_ids: List[str] = metadata["document_ids"].tolist()
+        self.corpus_ranges: Dict[str, Tuple[int, int]] = {
+            corpus: (int(start), int(end))
+            for corpus, start, end in zip(
+                metadata["corpora"].tolist(),
+                metadata["corpus_starts"],
+                metadata["corpus_ends"],
+            )
+        }
+        self.embeddings = np.load(paths["embeddings"], mmap_mode="r")
+
+        if self.index_type == "exact":
+            self.index = ExactIndex(self.embeddings, self.block_size)
+            return
+
+        num_clusters = self.num_clusters
+        if num_clusters is None:
+            num_clusters = max(1, int(4 * math.sqrt(len(self.embeddings))))
+
+        if int(metadata.get("num_clusters", -1)) == num_clusters:
+            self.index = IvfIndex(
+                self.embeddings,
+                metadata["centroids"],
+                metadata["list_pointers"],
+                metadata["list_ids"],
+                self.num_probes,
+            )
+            return
+
+        self.index = IvfIndex.train(
+            self.embeddings,
+            num_clusters,
+            num_probes=self.num_probes,
+            block_size=self.block_size,
+        )
+        metadata.update(
+            num_clusters=np.array(num_clusters),
+            centroids=self.index.centroids,
+            list_pointers=self.index.list_pointers,
+            list_ids=self.index.list_ids,
+        )
+        self.save_metadata(metadata)
+
+    def build_embeddings(self) -> Dict[str, np.ndarray]:
+        # Entities are encoded once, in corpus order, and written straight
+        # into a float16 .npy file so the full matrix is never held in
+        # float32
+        document_ids, corpus_ranges = group_by_corpus(
+            self.entity_dict.values()
+        )
+        paths = self.index_paths()
+        os.makedirs(self.path, exist_ok=True)
+
+        tmp_path = f"{paths['embeddings']}.{os.getpid()}.tmp"
+        embeddings = np.lib.format.open_memmap(
+            tmp_path,
+            mode="w+",
+            dtype=np.float16,
+            shape=(len(document_ids), self.encoder.config.hidden_size),
+        )
+        chunk_size = self.batch_size * 64
+        for start in range(0, len(document_ids), chunk_size):
+            texts = []
+            for document_id in document_ids[start : start + chunk_size]:
+                entity = self.entity_dict[document_id]
+                texts.append(self.entity_text(entity))
+            embeddings[start : start + len(texts)] = self.encode(texts)
+
+        embeddings.flush()
+        del embeddings
+        os.replace(tmp_path, paths["embeddings"])
+
+        corpora = list(corpus_ranges)
+        return {
+            "document_ids": np.array(document_ids),
+            "corpora": np.array(corpora),
+            "corpus_starts": np.array(
+                [corpus_ranges[c][0] for c in corpora], dtype=np.int64
+            ),
+            "corpus_ends": np.array(
+                [corpus_ranges[c][1] for c in corpora], dtype=np.int64
+            ),
+        }
+
+    def save_metadata(self, metadata: Dict[str, np.ndarray]):
+        path = self.index_paths()["metadata"]
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **metadata)
+        os.replace(tmp_path, path)
+
+    def entity_text(self, entity: Entity) -> str:
+        return f"{entity.title}. {entity.text}"
+
+    def mention_text(self, mention: Mention) -> str:
+        context = mention_context(
+            mention, self.entity_dict, self.context_window
+        )
+        return f"{mention.text}: {context}"
+
+    def document_range(self, mention: Mention) -> Tuple[int, int]:
+        return self.corpus_ranges.get(
+            mention.corpus, (0, len(self.document_ids))
+        )
+
+    def generate(self, mention: Mention) -> List[Entity]:
+        return self.generate_batch([mention])[0]
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        entities, tombstones, segment = self.state
+        queries = self.encode([self.mention_text(m) for m in mentions])
+
+        rows_by_range = defaultdict(list)
+        for row, mention in enumerate(mentions):
+            rows_by_range[self.document_range(mention)].append(row)
+
+        candidates: List[List[Entity]] = [[] for _ in mentions]
+        for (start, end), rows in rows_by_range.items():
+            k = self.top_k
+            if tombstones is not None:
+                k += int(tombstones[start:end].sum())
+            results = self.index.search(queries[rows], k, start, end)
+
+            for row, indices in zip(rows, results):
+                if tombstones is not None:
+                    indices = indices[~tombstones[indices]][: self.top_k]
+                row_entities = [
+                    entities[self.document_ids[i]] for i in indices.tolist()
+                ]
+                if segment is not None:
+                    row_entities = self.merge_segment(
+                        mentions[row],
+                        queries[row],
+                        segment,
+                        indices,
+                        row_entities,
+                    )
+                candidates[row] = row_entities
+
+        return candidates
+
+    def merge_segment(
+        self,
+        mention: Mention,
+        query: np.ndarray,
+        segment: Tuple[List[Entity], np.ndarray, np.ndarray],
+        indices: np.ndarray,
+        base_entities: List[Entity],
+    ) -> List[Entity]:
+        # The segment is searched exhaustively and merged with the index
+        # results by inner product
+        segment_entities, segment_embeddings, segment_corpora = segment
+        base_scores = np.asarray(self.embeddings[indices], np.float32) @ query
+        segment_scores = segment_embeddings @ query
+        if mention.corpus in self.corpus_ranges:
+            segment_scores[segment_corpora != mention.corpus] = -np.inf
+
+        scores = np.concatenate([base_scores, segment_scores])
+        all_entities = base_entities + segment_entities
+        return [
+            all_entities[i]
+            for i in top_k_indices(scores, self.top_k).tolist()
+            if scores[i] > -np.inf
+        ]
+
+    def delta_path(self, delta_key: str) -> str:
+        return os.path.join(self.path, "deltas", f"{delta_key}.npz")
+
+    def apply_delta(self, delta: EntityDelta):
+        # Changed and deleted rows are tombstoned; entities added since the
+        # index was built are encoded once and kept in a small segment. The
+        # result is saved next to the index, keyed by the index and the
+        # deltas applied so far, so later runs applying the same deltas do
+        # not encode the entities again.
+        delta_key = hashlib.sha1(
+            f"{self.delta_key}\n{delta.fingerprint()}".encode("utf-8")
+        ).hexdigest()
+        entities = entity_snapshot(self.entity_dict)
+
+        state = self.load_delta_state(delta_key, entities)
+        if state is None:
+            state = self.build_delta_state(delta)
+            self.save_delta_state(delta_key, *state)
+
+        self.delta_key = delta_key
+        self.state = (entities, *state)
+
+    def build_delta_state(
+        self, delta: EntityDelta
+    ) -> Tuple[
+        np.ndarray, Optional[Tuple[List[Entity], np.ndarray, np.ndarray]]
+    ]:
+        _, tombstones, segment = self.state
+        changed = delta.changed_ids()
+
+        if self.document_rows is None:
+            self.document_rows = {
+                document_id: i
+                for i, document_id in enumerate(self.document_ids)
+            }
+        if tombstones is None:
+            tombstones = np.zeros(len(self.document_ids), dtype=bool)
+        else:
+            tombstones = tombstones.copy()
+        rows = [
+            self.document_rows[i] for i in changed if i in self.document_rows
+        ]
+        tombstones[rows] = True
+
+        segment_entities: List[Entity] = []
+        segment_embeddings = [
+            np.zeros((0, self.encoder.config.hidden_size), np.float32)
+        ]
+        if segment is not None:
+            kept = [
+                i
+                for i, entity in enumerate(segment[0])
+                if entity.document_id not in changed
+            ]
+            segment_entities = [segment[0][i] for i in kept]
+            segment_embeddings.append(segment[1][kept])
+
+        upserts = list(
+            {entity.document_id: entity for entity in delta.upserts}.values()
+        )
+        segment_entities += upserts
+        # Rounded through float16 like the indexed embeddings, so that an
+        # unchanged entity scores the same before and after an update
+        segment_embeddings.append(
+            self.encode([self.entity_text(entity) for entity in upserts])
+            .astype(np.float16)
+            .astype(np.float32)
+        )
+
+        segment = None
+        if segment_entities:
+            segment = (
+                segment_entities,
+                np.concatenate(segment_embeddings),
+                np.array([entity.corpus or "" for entity in segment_entities]),
+            )
+
+        return tombstones, segment
+
+    def save_delta_state(
+        self,
+        delta_key: str,
+        tombstones: np.ndarray,
+        segment: Optional[Tuple[List[Entity], np.ndarray, np.ndarray]],
+    ):
+        segment_ids, segment_embeddings = [], np.zeros(
+            (0, self.encoder.config.hidden_size), np.float32
+        )
+        if segment is not None:
+            segment_ids = [entity.document_id for entity in segment[0]]
+            segment_embeddings = segment[1]
+
+        path = self.delta_path(delta_key)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.savez(
+                tmp_path,
+                tombstones=np.flatnonzero(tombstones),
+                segment_ids=np.array(segment_ids, dtype=np.str_),
+                segment_embeddings=segment_embeddings,
+            )
+            os.replace(tmp_path, path)
+        except OSError:
+            # A read-only artifacts directory only costs us the cache
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.prune_delta_states()
+
+    def prune_delta_states(self):
+        directory = os.path.dirname(self.delta_path(""))
+        try:
+            # Files being written by other processes end in .tmp.npz
+            paths = [
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if name.endswith(".npz") and not name.endswith(".tmp.npz")
+            ]
+            paths.sort(key=os.path.getmtime, reverse=True)
+            for path in paths[self.max_delta_states :]:
+                os.remove(path)
+        except OSError:
+            # Files removed by another process meanwhile
+            pass
+
+    def load_delta_state(
+        self, delta_key: str, entities: Mapping[str, Entity]
+    ) -> Optional[
+        Tuple[
+            np.ndarray, Optional[Tuple[List[Entity], np.ndarray, np.ndarray]]
+        ]
+    ]:
+        path = self.delta_path(delta_key)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            # Marks the file as recently used, so that it is pruned last
+            os.utime(path)
+        except OSError:
+            pass
+
+        try:
+            with np.load(path) as f:
+                tombstone_rows = f["tombstones"]
+                segment_ids = f["segment_ids"].tolist()
+                segment_embeddings = f["segment_embeddings"]
+            # Segment entities are the current versions of the upserts
+            segment_entities = [entities[i] for i in segment_ids]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        tombstones = np.zeros(len(self.document_ids), dtype=bool)
+        tombstones[tombstone_rows] = True
+
+        segment = None
+        if segment_entities:
+            segment = (
+                segment_entities,
+                segment_embeddings,
+                np.array([entity.corpus or "" for entity in segment_entities]),
+            )
+
+        return tombstones, segment
@@ -0,0 +1,64 @@
+from typing import Dict
+
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.candidate_generators.bm25_candidate_generator import (
+    Bm25CandidateGenerator,
+)
+from src.candidate_generators.dense_candidate_generator import (
+    DenseCandidateGenerator,
+)
+from src.candidate_generators.fusion_candidate_generator import (
+    FusionCandidateGenerator,
+)
+from src.candidate_generators.tfidf_candidate_generator import (
+    TfidfCandidateGenerator,
+)
+from src.candidate_generators.title_match_candidate_generator import (
+    TitleMatchCandidateGenerator,
+)
+from src.data.entity import Entity
+
+CANDIDATE_GENERATORS = ["tfidf", "bm25", "dense", "fusion", "title"]
+
+
+def get_candidate_generator(
+    name: str,
+    entity_dict: Dict[str, Entity],
+    top_k: int = 64,
+    filename: str = "train.json",
+) -> BaseCandidateEntityGenerator:
+    if name == "tfidf":
+        return TfidfCandidateGenerator(
+            entity_dict=entity_dict, top_k=top_k, filename=filename
+        )
+
+    if name == "bm25":
+        return Bm25CandidateGenerator(entity_dict=entity_dict, top_k=top_k)
+
+    if name == "dense":
+        return DenseCandidateGenerator(entity_dict=entity_dict, top_k=top_k)
+
+    if name == "fusion":
+        # Children retrieve deeper lists than the fused top_k so that
+        # agreement between them decides which candidates are kept
+        return FusionCandidateGenerator(
+            [
+                TfidfCandidateGenerator(
+                    entity_dict=entity_dict, top_k=64, filename=filename
+                ),
+                Bm25CandidateGenerator(entity_dict=entity_dict, top_k=64),
+                TitleMatchCandidateGenerator(entity_dict=entity_dict),
+            ],
+            top_k=top_k,
+        )
+
+    if name == "title":
+        # Exact title matches first, TF-IDF fills the rest of the list
+        return TitleMatchCandidateGenerator(
+            entity_dict=entity_dict,
+            candidate_generator=TfidfCandidateGenerator(
+                entity_dict=entity_dict, top_k=top_k, filename=filename
+            ),
+        )
+
+    raise ValueError(f"Unknown candidate generator: {name}")
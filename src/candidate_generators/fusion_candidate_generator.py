@@ -0,0 +1,189 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.data.delta import EntityDelta
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+
+class FusionCandidateGenerator(BaseCandidateEntityGenerator):
+    def __init__(
+        self,
+        candidate_generators: List[BaseCandidateEntityGenerator],
+        top_k: int = 64,
+        rrf_k: int = 60,
+        weights: Optional[List[float]] = None,
+        latency_budget: Optional[float] = None,
+        chunk_size: int = 16,
+    ):
+        BaseCandidateEntityGenerator.__init__(
+            self, candidate_generators[0].entity_dict
+        )
+        if weights is not None and len(weights) != len(candidate_generators):
+            raise ValueError(
+                f"Got {len(weights)} weights for "
+                f"{len(candidate_generators)} candidate generators"
+            )
+
+        self.candidate_generators = candidate_generators
+        self.top_k = top_k
+        self.rrf_k = rrf_k
+        self.weights = weights or [1.0] * len(candidate_generators)
+        # Seconds allowed per mention. Children answer a batch in chunks of
+        # chunk_size mentions and the first i mentions of a batch must be
+        # answered within i * latency_budget seconds; a child that misses
+        # the deadline of a mention is left out of that mention's list only
+        self.latency_budget = latency_budget
+        self.chunk_size = chunk_size
+        # One thread per child, so that a child still busy with a batch
+        # whose deadline passed cannot delay the others; under a budget, a
+        # child that is still busy is left out of the next batch
+        self.executors = [
+            ThreadPoolExecutor(max_workers=1) for _ in candidate_generators
+        ]
+        self.running: List[Optional[Future]] = [None] * len(
+            candidate_generators
+        )
+        self.lock = threading.Lock()
+        # Mentions for which each child was dropped
+        self.dropped = [0] * len(candidate_generators)
+
+    def __enter__(self) -> "FusionCandidateGenerator":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def generate(self, mention: Mention) -> List[Entity]:
+        return self.generate_batch([mention])[0]
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        if not mentions:
+            return []
+
+        if self.latency_budget is None:
+            futures = [
+                executor.submit(generator.generate_batch, mentions)
+                for executor, generator in zip(
+                    self.executors, self.candidate_generators
+                )
+            ]
+            child_candidates = [
+                (weight, future.result())
+                for weight, future in zip(self.weights, futures)
+            ]
+            return [
+                self.fuse(
+                    [
+                        (weight, lists[row])
+                        for weight, lists in child_candidates
+                    ]
+                )
+                for row in range(len(mentions))
+            ]
+
+        # Mentions answered together share the deadline of the last one
+        chunk_ends = np.minimum(
+            (np.arange(len(mentions)) // self.chunk_size + 1)
+            * self.chunk_size,
+            len(mentions),
+        )
+        deadlines = time.perf_counter() + self.latency_budget * chunk_ends
+        stopped = threading.Event()
+        answers = [[None] * len(mentions) for _ in self.candidate_generators]
+        futures = []
+        with self.lock:
+            for i, generator in enumerate(self.candidate_generators):
+                if self.running[i] is not None and not self.running[i].done():
+                    continue
+                self.running[i] = self.executors[i].submit(
+                    self.answer_in_chunks,
+                    generator,
+                    mentions,
+                    answers[i],
+                    stopped,
+                )
+                futures.append(self.running[i])
+        wait(futures, timeout=deadlines[-1] - time.perf_counter())
+        # A running chunk cannot be interrupted; late children stop after
+        # it and their remaining mentions are dropped
+        stopped.set()
+        for future in futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+        fused = []
+        dropped = [0] * len(self.candidate_generators)
+        for row, deadline in enumerate(deadlines.tolist()):
+            ranked_lists = []
+            for i, child_answers in enumerate(answers):
+                answer = child_answers[row]
+                if answer is None or answer[1] > deadline:
+                    dropped[i] += 1
+                    continue
+                ranked_lists.append((self.weights[i], answer[0]))
+            fused.append(self.fuse(ranked_lists))
+
+        with self.lock:
+            self.dropped = [a + b for a, b in zip(self.dropped, dropped)]
+
+        return fused
+
+    def answer_in_chunks(
+        self,
+        generator: BaseCandidateEntityGenerator,
+        mentions: List[Mention],
+        answers: List[Optional[Tuple[List[Entity], float]]],
+        stopped: threading.Event,
+    ):
+        # Each answer is stored with the time its chunk completed
+        for start in range(0, len(mentions), self.chunk_size):
+            if stopped.is_set():
+                return
+            chunk = mentions[start : start + self.chunk_size]
+            candidates = generator.generate_batch(chunk)
+            completed = time.perf_counter()
+            for i, row_candidates in enumerate(candidates):
+                answers[start + i] = (row_candidates, completed)
+
+    def apply_delta(self, delta: EntityDelta):
+        for generator in self.candidate_generators:
+            generator.apply_delta(delta)
+
+    def fuse(
+        self, ranked_lists: List[Tuple[float, List[Entity]]]
+    ) -> List[Entity]:
+        # Reciprocal rank fusion, deduplicated by document id; ties keep the
+        # order in which documents were first seen
+        scores: Dict[str, float] = {}
+        entities: Dict[str, Entity] = {}
+
+        for weight, candidates in ranked_lists:
+            for rank, entity in enumerate(candidates):
+                document_id = entity.document_id
+                scores[document_id] = scores.get(document_id, 0.0) + (
+                    weight / (self.rrf_k + rank + 1)
+                )
+                entities.setdefault(document_id, entity)
+
+        document_ids = sorted(scores, key=lambda i: -scores[i])
+
+        return [entities[i] for i in document_ids[: self.top_k]]
+
+    def stats(self) -> Dict[str, int]:
+        # Keyed by position, so that two children of the same class are
+        # counted separately
+        return {
+            f"{i}:{generator.__class__.__name__}": dropped
+            for i, (generator, dropped) in enumerate(
+                zip(self.candidate_generators, self.dropped)
+            )
+        }
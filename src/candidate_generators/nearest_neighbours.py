@@ -0,0 +1,194 @@
+from typing import List, Optional
+
+import numpy as np
+from src.candidate_generators.utils import top_k_indices
+
+
+def blocked_argmax(
+    vectors: np.ndarray, centroids: np.ndarray, block_size: int
+) -> np.ndarray:
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start : start + block_size], np.float32)
+        assignments[start : start + len(block)] = np.argmax(
+            block @ centroids.T, axis=1
+        )
+    return assignments
+
+
+class ExactIndex:
+    def __init__(self, embeddings: np.ndarray, block_size: int = 65536):
+        self.embeddings = embeddings
+        self.block_size = block_size
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> List[np.ndarray]:
+        # Exact inner-product search over rows [start, end). Rows are read
+        # (and upcast from float16) one block at a time, keeping a running
+        # top-k, so memory stays bounded for mmap'd embeddings.
+        end = len(self.embeddings) if end is None else end
+        best_indices = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+
+        for block_start in range(start, end, self.block_size):
+            block_end = min(block_start + self.block_size, end)
+            block = np.asarray(
+                self.embeddings[block_start:block_end], dtype=np.float32
+            )
+            scores = queries @ block.T
+            indices = top_k_indices(scores, k)
+
+            best_scores = np.concatenate(
+                [best_scores, np.take_along_axis(scores, indices, axis=1)],
+                axis=1,
+            )
+            best_indices = np.concatenate(
+                [best_indices, indices + block_start], axis=1
+            )
+
+            selected = top_k_indices(best_scores, k)
+            best_scores = np.take_along_axis(best_scores, selected, axis=1)
+            best_indices = np.take_along_axis(best_indices, selected, axis=1)
+
+        return list(best_indices)
+
+
+class IvfIndex:
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        centroids: np.ndarray,
+        list_pointers: np.ndarray,
+        list_ids: np.ndarray,
+        num_probes: int = 8,
+    ):
+        self.embeddings = embeddings
+        self.centroids = centroids
+        self.list_pointers = list_pointers
+        self.list_ids = list_ids
+        self.num_probes = num_probes
+        # Rows are sorted by list and by id within each list, so the
+        # (list, id) keys are sorted and the rows of any list that fall in
+        # an id range are found by binary search
+        num_rows = len(embeddings)
+        list_sizes = np.diff(list_pointers)
+        self.list_keys = (
+            np.repeat(np.arange(len(list_sizes), dtype=np.int64), list_sizes)
+            * num_rows
+            + list_ids
+        )
+
+    @classmethod
+    def train(
+        cls,
+        embeddings: np.ndarray,
+        num_clusters: int,
+        num_probes: int = 8,
+        iterations: int = 10,
+        sample_size: int = 100000,
+        block_size: int = 65536,
+        seed: int = 0,
+    ) -> "IvfIndex":
+        # Spherical k-means on a sample, then every row is assigned to its
+        # closest centroid; the inverted lists are rows sorted by cluster
+        rng = np.random.default_rng(seed)
+        num_clusters = min(num_clusters, len(embeddings))
+
+        sample_ids = np.sort(
+            rng.choice(
+                len(embeddings),
+                min(sample_size, len(embeddings)),
+                replace=False,
+            )
+        )
+        sample = np.asarray(embeddings[sample_ids], dtype=np.float32)
+        centroids = sample[
+            rng.choice(len(sample), num_clusters, replace=False)
+        ].copy()
+
+        for _ in range(iterations):
+            assignments = blocked_argmax(sample, centroids, block_size)
+            order = np.argsort(assignments, kind="stable")
+            sorted_assignments = assignments[order]
+            boundaries = np.flatnonzero(
+                np.diff(sorted_assignments, prepend=-1) != 0
+            )
+
+            sums = np.zeros_like(centroids)
+            sums[sorted_assignments[boundaries]] = np.add.reduceat(
+                sample[order], boundaries, axis=0
+            )
+
+            counts = np.bincount(assignments, minlength=num_clusters)
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), empty.sum())]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+
+        assignments = blocked_argmax(embeddings, centroids, block_size)
+        list_ids = np.argsort(assignments, kind="stable")
+        list_pointers = np.zeros(num_clusters + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(assignments, minlength=num_clusters),
+            out=list_pointers[1:],
+        )
+
+        return cls(embeddings, centroids, list_pointers, list_ids, num_probes)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> List[np.ndarray]:
+        end = len(self.embeddings) if end is None else end
+
+        # Only lists holding rows in [start, end) are probed, so that a
+        # search restricted to one world does not spend its probes on the
+        # lists of other worlds
+        bases = np.arange(len(self.centroids), dtype=np.int64) * len(
+            self.embeddings
+        )
+        lo = np.searchsorted(self.list_keys, bases + start)
+        hi = np.searchsorted(self.list_keys, bases + end)
+        available = np.flatnonzero(hi > lo)
+        if len(available) == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in queries]
+
+        # Lists in probe order; at least num_probes are probed, and more
+        # until k rows are found or the lists run out
+        order = top_k_indices(
+            queries @ self.centroids[available].T, len(available)
+        )
+        enough = np.cumsum((hi - lo)[available][order], axis=1) >= k
+        num_lists = np.maximum(
+            np.where(
+                enough.any(axis=1), enough.argmax(axis=1) + 1, len(available)
+            ),
+            min(self.num_probes, len(available)),
+        )
+
+        results = []
+        for query, query_order, query_num_lists in zip(
+            queries, order, num_lists
+        ):
+            ids = np.sort(
+                np.concatenate(
+                    [
+                        self.list_ids[lo[c] : hi[c]]
+                        for c in available[query_order[:query_num_lists]]
+                    ]
+                )
+            )
+
+            vectors = np.asarray(self.embeddings[ids], dtype=np.float32)
+            results.append(ids[top_k_indices(vectors @ query, k)])
+
+        return results
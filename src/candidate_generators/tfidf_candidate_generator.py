@@ -1,12 +1,15 @@
 import json
 import os
 import tarfile
-from typing import Dict, List
+from typing import Dict, List, Mapping, Optional
 
 import gdown
+import numpy as np
 from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.data.delta import EntityDelta, entity_snapshot
 from src.data.entity import Entity
 from src.data.mention import Mention
+from src.data.streams import ARCHIVE_SEPARATOR, open_text, split_archive_path
 
 cd = os.path.dirname(os.path.abspath(__file__))
 
@@ -18,52 +21,208 @@ class TfidfCandidateGenerator(BaseCandidateEntityGenerator):
         top_k: int = 64,
         filename: str = "train.json",
         path: str = os.path.join(cd, "artifacts", "tfidf_candidates"),
+        extract: bool = True,
     ):
         BaseCandidateEntityGenerator.__init__(self, entity_dict)
         self.path = path
         self.filename = filename
         self.top_k = top_k
+        self.extract = extract
+        self.archive_path = self.path + ".tar.bz2"
+        self.split = os.path.splitext(filename)[0]
         self.download_artifacts()
-        self.candidate_dict = self.get_candidate_dict()
+        self.load_candidate_matrix()
+        # Entities the lists are resolved against and a mask of removed
+        # entity codes, swapped together by apply_delta
+        self.state = (entity_snapshot(entity_dict), None)
 
     def generate(self, mention: Mention) -> List[Entity]:
-        mention_id = mention.mention_id
+        row = self.find_rows([mention.mention_id])[0]
 
-        if mention_id not in self.candidate_dict:
+        if row < 0:
             return []
 
-        candidate_ids = self.candidate_dict[mention_id]
-        candidate_entities = [
-            self.entity_dict[candidate_id] for candidate_id in candidate_ids
+        return self.lookup(self.candidate_matrix[row], *self.state)
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        rows = self.find_rows([m.mention_id for m in mentions])
+        found = np.flatnonzero(rows >= 0)
+
+        candidates: List[List[Entity]] = [[] for _ in mentions]
+        if len(found) == 0:
+            return candidates
+
+        # A single gather of all requested rows from the mmap'd matrix
+        state = self.state
+        codes = self.candidate_matrix[rows[found]]
+        for i, row_codes in zip(found.tolist(), codes):
+            candidates[i] = self.lookup(row_codes, *state)
+
+        return candidates
+
+    def find_rows(self, mention_ids: List[str]) -> np.ndarray:
+        # Binary search in the sorted mention ids; -1 for unknown mentions.
+        # As with a dict, the last row of a repeated mention id wins.
+        queries = np.array(
+            [mention_id.encode("utf-8") for mention_id in mention_ids],
+            dtype=np.bytes_,
+        )
+        positions = (
+            np.searchsorted(self.mention_ids, queries, side="right") - 1
+        )
+        found = positions >= 0
+        found[found] = self.mention_ids[positions[found]] == queries[found]
+
+        rows = np.full(len(queries), -1, dtype=np.int64)
+        rows[found] = self.mention_rows[positions[found]]
+        return rows
+
+    def lookup(
+        self,
+        codes: np.ndarray,
+        entities: Mapping[str, Entity],
+        removed: Optional[np.ndarray],
+    ) -> List[Entity]:
+        # Rows shorter than the matrix width are padded with -1
+        codes = codes[codes >= 0]
+        if removed is not None:
+            codes = codes[~removed[codes]]
+
+        return [
+            entities[document_id.decode("utf-8")]
+            for document_id in self.entity_ids[codes[: self.top_k]].tolist()
         ]
 
-        return candidate_entities[: self.top_k]
+    def apply_delta(self, delta: EntityDelta):
+        # The precomputed lists cannot gain new entities; deleted entities
+        # are filtered out and modified ones are read from the new snapshot
+        entities = entity_snapshot(self.entity_dict)
+        removed = np.array(
+            [
+                document_id.decode("utf-8") not in entities
+                for document_id in self.entity_ids.tolist()
+            ],
+            dtype=bool,
+        )
+        self.state = (entities, removed if removed.any() else None)
+
+    def candidates_path(self) -> str:
+        path = os.path.join(self.path, self.filename)
+        if os.path.isfile(path) or not os.path.isfile(self.archive_path):
+            return path
+
+        # Stream the split straight out of the downloaded archive
+        member_name = os.path.basename(self.path) + "/" + self.filename
+        return self.archive_path + ARCHIVE_SEPARATOR + member_name
+
+    def matrix_paths(self) -> Dict[str, str]:
+        return {
+            "matrix": os.path.join(self.path, f"{self.split}.candidates.npy"),
+            "entities": os.path.join(self.path, f"{self.split}.entities.npy"),
+            "mentions": os.path.join(self.path, f"{self.split}.mentions.npy"),
+            "mention_rows": os.path.join(
+                self.path, f"{self.split}.mention_rows.npy"
+            ),
+        }
+
+    def is_matrix_stale(self) -> bool:
+        source_path, _ = split_archive_path(self.candidates_path())
+        source_mtime = os.path.getmtime(source_path)
+
+        return any(
+            not os.path.isfile(path) or os.path.getmtime(path) < source_mtime
+            for path in self.matrix_paths().values()
+        )
+
+    def convert_candidates(self):
+        # One-time conversion of the JSON candidate lists into an int32
+        # [n_mentions, K] matrix over an integer entity vocabulary
+        entity_codes: Dict[str, int] = {}
+        mention_ids = []
+        rows = []
 
-    def get_candidate_dict(self) -> Dict[str, List[str]]:
-        candidate_dict = {}
-        with open(os.path.join(self.path, self.filename), "r") as f:
+        with open_text(self.candidates_path()) as f:
             for line in f:
                 line_dict = json.loads(line)
-                candidate_dict[line_dict["mention_id"]] = line_dict[
-                    "tfidf_candidates"
-                ]
+                mention_ids.append(line_dict["mention_id"])
+                rows.append(
+                    [
+                        entity_codes.setdefault(_id, len(entity_codes))
+                        for _id in line_dict["tfidf_candidates"]
+                    ]
+                )
+
+        width = max((len(row) for row in rows), default=0)
+        matrix = np.full((len(rows), width), -1, dtype=np.int32)
+        for i, row in enumerate(rows):
+            matrix[i, : len(row)] = row
+
+        # Mention ids are sorted once here so that startup only maps the
+        # arrays and lookups are binary searches
+        mention_ids = np.array(
+            [mention_id.encode("utf-8") for mention_id in mention_ids],
+            dtype=np.bytes_,
+        )
+        order = np.argsort(mention_ids, kind="stable")
+        arrays = {
+            "matrix": matrix,
+            "entities": np.array(
+                [_id.encode("utf-8") for _id in entity_codes], dtype=np.bytes_
+            ),
+            "mentions": mention_ids[order],
+            "mention_rows": order.astype(np.int32),
+        }
+
+        paths = self.matrix_paths()
+        os.makedirs(self.path, exist_ok=True)
 
-        return candidate_dict
+        # Write to temporary files first so an interrupted conversion is
+        # never mistaken for a complete one; the names are per process so
+        # that concurrent conversions do not write to the same files
+        tmp_paths = {
+            key: f"{path}.{os.getpid()}.tmp" for key, path in paths.items()
+        }
+        try:
+            for key, array in arrays.items():
+                with open(tmp_paths[key], "wb") as f:
+                    np.save(f, array)
+            for key, path in paths.items():
+                os.replace(tmp_paths[key], path)
+        finally:
+            for tmp_path in tmp_paths.values():
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def load_candidate_matrix(self):
+        if self.is_matrix_stale():
+            self.convert_candidates()
+
+        paths = self.matrix_paths()
+        self.candidate_matrix = np.load(paths["matrix"], mmap_mode="r")
+        self.entity_ids = np.load(paths["entities"], mmap_mode="r")
+        self.mention_ids = np.load(paths["mentions"], mmap_mode="r")
+        self.mention_rows = np.load(paths["mention_rows"], mmap_mode="r")
 
     def download_artifacts(self):
         if os.path.isfile(os.path.join(self.path, self.filename)):
             return
 
+        if not self.extract and os.path.isfile(self.archive_path):
+            return
+
         url = (
             "https://drive.google.com/u/0/uc?"
             "id=1wGppj3ivE7jBaDzDlovWAvaBzLhPjR8B&export=download"
         )
 
-        archive_path = self.path + ".tar.bz2"
+        archive_path = self.archive_path
 
         os.makedirs(self.path, exist_ok=True)
         gdown.cached_download(url, archive_path)
 
+        if not self.extract:
+            return
+
         with tarfile.open(archive_path, "r:bz2") as f:
             f.extractall(os.path.dirname(archive_path))
 
@@ -0,0 +1,104 @@
+import re
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from src.candidate_generators.utils import tokenize
+from src.data.delta import EntityDelta
+from src.data.entity import Entity
+
+PARENTHETICAL_PATTERN = re.compile(r"\s*\([^)]*\)\s*$")
+
+
+def normalize_title(title: str) -> str:
+    return " ".join(tokenize(title))
+
+
+def title_aliases(title: str) -> List[str]:
+    # "Darth Vader (Legends)" is also reachable as "darth vader"
+    aliases = [normalize_title(title)]
+    stripped = normalize_title(PARENTHETICAL_PATTERN.sub("", title))
+    if stripped and stripped != aliases[0]:
+        aliases.append(stripped)
+    return [alias for alias in aliases if alias]
+
+
+class TitleIndex:
+    def __init__(self, entities: Iterable[Entity]):
+        # corpus -> normalized title -> (alias rank, document id) postings;
+        # exact titles (rank 0) are listed before parenthetical-stripped
+        # aliases (rank 1)
+        self.index: Dict[str, Dict[str, Tuple[Tuple[int, str], ...]]] = {}
+
+        postings: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
+        for entity in entities:
+            corpus = entity.corpus or ""
+            for rank, alias in enumerate(title_aliases(entity.title)):
+                postings.setdefault((corpus, alias), []).append(
+                    (rank, entity.document_id)
+                )
+
+        for (corpus, alias), document_ids in postings.items():
+            self.index.setdefault(corpus, {})[alias] = tuple(
+                sorted(document_ids)
+            )
+
+    def __len__(self) -> int:
+        return sum(len(titles) for titles in self.index.values())
+
+    def lookup(self, text: str, corpus: Optional[str] = None) -> List[str]:
+        normalized = normalize_title(text)
+        if corpus is not None:
+            postings = self.index.get(corpus, {}).get(normalized, ())
+            return [document_id for _, document_id in postings]
+
+        document_ids = []
+        for titles in self.index.values():
+            document_ids.extend(
+                document_id for _, document_id in titles.get(normalized, ())
+            )
+        return document_ids
+
+    def apply_delta(
+        self, delta: EntityDelta, previous: Mapping[str, Entity]
+    ) -> "TitleIndex":
+        # Returns an updated copy; only the worlds touched by the delta are
+        # copied, the others are shared with this index. previous maps the
+        # changed ids to their entities before the delta.
+        index = dict(self.index)
+        copied = set()
+
+        def titles(corpus: str) -> Dict[str, Tuple[Tuple[int, str], ...]]:
+            if corpus not in copied:
+                index[corpus] = dict(index.get(corpus, {}))
+                copied.add(corpus)
+            return index[corpus]
+
+        for document_id in delta.changed_ids():
+            if document_id not in previous:
+                continue
+            entity = previous[document_id]
+            corpus_titles = titles(entity.corpus or "")
+            for alias in title_aliases(entity.title):
+                postings = tuple(
+                    posting
+                    for posting in corpus_titles.get(alias, ())
+                    if posting[1] != document_id
+                )
+                if postings:
+                    corpus_titles[alias] = postings
+                else:
+                    corpus_titles.pop(alias, None)
+
+        upserts = {entity.document_id: entity for entity in delta.upserts}
+        for entity in upserts.values():
+            corpus_titles = titles(entity.corpus or "")
+            for rank, alias in enumerate(title_aliases(entity.title)):
+                corpus_titles[alias] = tuple(
+                    sorted(
+                        set(corpus_titles.get(alias, ()))
+                        | {(rank, entity.document_id)}
+                    )
+                )
+
+        title_index = TitleIndex([])
+        title_index.index = index
+        return title_index
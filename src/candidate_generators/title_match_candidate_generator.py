@@ -0,0 +1,84 @@
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.candidate_generators.title_index import TitleIndex
+from src.data.delta import EntityDelta, entity_snapshot
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+
+class TitleMatchCandidateGenerator(BaseCandidateEntityGenerator):
+    def __init__(
+        self,
+        entity_dict: Dict[str, Entity],
+        candidate_generator: Optional[BaseCandidateEntityGenerator] = None,
+        top_k: Optional[int] = None,
+        short_circuit: bool = False,
+        title_index: Optional[TitleIndex] = None,
+    ):
+        BaseCandidateEntityGenerator.__init__(self, entity_dict)
+        self.candidate_generator = candidate_generator
+        self.top_k = top_k
+        if self.top_k is None and candidate_generator is not None:
+            self.top_k = getattr(candidate_generator, "top_k", None)
+        # With short_circuit, mentions that exactly match a title in their
+        # world never reach the wrapped generator
+        self.short_circuit = short_circuit
+        # Entities and the title index over them, swapped together by
+        # apply_delta
+        self.state: Tuple[Mapping[str, Entity], TitleIndex] = (
+            entity_snapshot(entity_dict),
+            title_index or TitleIndex(entity_dict.values()),
+        )
+        self.exact_matches = 0
+
+    @property
+    def title_index(self) -> TitleIndex:
+        return self.state[1]
+
+    def apply_delta(self, delta: EntityDelta):
+        previous, title_index = self.state
+        self.state = (
+            entity_snapshot(self.entity_dict),
+            title_index.apply_delta(delta, previous),
+        )
+        if self.candidate_generator is not None:
+            self.candidate_generator.apply_delta(delta)
+
+    def generate(self, mention: Mention) -> List[Entity]:
+        return self.generate_batch([mention])[0]
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        entities, title_index = self.state
+        matches = [
+            title_index.lookup(mention.text, mention.corpus)
+            for mention in mentions
+        ]
+        self.exact_matches += sum(1 for ids in matches if ids)
+
+        rows = list(range(len(mentions)))
+        if self.short_circuit:
+            rows = [row for row in rows if not matches[row]]
+
+        generated: Dict[int, List[Entity]] = {}
+        if self.candidate_generator is not None and rows:
+            generated = dict(
+                zip(
+                    rows,
+                    self.candidate_generator.generate_batch(
+                        [mentions[row] for row in rows]
+                    ),
+                )
+            )
+
+        candidates = []
+        for row, document_ids in enumerate(matches):
+            seen = set(document_ids)
+            candidate_entities = [entities[i] for i in document_ids]
+            for entity in generated.get(row, []):
+                if entity.document_id not in seen:
+                    seen.add(entity.document_id)
+                    candidate_entities.append(entity)
+            candidates.append(candidate_entities[: self.top_k])
+
+        return candidates
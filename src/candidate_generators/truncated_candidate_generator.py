@@ -0,0 +1,33 @@
+from typing import List
+
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.data.delta import EntityDelta
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+
+class TruncatedCandidateGenerator(BaseCandidateEntityGenerator):
+    def __init__(
+        self, candidate_generator: BaseCandidateEntityGenerator, top_k: int
+    ):
+        # Serves the first top_k candidates of a deeper list, so a small-k
+        # pass and a large-k pass can share one (cached) retrieval
+        BaseCandidateEntityGenerator.__init__(
+            self, candidate_generator.entity_dict
+        )
+        self.candidate_generator = candidate_generator
+        self.top_k = top_k
+
+    def generate(self, mention: Mention) -> List[Entity]:
+        return self.candidate_generator.generate(mention)[: self.top_k]
+
+    def generate_batch(self, mentions: List[Mention]) -> List[List[Entity]]:
+        return [
+            candidate_entities[: self.top_k]
+            for candidate_entities in self.candidate_generator.generate_batch(
+                mentions
+            )
+        ]
+
+    def apply_delta(self, delta: EntityDelta):
+        self.candidate_generator.apply_delta(delta)
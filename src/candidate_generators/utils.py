@@ -0,0 +1,126 @@
+import hashlib
+import re
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+import numpy as np
+from src.candidate_generators.base import BaseCandidateEntityGenerator
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Generator attributes that change which candidates are returned. Ones
+# that only trade speed or memory (batch, block and pool sizes) are left
+# out, except chunk_size: under a latency budget, fusion drops children per
+# chunk, and the BM25 index build shares the name.
+GENERATOR_SETTINGS = (
+    "top_k",
+    "path",
+    "filename",
+    "k1",
+    "b",
+    "context_window",
+    "encoder_model",
+    "index_type",
+    "num_clusters",
+    "num_probes",
+    "max_length",
+    "key_type",
+    "entity_length",
+    "title_weight",
+    "short_circuit",
+    "rrf_k",
+    "weights",
+    "latency_budget",
+    "chunk_size",
+    "applied_deltas",
+)
+
+
+def generator_settings(
+    candidate_generator: BaseCandidateEntityGenerator,
+) -> Dict[str, object]:
+    settings: Dict[str, object] = {
+        "name": candidate_generator.__class__.__name__
+    }
+    excluded = getattr(candidate_generator, "excluded_settings", ())
+    for attribute in GENERATOR_SETTINGS:
+        if attribute not in excluded and hasattr(
+            candidate_generator, attribute
+        ):
+            settings[attribute] = getattr(candidate_generator, attribute)
+
+    inner_generator = getattr(candidate_generator, "candidate_generator", None)
+    if inner_generator is not None:
+        settings["candidate_generator"] = generator_settings(inner_generator)
+    for i, child in enumerate(
+        getattr(candidate_generator, "candidate_generators", [])
+    ):
+        settings[f"candidate_generator_{i}"] = generator_settings(child)
+
+    return settings
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def mention_context(
+    mention: Mention, entity_dict: Mapping[str, Entity], window_size: int
+) -> str:
+    if mention.context_document_id not in entity_dict:
+        return mention.text
+
+    tokens = entity_dict[mention.context_document_id].text.split(" ")
+    window_start = max(mention.start_index - window_size, 0)
+    window_end = mention.end_index + window_size + 1
+
+    return " ".join(tokens[window_start:window_end])
+
+
+def group_by_corpus(
+    entities: Iterable[Entity],
+) -> Tuple[List[str], Dict[str, Tuple[int, int]]]:
+    # Orders document ids so that every corpus (world) occupies a
+    # contiguous [start, end) range, which lets retrieval be restricted to
+    # one world by slicing.
+    keys = sorted(
+        (entity.corpus or "", entity.document_id) for entity in entities
+    )
+    document_ids = [document_id for _, document_id in keys]
+
+    corpus_ranges = {}
+    for i, (corpus, _) in enumerate(keys):
+        start, _ = corpus_ranges.get(corpus, (i, i))
+        corpus_ranges[corpus] = (start, i + 1)
+
+    return document_ids, corpus_ranges
+
+
+def content_fingerprint(entities: Mapping[str, Entity], *params) -> str:
+    # Covers what an index is built from, so that an entity whose title,
+    # text or corpus changed under the same id invalidates it
+    sha = hashlib.sha1()
+    for document_id in sorted(entities):
+        entity = entities[document_id]
+        for field in (document_id, entity.corpus or "", entity.title):
+            sha.update(field.encode("utf-8", "surrogatepass"))
+            sha.update(b"\0")
+        sha.update(entity.text.encode("utf-8", "surrogatepass"))
+        sha.update(b"\n")
+    sha.update(repr(params).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition selects the k best of each row in linear time; only
+    # those k are sorted, by descending score and then by index for stable
+    # ties
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+
+    candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.lexsort((candidates, -candidate_scores), axis=-1)
+    return np.take_along_axis(candidates, order, axis=-1)
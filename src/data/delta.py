@@ -0,0 +1,161 @@
+from collections.abc import Mapping
+from dataclasses import asdict, dataclass, field
+import hashlib
+import json
+import threading
+from typing import Dict, FrozenSet, Iterator, List, Set
+
+from src.data.entity import Entity
+from src.data.streams import open_text
+
+
+@dataclass
+class EntityDelta:
+    upserts: List[Entity] = field(default_factory=list)
+    deletes: List[str] = field(default_factory=list)
+
+    def changed_ids(self) -> Set[str]:
+        return {entity.document_id for entity in self.upserts} | set(
+            self.deletes
+        )
+
+    def fingerprint(self) -> str:
+        # Identifies the delta by content, so that caches built after it was
+        # applied are not mistaken for ones built after another delta
+        serialized = json.dumps(
+            {
+                "upserts": [asdict(entity) for entity in self.upserts],
+                "deletes": self.deletes,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha1(
+            serialized.encode("utf-8", "surrogatepass")
+        ).hexdigest()
+
+
+def read_delta(path: str) -> EntityDelta:
+    # One JSON record per line: an entity (with its "corpus") that is added
+    # or replaced, or {"document_id": ..., "deleted": true}
+    delta = EntityDelta()
+    with open_text(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            line_dict = json.loads(line)
+            if line_dict.get("deleted", False):
+                delta.deletes.append(line_dict["document_id"])
+            else:
+                delta.upserts.append(
+                    Entity(
+                        title=line_dict["title"],
+                        text=line_dict["text"],
+                        document_id=line_dict["document_id"],
+                        corpus=line_dict.get("corpus"),
+                    )
+                )
+    return delta
+
+
+class EntitySnapshot(Mapping):
+    def __init__(
+        self,
+        base: Mapping,
+        upserts: Dict[str, Entity],
+        deletes: FrozenSet[str],
+        version: int,
+    ):
+        # Immutable overlay of the upserted and deleted entities on top of
+        # the base entities; deletes only ever name base entities
+        self.base = base
+        self.upserts = upserts
+        self.deletes = deletes
+        self.version = version
+        self.num_entities = (
+            len(base) - len(deletes) + sum(1 for i in upserts if i not in base)
+        )
+
+    def __getitem__(self, document_id: str) -> Entity:
+        entity = self.upserts.get(document_id)
+        if entity is not None:
+            return entity
+        if document_id in self.deletes:
+            raise KeyError(document_id)
+        return self.base[document_id]
+
+    def __contains__(self, document_id) -> bool:
+        if document_id in self.upserts:
+            return True
+        return document_id not in self.deletes and document_id in self.base
+
+    def __iter__(self) -> Iterator[str]:
+        for document_id in self.base:
+            if document_id not in self.deletes and (
+                document_id not in self.upserts
+            ):
+                yield document_id
+        yield from self.upserts
+
+    def __len__(self) -> int:
+        return self.num_entities
+
+
+class VersionedEntityDict(Mapping):
+    def __init__(self, entity_dict: Mapping):
+        self.current = EntitySnapshot(entity_dict, {}, frozenset(), 0)
+        self.lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self.current.version
+
+    def snapshot(self) -> EntitySnapshot:
+        # Readers that need a consistent view across several lookups hold
+        # on to a snapshot; later deltas do not affect it
+        return self.current
+
+    def apply(self, delta: EntityDelta) -> int:
+        with self.lock:
+            current = self.current
+            upserts = dict(current.upserts)
+            deletes = set(current.deletes)
+
+            for document_id in delta.deletes:
+                upserts.pop(document_id, None)
+                if document_id in current.base:
+                    deletes.add(document_id)
+
+            for entity in delta.upserts:
+                upserts[entity.document_id] = entity
+                deletes.discard(entity.document_id)
+
+            # A single assignment publishes the new version
+            self.current = EntitySnapshot(
+                current.base, upserts, frozenset(deletes), current.version + 1
+            )
+            return self.current.version
+
+    def __getitem__(self, document_id: str) -> Entity:
+        return self.current[document_id]
+
+    def __contains__(self, document_id) -> bool:
+        return document_id in self.current
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.current)
+
+    def __len__(self) -> int:
+        return len(self.current)
+
+    def __getstate__(self):
+        return {"current": self.current}
+
+    def __setstate__(self, state):
+        self.current = state["current"]
+        self.lock = threading.Lock()
+
+
+def entity_snapshot(entity_dict: Mapping) -> Mapping:
+    if isinstance(entity_dict, VersionedEntityDict):
+        return entity_dict.snapshot()
+    return entity_dict
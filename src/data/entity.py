@@ -1,7 +1,26 @@
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 import os
 import json
-from typing import Dict
+import mmap
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.data.snapshot import (
+    read_snapshot,
+    source_fingerprint,
+    write_snapshot,
+)
+from src.data.streams import (
+    is_archive_path,
+    is_streamed,
+    iter_archive,
+    open_text,
+    split_archive_path,
+)
+
+DOCUMENT_ID_PATTERN = re.compile(rb'"document_id":\s*"([^"\\]*)"')
 
 
 @dataclass
@@ -9,19 +28,201 @@ class Entity:
     title: str
     text: str
     document_id: str
+    corpus: Optional[str] = None
+
+
+def corpus_name(path: str) -> str:
+    # zeshel stores one world per file, e.g. documents/star_trek.json
+    return os.path.basename(path).split(".")[0]
+
+
+class EntityStore(Mapping):
+    def __init__(self, paths: List[str]):
+        self.paths = paths
+        self.index: Dict[str, Tuple[int, int, int]] = {}
+        self.buffers: List[mmap.mmap] = []
+        self.open_buffers()
+        self.build_index()
+
+    def open_buffers(self):
+        for path in self.paths:
+            if is_streamed(path):
+                raise ValueError(f"{path} is compressed and cannot be mmap'd")
+
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self.buffers.append(None)
+                    continue
+                # The mapping stays valid after the file object is closed
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffers.append(buffer)
+
+    def build_index(self):
+        for file_idx, buffer in enumerate(self.buffers):
+            if buffer is None:
+                continue
+
+            offset = 0
+            size = len(buffer)
+            while offset < size:
+                end = buffer.find(b"\n", offset)
+                if end == -1:
+                    end = size
+
+                line = buffer[offset:end]
+                if line.strip():
+                    document_id = self.parse_document_id(line)
+                    self.index[document_id] = (file_idx, offset, end - offset)
+
+                offset = end + 1
+
+    @staticmethod
+    def parse_document_id(line: bytes) -> str:
+        # Avoid decoding the full document text just to find its id
+        match = DOCUMENT_ID_PATTERN.search(line)
+        if match is not None:
+            return match.group(1).decode("utf-8")
+        return json.loads(line)["document_id"]
+
+    def __getitem__(self, document_id: str) -> Entity:
+        file_idx, offset, length = self.index[document_id]
+        line = self.buffers[file_idx][offset : offset + length]
+        return Entity(
+            **json.loads(line), corpus=corpus_name(self.paths[file_idx])
+        )
+
+    def __contains__(self, document_id) -> bool:
+        return document_id in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getstate__(self):
+        return {"paths": self.paths, "index": self.index}
+
+    def __setstate__(self, state):
+        self.paths = state["paths"]
+        self.index = state["index"]
+        self.buffers = []
+        self.open_buffers()
+
+    def close(self):
+        for buffer in self.buffers:
+            if buffer is not None:
+                buffer.close()
+        self.buffers = []
 
 
 class EntityReader:
-    def __init__(self, path):
+    def __init__(
+        self,
+        path,
+        use_snapshots: bool = True,
+        num_workers: int = 1,
+        corpora: Optional[Iterable[str]] = None,
+    ):
         self.path = path
+        self.use_snapshots = use_snapshots
+        self.num_workers = num_workers
+        self.corpora = set(corpora) if corpora is not None else None
+        self.snapshot_dir = path.rstrip(os.sep) + ".snapshots"
+
+    def corpus_files(self) -> Dict[str, str]:
+        return {
+            corpus_name(filename): os.path.join(self.path, filename)
+            for filename in sorted(os.listdir(self.path))
+        }
+
+    def files(self) -> List[str]:
+        return [
+            filename
+            for corpus, filename in self.corpus_files().items()
+            if self.corpora is None or corpus in self.corpora
+        ]
+
+    def snapshot_path(self, filename: str) -> str:
+        return os.path.join(
+            self.snapshot_dir, os.path.basename(filename) + ".snap"
+        )
+
+    def parse_file(self, filename: str) -> List[Entity]:
+        corpus = corpus_name(filename)
+        with open_text(filename) as f:
+            return [Entity(**json.loads(line), corpus=corpus) for line in f]
+
+    def read_file(self, filename: str) -> List[Entity]:
+        if not self.use_snapshots:
+            return self.parse_file(filename)
+
+        snapshot_path = self.snapshot_path(filename)
+        fingerprint = source_fingerprint(filename)
+
+        records = read_snapshot(snapshot_path, fingerprint)
+        if records is not None:
+            corpus = corpus_name(filename)
+            return [Entity(*record, corpus=corpus) for record in records]
+
+        entities = self.parse_file(filename)
+        records = [
+            (entity.title, entity.text, entity.document_id)
+            for entity in entities
+        ]
+        try:
+            write_snapshot(snapshot_path, fingerprint, records, width=3)
+        except (OSError, ValueError):
+            # A read-only data directory only costs us the cache
+            pass
+
+        return entities
+
+    def iter_archive(self):
+        # Archives are streamed member by member in archive order, without
+        # snapshots or worker processes.
+        archive_path, prefix = split_archive_path(self.path)
+        for filename, f in iter_archive(archive_path, prefix):
+            corpus = corpus_name(filename)
+            if self.corpora is not None and corpus not in self.corpora:
+                continue
+
+            for line in f:
+                yield Entity(**json.loads(line), corpus=corpus)
 
     def __iter__(self):
-        for filename in os.listdir(self.path):
-            with open(os.path.join(self.path, filename), "r") as f:
-                for line in f:
-                    entity_dict = json.loads(line)
-                    entity = Entity(**entity_dict)
-                    yield entity
+        if is_archive_path(self.path):
+            yield from self.iter_archive()
+            return
+
+        filenames = self.files()
+
+        if self.num_workers <= 1 or len(filenames) <= 1:
+            for filename in filenames:
+                yield from self.read_file(filename)
+            return
+
+        # map() yields results in submission order, so the merged output
+        # is identical to the sequential one
+        num_workers = min(self.num_workers, len(filenames))
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            for entities in executor.map(self.read_file, filenames):
+                yield from entities
+
+    def fingerprint(self) -> Dict[str, Dict[str, int]]:
+        # Identifies the files the entities are read from, so that caches
+        # of anything derived from them can be invalidated
+        if is_archive_path(self.path):
+            archive_path, _ = split_archive_path(self.path)
+            return {self.path: source_fingerprint(archive_path)}
+        return {
+            filename: source_fingerprint(filename) for filename in self.files()
+        }
 
     def read_all(self) -> Dict[str, Entity]:
         return {entity.document_id: entity for entity in self}
+
+    def read_store(self) -> EntityStore:
+        if is_archive_path(self.path):
+            raise ValueError(f"{self.path} is an archive and cannot be mmap'd")
+        return EntityStore(self.files())
@@ -1,6 +1,12 @@
+from collections.abc import Sequence
 from dataclasses import dataclass
 import json
-from typing import List
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+
+import numpy as np
+from src.data.snapshot import source_fingerprint
+from src.data.streams import is_streamed, open_text, split_archive_path
 
 
 @dataclass
@@ -15,17 +21,255 @@ class Mention:
     end_index: int
 
 
+class PackedStrings(Sequence):
+    # Strings stored as one UTF-8 buffer plus byte offsets, instead of one
+    # Python object per string; items are decoded when accessed
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_buffer(
+        cls, buffer: bytearray, offsets: List[int]
+    ) -> "PackedStrings":
+        return cls(
+            np.frombuffer(bytes(buffer), dtype=np.uint8),
+            np.array(offsets, dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("string index out of range")
+
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return (
+            self.buffer[start:end].tobytes().decode("utf-8", "surrogatepass")
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, indices: np.ndarray) -> "PackedStrings":
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[:-1][indices]
+        lengths = self.offsets[1:][indices] - starts
+
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Position of every gathered byte in the source buffer
+        positions = np.arange(offsets[-1], dtype=np.int64) + np.repeat(
+            starts - offsets[:-1], lengths
+        )
+
+        return PackedStrings(self.buffer[positions], offsets)
+
+
+class MentionStore(Sequence):
+    def __init__(
+        self,
+        texts: PackedStrings,
+        mention_ids: PackedStrings,
+        categories: List[str],
+        category_codes: np.ndarray,
+        corpora: List[str],
+        corpus_codes: np.ndarray,
+        document_ids: List[str],
+        context_document_codes: np.ndarray,
+        label_document_codes: np.ndarray,
+        start_indices: np.ndarray,
+        end_indices: np.ndarray,
+    ):
+        self.texts = texts
+        self.mention_ids = mention_ids
+        self.categories = categories
+        self.category_codes = category_codes
+        self.corpora = corpora
+        self.corpus_codes = corpus_codes
+        self.document_ids = document_ids
+        self.context_document_codes = context_document_codes
+        self.label_document_codes = label_document_codes
+        self.start_indices = start_indices
+        self.end_indices = end_indices
+
+    @classmethod
+    def from_mentions(cls, mentions: Iterable[Mention]) -> "MentionStore":
+        texts, mention_ids = bytearray(), bytearray()
+        text_offsets, mention_id_offsets = [0], [0]
+        categories: Dict[str, int] = {}
+        corpora: Dict[str, int] = {}
+        document_ids: Dict[str, int] = {}
+        category_codes, corpus_codes = [], []
+        context_document_codes, label_document_codes = [], []
+        start_indices, end_indices = [], []
+
+        for mention in mentions:
+            texts += mention.text.encode("utf-8", "surrogatepass")
+            text_offsets.append(len(texts))
+            mention_ids += mention.mention_id.encode("utf-8", "surrogatepass")
+            mention_id_offsets.append(len(mention_ids))
+            category_codes.append(
+                categories.setdefault(mention.category, len(categories))
+            )
+            corpus_codes.append(
+                corpora.setdefault(mention.corpus, len(corpora))
+            )
+            context_document_codes.append(
+                document_ids.setdefault(
+                    mention.context_document_id, len(document_ids)
+                )
+            )
+            label_document_codes.append(
+                document_ids.setdefault(
+                    mention.label_document_id, len(document_ids)
+                )
+            )
+            start_indices.append(mention.start_index)
+            end_indices.append(mention.end_index)
+
+        return cls(
+            texts=PackedStrings.from_buffer(texts, text_offsets),
+            mention_ids=PackedStrings.from_buffer(
+                mention_ids, mention_id_offsets
+            ),
+            categories=list(categories),
+            category_codes=np.array(category_codes, dtype=np.int32),
+            corpora=list(corpora),
+            corpus_codes=np.array(corpus_codes, dtype=np.int32),
+            document_ids=list(document_ids),
+            context_document_codes=np.array(
+                context_document_codes, dtype=np.int32
+            ),
+            label_document_codes=np.array(
+                label_document_codes, dtype=np.int32
+            ),
+            start_indices=np.array(start_indices, dtype=np.int32),
+            end_indices=np.array(end_indices, dtype=np.int32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.mention_ids)
+
+    def __getitem__(self, idx) -> Union[Mention, "MentionStore"]:
+        if isinstance(idx, slice):
+            return self.select(np.arange(len(self))[idx])
+
+        return Mention(
+            category=self.categories[self.category_codes[idx]],
+            text=self.texts[idx],
+            context_document_id=self.document_ids[
+                self.context_document_codes[idx]
+            ],
+            label_document_id=self.document_ids[
+                self.label_document_codes[idx]
+            ],
+            mention_id=self.mention_ids[idx],
+            corpus=self.corpora[self.corpus_codes[idx]],
+            start_index=int(self.start_indices[idx]),
+            end_index=int(self.end_indices[idx]),
+        )
+
+    def select(self, indices: np.ndarray) -> "MentionStore":
+        # The vocabularies are shared; only the per-mention columns are
+        # gathered.
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+
+        return MentionStore(
+            texts=self.texts.take(indices),
+            mention_ids=self.mention_ids.take(indices),
+            categories=self.categories,
+            category_codes=self.category_codes[indices],
+            corpora=self.corpora,
+            corpus_codes=self.corpus_codes[indices],
+            document_ids=self.document_ids,
+            context_document_codes=self.context_document_codes[indices],
+            label_document_codes=self.label_document_codes[indices],
+            start_indices=self.start_indices[indices],
+            end_indices=self.end_indices[indices],
+        )
+
+    def corpus_mask(self, corpus: str) -> np.ndarray:
+        if corpus not in self.corpora:
+            return np.zeros(len(self), dtype=bool)
+        return self.corpus_codes == self.corpora.index(corpus)
+
+    def filter_corpus(self, corpus: str) -> "MentionStore":
+        return self.select(self.corpus_mask(corpus))
+
+
 class MentionReader:
-    def __init__(self, path):
+    def __init__(self, path, start: int = 0, end: Optional[int] = None):
         self.path = path
-        self.x = 1
+        self.start = start
+        self.end = end
+
+    def shard(self, index: int, count: int) -> "MentionReader":
+        if not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index} of {count}")
+        if is_streamed(self.path):
+            raise ValueError(
+                f"{self.path} is compressed and cannot be sharded"
+            )
+
+        start = self.start
+        end = self.end if self.end is not None else os.path.getsize(self.path)
+        size = end - start
+
+        return MentionReader(
+            self.path,
+            start=start + size * index // count,
+            end=start + size * (index + 1) // count,
+        )
 
     def __iter__(self):
-        with open(self.path, "r") as f:
-            for line in f:
+        if is_streamed(self.path):
+            with open_text(self.path) as f:
+                for line in f:
+                    mention_dict = json.loads(line)
+                    mention = Mention(**mention_dict)
+                    yield mention
+            return
+
+        # A line belongs to the byte range that contains its first byte, so
+        # shards of the same file never overlap or skip a line.
+        with open(self.path, "rb") as f:
+            end = self.end
+            if end is None:
+                end = os.fstat(f.fileno()).st_size
+
+            position = self.start
+            if position > 0:
+                f.seek(position - 1)
+                position += len(f.readline()) - 1
+
+            while position < end:
+                line = f.readline()
+                if not line:
+                    break
+                position += len(line)
+
                 mention_dict = json.loads(line)
                 mention = Mention(**mention_dict)
                 yield mention
 
-    def read_all(self) -> List[Mention]:
-        return [mention for mention in self]
+    def corpora(self) -> Set[str]:
+        return {mention.corpus for mention in self}
+
+    def fingerprint(self) -> Dict[str, object]:
+        source_path, _ = split_archive_path(self.path)
+        return {
+            "path": os.path.abspath(self.path),
+            "start": self.start,
+            "end": self.end,
+            **source_fingerprint(source_path),
+        }
+
+    def read_all(self) -> MentionStore:
+        return MentionStore.from_mentions(self)
@@ -0,0 +1,101 @@
+from array import array
+import json
+import os
+import struct
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+MAGIC = b"SNAP"
+VERSION = 1
+HEADER = struct.Struct("<4sII")
+# Lone surrogates, which json.loads accepts, are stored as is
+ENCODING_ERRORS = "surrogatepass"
+
+
+def source_fingerprint(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_snapshot(
+    path: str,
+    fingerprint: Dict[str, int],
+    records: Sequence[Tuple[str, ...]],
+    width: int,
+):
+    # Strings are stored as one packed UTF-8 blob plus character offsets,
+    # so loading is a single decode followed by slicing.
+    strings = [string for record in records for string in record]
+
+    offsets = array("Q", [0])
+    position = 0
+    for string in strings:
+        position += len(string)
+        offsets.append(position)
+
+    metadata = json.dumps(
+        {
+            "fingerprint": fingerprint,
+            "width": width,
+            "count": len(strings),
+            "byteorder": sys.byteorder,
+        }
+    ).encode("utf-8")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(metadata)))
+            f.write(metadata)
+            f.write(offsets.tobytes())
+            f.write("".join(strings).encode("utf-8", ENCODING_ERRORS))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_snapshot(
+    path: str, fingerprint: Dict[str, int]
+) -> Optional[List[Tuple[str, ...]]]:
+    if not os.path.isfile(path):
+        return None
+
+    # A truncated or corrupt snapshot is a cache miss, like a stale one
+    try:
+        with open(path, "rb") as f:
+            magic, version, metadata_length = HEADER.unpack(
+                f.read(HEADER.size)
+            )
+            if magic != MAGIC or version != VERSION:
+                return None
+
+            metadata = json.loads(f.read(metadata_length))
+            if (
+                metadata["fingerprint"] != fingerprint
+                or metadata["byteorder"] != sys.byteorder
+            ):
+                return None
+
+            count = metadata["count"]
+            width = metadata["width"]
+            offsets = array("Q")
+            offsets.frombytes(f.read(offsets.itemsize * (count + 1)))
+            blob = f.read().decode("utf-8", ENCODING_ERRORS)
+
+        if (
+            width <= 0
+            or count % width != 0
+            or len(offsets) != count + 1
+            or offsets[0] != 0
+            or offsets[-1] != len(blob)
+        ):
+            return None
+    except (struct.error, ValueError, KeyError, TypeError):
+        return None
+
+    strings = [blob[offsets[i] : offsets[i + 1]] for i in range(count)]
+
+    return list(zip(*[iter(strings)] * width))
@@ -0,0 +1,117 @@
+import bz2
+from contextlib import contextmanager
+import gzip
+import io
+import lzma
+import os
+import tarfile
+from typing import Iterator, Optional, TextIO, Tuple
+
+# "data.tar.bz2::data/mentions/val.json" names a member inside an archive
+ARCHIVE_SEPARATOR = "::"
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+COMPRESSED_OPENERS = {
+    ".gz": gzip.GzipFile,
+    ".bz2": bz2.BZ2File,
+    ".xz": lzma.LZMAFile,
+}
+
+
+def split_archive_path(path: str) -> Tuple[str, Optional[str]]:
+    if ARCHIVE_SEPARATOR not in path:
+        return path, None
+    archive_path, member_name = path.split(ARCHIVE_SEPARATOR, 1)
+    return archive_path, normalize_member_name(member_name)
+
+
+def normalize_member_name(name: str) -> str:
+    name = name.replace(os.sep, "/")
+    while name.startswith("./"):
+        name = name[2:]
+    return name.strip("/")
+
+
+def is_archive_path(path: str) -> bool:
+    return ARCHIVE_SEPARATOR in path
+
+
+def is_compressed(path: str) -> bool:
+    return os.path.splitext(path)[1] in COMPRESSED_OPENERS
+
+
+def is_streamed(path: str) -> bool:
+    return is_archive_path(path) or is_compressed(path)
+
+
+class RawReader(io.RawIOBase):
+    # Adapts decompressor and tar member streams, which do not all implement
+    # the full io interface, so they can be wrapped in a BufferedReader.
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def wrap_text(stream, buffer_size: int = DEFAULT_BUFFER_SIZE) -> TextIO:
+    # The buffer bounds how much decompressed data is read ahead
+    return io.TextIOWrapper(
+        io.BufferedReader(RawReader(stream), buffer_size), encoding="utf-8"
+    )
+
+
+@contextmanager
+def open_text(
+    path: str, buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> Iterator[TextIO]:
+    archive_path, member_name = split_archive_path(path)
+
+    if member_name is not None:
+        members = iter_archive(archive_path, member_name, buffer_size)
+        try:
+            for name, f in members:
+                if name == member_name:
+                    yield f
+                    return
+        finally:
+            # Closes the archive without waiting for garbage collection of
+            # the suspended generator
+            members.close()
+        raise FileNotFoundError(f"{member_name} not found in {archive_path}")
+
+    extension = os.path.splitext(path)[1]
+    if extension in COMPRESSED_OPENERS:
+        with COMPRESSED_OPENERS[extension](path, "rb") as raw:
+            yield wrap_text(raw, buffer_size)
+        return
+
+    with open(path, "r") as f:
+        yield f
+
+
+def iter_archive(
+    archive_path: str,
+    prefix: str = "",
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+) -> Iterator[Tuple[str, TextIO]]:
+    # Stream mode ("r|*") reads the archive front to back without seeking,
+    # so members are yielded in archive order and must be consumed before
+    # advancing to the next one.
+    prefix = normalize_member_name(prefix)
+
+    with tarfile.open(archive_path, "r|*", bufsize=buffer_size) as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+
+            name = normalize_member_name(member.name)
+            if prefix and name != prefix and not name.startswith(prefix + "/"):
+                continue
+
+            yield name, wrap_text(tar.extractfile(member), buffer_size)
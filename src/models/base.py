@@ -15,3 +15,12 @@ class BasePreprocessor(ABC):
         self, mention: Mention, candidate_entities: List[Entity]
     ) -> Any:
         pass
+
+    def preprocess_batch(
+        self, mentions: List[Mention], candidates: List[List[Entity]]
+    ) -> List[Any]:
+        # Preprocessors that can encode many samples at once override this
+        return [
+            self.preprocess(mention, candidate_entities)
+            for mention, candidate_entities in zip(mentions, candidates)
+        ]
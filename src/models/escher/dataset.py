@@ -1,11 +1,86 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import torch
 from src.candidate_generators.base import BaseCandidateEntityGenerator
-from src.data.mention import MentionReader
+from src.candidate_generators.utils import generator_settings
+from src.data.entity import Entity
+from src.data.mention import Mention, MentionReader, MentionStore
+from src.data.streams import is_streamed
 from src.models.base import BasePreprocessor
-from src.models.escher.esc.esc_dataset import QAExtractiveDataset
+from src.models.escher.dataset_cache import DatasetCache
+from src.models.escher.esc.esc_dataset import DataElement, QAExtractiveDataset
+from src.models.escher.esc.utils.commons import count_lines_in_file
 from src.models.escher.esc.utils.definitions_tokenizer import (
     DefinitionsTokenizer,
     get_tokenizer,
 )
+from torch.utils.data import get_worker_info
+
+# Set in each preprocessing worker; with fork, the preprocessor (and its
+# tokenizer) and the entities are the parent's, shared copy-on-write
+worker_preprocessor: Optional[BasePreprocessor] = None
+worker_entity_dict: Optional[Mapping[str, Entity]] = None
+
+
+def init_preprocessing_worker(
+    preprocessor: BasePreprocessor, entity_dict: Mapping[str, Entity]
+):
+    global worker_preprocessor, worker_entity_dict
+    worker_preprocessor = preprocessor
+    worker_entity_dict = entity_dict
+
+
+def to_numpy(data_element: DataElement) -> DataElement:
+    # Tensors sent between processes go through shared memory, one file
+    # descriptor each; arrays are pickled by value instead
+    token_type_ids = data_element.token_type_ids
+    if token_type_ids is not None:
+        token_type_ids = token_type_ids.numpy()
+    return data_element._replace(
+        encoded_final_sequence=data_element.encoded_final_sequence.numpy(),
+        token_type_ids=token_type_ids,
+    )
+
+
+def from_numpy(data_element: DataElement) -> DataElement:
+    token_type_ids = data_element.token_type_ids
+    if token_type_ids is not None:
+        token_type_ids = torch.from_numpy(token_type_ids)
+    return data_element._replace(
+        encoded_final_sequence=torch.from_numpy(
+            data_element.encoded_final_sequence
+        ),
+        token_type_ids=token_type_ids,
+    )
+
+
+def preprocess_chunk(
+    chunk: List[Tuple[Mention, List[str]]],
+) -> List[Optional[DataElement]]:
+    data_elements = worker_preprocessor.preprocess_batch(
+        [mention for mention, _ in chunk],
+        [
+            [worker_entity_dict[document_id] for document_id in document_ids]
+            for _, document_ids in chunk
+        ],
+    )
+    return [
+        to_numpy(data_element) if data_element is not None else None
+        for data_element in data_elements
+    ]
 
 
 class EscherDataset(QAExtractiveDataset):
@@ -17,9 +92,15 @@ class EscherDataset(QAExtractiveDataset):
         re_init_on_iter: bool,
         preprocessor: BasePreprocessor,
         candidate_generator: BaseCandidateEntityGenerator,
-        mention_reader: MentionReader,
+        mention_reader: Union[MentionReader, MentionStore],
         tokenizer: DefinitionsTokenizer = None,
         is_test: bool = False,
+        generation_batch_size: int = 256,
+        preprocessing_workers: int = 0,
+        cache_dir: Optional[str] = None,
+        cache_settings: Optional[Dict[str, object]] = None,
+        stream: bool = False,
+        stream_buffer_size: int = 8192,
     ) -> None:
         if tokenizer is None:
             tokenizer = get_tokenizer("facebook/bart-large", False)
@@ -28,14 +109,250 @@ class EscherDataset(QAExtractiveDataset):
         self.preprocessor = preprocessor
         self.mention_reader = mention_reader
         self.candidate_generator = candidate_generator
+        self.generation_batch_size = generation_batch_size
+        self.preprocessing_workers = preprocessing_workers
+        # Settings the dataset cannot see itself, e.g. where the entities
+        # were read from, that are part of the cache key
+        self.cache_dir = cache_dir
+        self.cache_settings = cache_settings or {}
+        # When streaming, mentions are preprocessed as batches are consumed
+        # and at most stream_buffer_size elements are held at a time
+        self.stream = stream
+        self.stream_buffer_size = stream_buffer_size
+        self.shard = (0, 1)
+        # Preprocessing workers are kept across epochs, so that the entity
+        # tokens and word offsets they cached are reused
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.executor_version: Optional[int] = None
+
+    @staticmethod
+    def current_shard() -> Tuple[int, int]:
+        worker_info = get_worker_info()
+        if worker_info is None:
+            return 0, 1
+        return worker_info.id, worker_info.num_workers
+
+    def shard_mention_reader(self) -> Union[MentionReader, MentionStore]:
+        self.shard = self.current_shard()
+
+        mention_reader = self.mention_reader
+        if self.shard != (0, 1):
+            index, count = self.shard
+            if isinstance(mention_reader, MentionReader):
+                mention_reader = mention_reader.shard(index, count)
+            elif isinstance(mention_reader, MentionStore):
+                mention_reader = mention_reader[index::count]
+
+        return mention_reader
 
     def init_dataset(self):
         self.data_store = []
         self.mentions = []
-        for mention in self.mention_reader:
-            candidate_entities = self.candidate_generator.generate(mention)
-            data_element = self.preprocessor.preprocess(
-                mention, candidate_entities
-            )
+        mention_reader = self.shard_mention_reader()
+
+        dataset_cache = self.dataset_cache(mention_reader)
+        if dataset_cache is not None:
+            data_store = dataset_cache.read()
+            if data_store is not None:
+                self.data_store = data_store
+                return
+
+        for data_element in self.preprocess(mention_reader):
             if data_element is not None:
                 self.data_store.append(data_element)
+
+        if dataset_cache is not None:
+            dataset_cache.write(self.data_store)
+
+    def dataset_cache(
+        self, mention_reader: Union[MentionReader, MentionStore]
+    ) -> Optional[DatasetCache]:
+        # Only splits read from a file can be recognized across runs
+        if self.cache_dir is None or not isinstance(
+            mention_reader, MentionReader
+        ):
+            return None
+
+        tokenizer = getattr(self.preprocessor, "tokenizer", self.tokenizer)
+        settings = {
+            "split": mention_reader.fingerprint(),
+            "preprocessor": self.preprocessor.__class__.__name__,
+            "mention_window_size": getattr(
+                self.preprocessor, "mention_window_size", None
+            ),
+            "entity_length": getattr(self.preprocessor, "entity_length", None),
+            "max_tokens": getattr(self.preprocessor, "max_tokens", None),
+            "tokenizer": {
+                "transformer_model": tokenizer.transformer_model,
+                "use_special_tokens": tokenizer.use_special_tokens,
+                "size": len(tokenizer),
+            },
+            "candidate_generator": generator_settings(
+                self.candidate_generator
+            ),
+            "entity_version": getattr(
+                self.candidate_generator.entity_dict, "version", None
+            ),
+            **self.cache_settings,
+        }
+
+        return DatasetCache(self.cache_dir, settings)
+
+    def candidate_batches(
+        self, mention_reader: Union[MentionReader, MentionStore]
+    ) -> Iterator[Tuple[List[Mention], List[List[Entity]]]]:
+        mention_iterator = iter(mention_reader)
+        while True:
+            mentions = list(
+                islice(mention_iterator, self.generation_batch_size)
+            )
+            if not mentions:
+                break
+
+            yield mentions, self.candidate_generator.generate_batch(mentions)
+
+    def preprocess(
+        self, mention_reader: Union[MentionReader, MentionStore]
+    ) -> Iterator[Optional[DataElement]]:
+        batches = self.candidate_batches(mention_reader)
+        if self.use_preprocessing_pool():
+            return self.preprocess_parallel(batches)
+        return self.preprocess_serial(batches)
+
+    def use_preprocessing_pool(self) -> bool:
+        # DataLoader workers are daemonic and cannot start a pool of their
+        # own; they build their shard serially
+        return (
+            self.preprocessing_workers > 1
+            and get_worker_info() is None
+            and "fork" in multiprocessing.get_all_start_methods()
+        )
+
+    def preprocess_serial(
+        self, batches: Iterator[Tuple[List[Mention], List[List[Entity]]]]
+    ) -> Iterator[Optional[DataElement]]:
+        for mentions, candidates in batches:
+            yield from self.preprocessor.preprocess_batch(mentions, candidates)
+
+    def preprocess_parallel(
+        self, batches: Iterator[Tuple[List[Mention], List[List[Entity]]]]
+    ) -> Iterator[Optional[DataElement]]:
+        # Candidates are generated here, batch by batch, while the workers
+        # window and tokenize earlier batches. Only document ids are sent;
+        # results are collected in submission order, so the data store is
+        # identical to the serial one.
+        executor = self.preprocessing_executor()
+        pending = deque()
+        for mentions, candidates in batches:
+            chunk = [
+                (
+                    mention,
+                    [entity.document_id for entity in candidate_entities],
+                )
+                for mention, candidate_entities in zip(mentions, candidates)
+            ]
+            pending.append(executor.submit(preprocess_chunk, chunk))
+
+            # Bounds the number of batches held in memory
+            while len(pending) > 2 * self.preprocessing_workers:
+                yield from self.collect(pending.popleft().result())
+
+        while pending:
+            yield from self.collect(pending.popleft().result())
+
+    def preprocessing_executor(self) -> ProcessPoolExecutor:
+        # Workers hold the entities as they were when forked; after a delta
+        # they are replaced, otherwise the same workers serve every epoch
+        entity_dict = self.candidate_generator.entity_dict
+        version = getattr(entity_dict, "version", None)
+        if self.executor is not None and self.executor_version != version:
+            self.close()
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.preprocessing_workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=init_preprocessing_worker,
+                initargs=(self.preprocessor, entity_dict),
+            )
+            self.executor_version = version
+        return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+            self.executor_version = None
+
+    def __getstate__(self):
+        # DataLoader workers build their shard serially and never use the
+        # pool, which cannot be pickled
+        state = self.__dict__.copy()
+        state["executor"] = None
+        state["executor_version"] = None
+        return state
+
+    @staticmethod
+    def collect(
+        data_elements: List[Optional[DataElement]],
+    ) -> Iterator[Optional[DataElement]]:
+        for data_element in data_elements:
+            if data_element is not None:
+                data_element = from_numpy(data_element)
+            yield data_element
+
+    def stream_batches(self) -> Iterator[Dict[str, Any]]:
+        # Elements are sorted by length (and shuffled in chunks when
+        # training) within each buffer instead of across the whole split
+        buffer = []
+        for data_element in self.preprocess(self.shard_mention_reader()):
+            if data_element is None or not self.is_within_limits(data_element):
+                continue
+
+            buffer.append(data_element)
+            if len(buffer) >= self.stream_buffer_size:
+                yield from self.batches(self.sort_elements(buffer))
+                buffer = []
+
+        if buffer:
+            yield from self.batches(self.sort_elements(buffer))
+
+    def __iter__(self):
+        if self.stream:
+            return self.stream_batches()
+
+        # Each DataLoader worker holds a copy of the dataset. A store the
+        # main process built for the whole split is sliced rather than
+        # preprocessed again; one built for another shard is discarded so
+        # that workers only preprocess their own slice.
+        shard = self.current_shard()
+        if self.shard != shard:
+            if self.shard == (0, 1) and len(self.data_store) > 0:
+                index, count = shard
+                self.data_store = self.data_store[index::count]
+                self.shard = shard
+                if len(self.data_store) == 0:
+                    return iter(())
+            else:
+                self.data_store = []
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        if not self.stream and len(self.data_store) > 0:
+            return len(self.data_store)
+
+        # Number of mentions, without preprocessing them, so that asking for
+        # the length (e.g. for a progress bar) does not build the whole
+        # store in the main process before DataLoader workers build their
+        # shards again; an upper bound, since mentions whose gold entity is
+        # not retrieved are skipped
+        mention_reader = self.mention_reader
+        if isinstance(mention_reader, MentionStore):
+            return len(mention_reader)
+        if (
+            not is_streamed(mention_reader.path)
+            and mention_reader.start == 0
+            and mention_reader.end is None
+        ):
+            return count_lines_in_file(mention_reader.path)
+        return sum(1 for _ in mention_reader)
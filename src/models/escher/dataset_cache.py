@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from src.models.escher.esc.esc_dataset import DataElement
+
+CACHE_VERSION = 1
+
+
+def cache_key(settings: Dict[str, object]) -> str:
+    serialized = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+class DatasetCache:
+    def __init__(
+        self,
+        cache_dir: str,
+        settings: Dict[str, object],
+        shard_size: int = 8192,
+    ):
+        # One directory per settings hash, holding shards of
+        #   tokens-{i}.npy       token ids of all elements, concatenated
+        #   token_types-{i}.npy  token type ids, aligned with the tokens
+        #   offsets-{i}.npy      element boundaries in the token arrays
+        #   glosses-{i}.npy      gloss positions of all elements, (n, 2)
+        #   gloss_offsets-{i}.npy  element boundaries in the glosses
+        #   labels-{i}.json      ids, labels and answer positions
+        self.settings = {"version": CACHE_VERSION, **settings}
+        self.path = os.path.join(cache_dir, cache_key(self.settings))
+        self.shard_size = shard_size
+
+    def metadata_path(self, path: Optional[str] = None) -> str:
+        return os.path.join(path or self.path, "metadata.json")
+
+    def shard_path(self, name: str, shard: int, path: Optional[str] = None):
+        extension = "json" if name == "labels" else "npy"
+        return os.path.join(path or self.path, f"{name}-{shard}.{extension}")
+
+    def read(self) -> Optional[List[DataElement]]:
+        if not os.path.isfile(self.metadata_path()):
+            return None
+
+        try:
+            with open(self.metadata_path(), "r") as f:
+                metadata = json.load(f)
+            if metadata["settings"] != json.loads(
+                json.dumps(self.settings, default=str)
+            ):
+                return None
+
+            data_elements = []
+            for shard in range(metadata["shards"]):
+                data_elements.extend(
+                    self.read_shard(shard, metadata["token_type_ids"])
+                )
+            if len(data_elements) != metadata["size"]:
+                return None
+        except (OSError, EOFError, IndexError, KeyError, ValueError):
+            # Corrupt metadata or a missing or truncated shard; the split is
+            # preprocessed again
+            return None
+
+        return data_elements
+
+    def read_shard(
+        self, shard: int, has_token_type_ids: bool
+    ) -> List[DataElement]:
+        # Copy-on-write maps: sequences are views of the files and pages
+        # are only read once a batch uses them
+        tokens = torch.from_numpy(
+            np.load(self.shard_path("tokens", shard), mmap_mode="c")
+        )
+        token_types = None
+        if has_token_type_ids:
+            token_types = torch.from_numpy(
+                np.load(self.shard_path("token_types", shard), mmap_mode="c")
+            )
+        offsets = np.load(self.shard_path("offsets", shard)).tolist()
+        glosses = np.load(self.shard_path("glosses", shard)).tolist()
+        gloss_offsets = np.load(self.shard_path("gloss_offsets", shard))
+        gloss_offsets = gloss_offsets.tolist()
+        with open(self.shard_path("labels", shard), "r") as f:
+            labels = json.load(f)
+
+        data_elements = []
+        for i, (
+            element_id,
+            possible_offsets,
+            gold_labels,
+            start_position,
+            end_position,
+        ) in enumerate(labels):
+            start, end = offsets[i], offsets[i + 1]
+            data_elements.append(
+                DataElement(
+                    encoded_final_sequence=tokens[start:end],
+                    possible_offsets=possible_offsets,
+                    gloss_positions=[
+                        tuple(position)
+                        for position in glosses[
+                            gloss_offsets[i] : gloss_offsets[i + 1]
+                        ]
+                    ],
+                    token_type_ids=(
+                        token_types[start:end]
+                        if token_types is not None
+                        else None
+                    ),
+                    gold_labels=gold_labels,
+                    start_position=start_position,
+                    end_position=end_position,
+                    element_id=element_id,
+                )
+            )
+
+        return data_elements
+
+    def write(self, data_elements: List[DataElement]):
+        has_token_type_ids = all(
+            data_element.token_type_ids is not None
+            for data_element in data_elements
+        )
+
+        # Written to a private directory and renamed into place, so readers
+        # never see a partial cache
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(tmp_path, exist_ok=True)
+
+            shards = 0
+            for start in range(0, len(data_elements), self.shard_size):
+                self.write_shard(
+                    data_elements[start : start + self.shard_size],
+                    shards,
+                    has_token_type_ids,
+                    tmp_path,
+                )
+                shards += 1
+
+            with open(self.metadata_path(tmp_path), "w") as f:
+                json.dump(
+                    {
+                        "settings": self.settings,
+                        "shards": shards,
+                        "size": len(data_elements),
+                        "token_type_ids": has_token_type_ids,
+                    },
+                    f,
+                    default=str,
+                )
+
+            os.replace(tmp_path, self.path)
+        except (OSError, ValueError):
+            # A read-only or full cache directory, or another process that
+            # wrote the same cache first, only costs us the cache
+            pass
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def write_shard(
+        self,
+        data_elements: List[DataElement],
+        shard: int,
+        has_token_type_ids: bool,
+        path: str,
+    ):
+        lengths = [
+            len(data_element.encoded_final_sequence)
+            for data_element in data_elements
+        ]
+        gloss_lengths = [
+            len(data_element.gloss_positions) for data_element in data_elements
+        ]
+
+        np.save(
+            self.shard_path("tokens", shard, path),
+            np.concatenate(
+                [
+                    data_element.encoded_final_sequence.numpy()
+                    for data_element in data_elements
+                ]
+            ).astype(np.int64),
+        )
+        if has_token_type_ids:
+            np.save(
+                self.shard_path("token_types", shard, path),
+                np.concatenate(
+                    [
+                        data_element.token_type_ids.numpy()
+                        for data_element in data_elements
+                    ]
+                ).astype(np.int64),
+            )
+        np.save(
+            self.shard_path("offsets", shard, path),
+            np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        )
+        np.save(
+            self.shard_path("glosses", shard, path),
+            np.array(
+                [
+                    position
+                    for data_element in data_elements
+                    for position in data_element.gloss_positions
+                ],
+                dtype=np.int64,
+            ).reshape(-1, 2),
+        )
+        np.save(
+            self.shard_path("gloss_offsets", shard, path),
+            np.concatenate([[0], np.cumsum(gloss_lengths)]).astype(np.int64),
+        )
+        with open(self.shard_path("labels", shard, path), "w") as f:
+            json.dump(
+                [
+                    [
+                        data_element.element_id,
+                        data_element.possible_offsets,
+                        data_element.gold_labels,
+                        data_element.start_position,
+                        data_element.end_position,
+                    ]
+                    for data_element in data_elements
+                ],
+                f,
+            )
@@ -1,7 +1,17 @@
 import collections
 import random
 from abc import ABC, abstractmethod
-from typing import List, Union, Tuple, Dict, Any, Optional, NamedTuple
+from typing import (
+    List,
+    Union,
+    Tuple,
+    Dict,
+    Any,
+    Optional,
+    NamedTuple,
+    Iterable,
+    Iterator,
+)
 
 import numpy as np
 import torch
@@ -59,16 +69,19 @@ class QAExtractiveDataset(IterableDataset, ABC):
     def init_dataset(self):
         raise NotImplementedError
 
+    def is_within_limits(self, elem: DataElement) -> bool:
+        return (
+            elem.encoded_final_sequence.size(0) <= self.tokens_per_batch
+            and elem.encoded_final_sequence.size(0)
+            <= self.tokenizer.model_max_length
+        )
+
     def clean_dataset(self):
 
         old_len = len(self.data_store)
 
         self.data_store = [
-            elem
-            for elem in self.data_store
-            if elem.encoded_final_sequence.size(0) <= self.tokens_per_batch
-            and elem.encoded_final_sequence.size(0)
-            <= self.tokenizer.model_max_length
+            elem for elem in self.data_store if self.is_within_limits(elem)
         ]
 
         new_len = len(self.data_store)
@@ -83,22 +96,27 @@ class QAExtractiveDataset(IterableDataset, ABC):
                 )
             )
 
-    def shuffle_dataset(self) -> None:
+    def sort_elements(
+        self, data_elements: List[DataElement]
+    ) -> List[DataElement]:
         if not self.is_test:
-            self.data_store = sorted(
-                self.data_store,
+            data_elements = sorted(
+                data_elements,
                 key=lambda x: x.encoded_final_sequence.size(0)
                 + torch.randint(0, 10, (1,))
                 + 1,
             )
-            self.data_store = list(chunks(self.data_store, 2048))
-            random.shuffle(self.data_store)
-            self.data_store = flatten(self.data_store)
+            data_elements = list(chunks(data_elements, 2048))
+            random.shuffle(data_elements)
+            return flatten(data_elements)
         else:
-            self.data_store = sorted(
-                self.data_store, key=lambda x: x.encoded_final_sequence.size(0)
+            return sorted(
+                data_elements, key=lambda x: x.encoded_final_sequence.size(0)
             )
 
+    def shuffle_dataset(self) -> None:
+        self.data_store = self.sort_elements(self.data_store)
+
     def build_dataset(self):
         self.init_dataset()
         self.shuffle_dataset()
@@ -176,25 +194,31 @@ class QAExtractiveDataset(IterableDataset, ABC):
 
         print("Len datastore: {}".format(len(self.data_store)))
 
+        yield from self.batches(self.data_store)
+
+    def batches(
+        self, data_elements: Iterable[DataElement]
+    ) -> Iterator[Dict[str, Any]]:
+        # Greedily packs consecutive elements into batches of at most
+        # tokens_per_batch tokens, counting padding to the longest element
         current_batch = []
+        batch_max_len = 0
 
-        for data_elem in self.data_store:
+        for data_elem in data_elements:
 
-            batch_max_len = max(
-                [be.encoded_final_sequence.size(0) for be in current_batch],
-                default=0,
-            )
+            elem_len = data_elem.encoded_final_sequence.size(0)
 
             if (
-                max(data_elem.encoded_final_sequence.size(0), batch_max_len)
-                * (len(current_batch) + 1)
+                max(elem_len, batch_max_len) * (len(current_batch) + 1)
                 > self.tokens_per_batch
             ):
                 if len(current_batch) != 0:
                     yield self.output_batch(current_batch)
                 current_batch = []
+                batch_max_len = 0
 
             current_batch.append(data_elem)
+            batch_max_len = max(batch_max_len, elem_len)
 
         if len(current_batch) != 0:
             yield self.output_batch(current_batch)
@@ -287,6 +311,8 @@ class WordNetDataset(QAExtractiveDataset):
                     for wsd_instance in wsd_sentence
                 ]
 
+                sentence_instances = []
+
                 for i, wsd_instance in enumerate(wsd_sentence):
 
                     if wsd_instance.instance_id is None:
@@ -363,13 +389,38 @@ class WordNetDataset(QAExtractiveDataset):
                         for po in possible_offsets
                     ]
 
+                    sentence_instances.append(
+                        (
+                            wsd_instance,
+                            gold_labels,
+                            current_label,
+                            possible_offsets,
+                            curr_sentence,
+                            possible_glosses,
+                        )
+                    )
+
+                # the instances of a sentence are encoded in a single batch
+                sentence_samples = self.tokenizer.prepare_samples(
+                    [instance[4] for instance in sentence_instances],
+                    [instance[5] for instance in sentence_instances],
+                )
+
+                for (
+                    (
+                        wsd_instance,
+                        gold_labels,
+                        current_label,
+                        possible_offsets,
+                        _,
+                        _,
+                    ),
                     (
                         encoded_final_sequence,
                         gloss_positions,
                         token_type_ids,
-                    ) = self.tokenizer.prepare_sample(
-                        curr_sentence, possible_glosses
-                    )
+                    ),
+                ) in zip(sentence_instances, sentence_samples):
 
                     start_position, end_position = None, None
                     if current_label is not None:
@@ -470,47 +521,69 @@ class OxfordDictionaryDataset(QAExtractiveDataset):
 
         self.data_store = []
 
-        for (
-            defined_token_index,
-            defined_token_lemmapos,
-            context_tokens,
-            definition,
-        ) in self.dataset_sentences:
+        # sentences are encoded in batches of 256
+        for sentences_chunk in chunks(self.dataset_sentences, 256):
 
-            context_sentence = self.tokenizer.insert_classify_tokens(
-                context_tokens, defined_token_index
-            )
+            chunk_instances = []
 
-            possible_definitions = list(
-                self.lemmapos2glosses[defined_token_lemmapos]
-            )
+            for (
+                defined_token_index,
+                defined_token_lemmapos,
+                context_tokens,
+                definition,
+            ) in sentences_chunk:
 
-            if not self.is_test:
-                np.random.shuffle(possible_definitions)
+                context_sentence = self.tokenizer.insert_classify_tokens(
+                    context_tokens, defined_token_index
+                )
 
-            label_idx = possible_definitions.index(definition)
+                possible_definitions = list(
+                    self.lemmapos2glosses[defined_token_lemmapos]
+                )
 
-            (
-                encoded_final_sequence,
-                definitions_positions,
-                token_type_ids,
-            ) = self.tokenizer.prepare_sample(
-                context_sentence, possible_definitions
-            )
+                if not self.is_test:
+                    np.random.shuffle(possible_definitions)
 
-            start_position, end_position = definitions_positions[label_idx]
+                label_idx = possible_definitions.index(definition)
 
-            data_elem = DataElement(
-                encoded_final_sequence=encoded_final_sequence,
-                start_position=start_position,
-                end_position=end_position,
-                possible_offsets=possible_definitions,
-                gold_labels=[definition],
-                gloss_positions=definitions_positions,
-                token_type_ids=token_type_ids,
+                chunk_instances.append(
+                    (
+                        context_sentence,
+                        possible_definitions,
+                        definition,
+                        label_idx,
+                    )
+                )
+
+            chunk_samples = self.tokenizer.prepare_samples(
+                [instance[0] for instance in chunk_instances],
+                [instance[1] for instance in chunk_instances],
             )
 
-            self.data_store.append(data_elem)
+            for (
+                (_, possible_definitions, definition, label_idx),
+                (
+                    encoded_final_sequence,
+                    definitions_positions,
+                    token_type_ids,
+                ),
+            ) in zip(chunk_instances, chunk_samples):
+
+                start_position, end_position = definitions_positions[
+                    label_idx
+                ]
+
+                data_elem = DataElement(
+                    encoded_final_sequence=encoded_final_sequence,
+                    start_position=start_position,
+                    end_position=end_position,
+                    possible_offsets=possible_definitions,
+                    gold_labels=[definition],
+                    gloss_positions=definitions_positions,
+                    token_type_ids=token_type_ids,
+                )
+
+                self.data_store.append(data_elem)
 
 
 class DatasetAlternator(IterableDataset):
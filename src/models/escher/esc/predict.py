@@ -1,6 +1,6 @@
 import argparse
 import time
-from typing import NamedTuple, List, Optional, Tuple
+from typing import NamedTuple, List, Optional, Tuple, Union
 from tqdm import tqdm
 
 import numpy as np
@@ -30,6 +30,7 @@ class InstancePredictionReport(NamedTuple):
     predicted_end_indices_logits: torch.FloatTensor
     wsd_instance: Optional[WSDInstance] = None
     element_id: Optional[str] = None
+    margin: Optional[float] = None
 
 
 class ScoresReport(NamedTuple):
@@ -43,13 +44,23 @@ class PredictionReport(NamedTuple):
     scores_report: ScoresReport
 
 
+def prediction_margin(glosses_probs: List[torch.Tensor]) -> float:
+    # difference between the two most probable glosses, once normalized over the candidates
+    probs = torch.softmax(torch.stack(glosses_probs).float(), dim=0)
+    if len(probs) < 2:
+        return 1.0
+    top_probs = torch.topk(probs, 2).values
+    return (top_probs[0] - top_probs[1]).item()
+
+
 def probabilistic_prediction(
     start_logits: torch.FloatTensor,
     end_logits: torch.FloatTensor,
     glosses_indices: List[Tuple[int, int]],
     possible_offsets: List[str],
     probabilistic_type: str,
-) -> List[str]:
+    return_margin: bool = False,
+) -> Union[List[str], Tuple[List[str], Optional[float]]]:
     start_logits_lp = torch.log_softmax(start_logits, dim=0).squeeze()
     end_logits_lp = torch.log_softmax(end_logits, dim=0).squeeze()
 
@@ -66,13 +77,17 @@ def probabilistic_prediction(
         glosses_end_probs = [end_logits_lp[ei] for _, ei in glosses_indices]
         start_label_idx = np.argmax(glosses_start_probs).item()
         end_label_idx = np.argmax(glosses_end_probs).item()
-        return list({possible_offsets[start_label_idx], possible_offsets[end_label_idx]})
+        predicted_offsets = list({possible_offsets[start_label_idx], possible_offsets[end_label_idx]})
+        return (predicted_offsets, None) if return_margin else predicted_offsets
     else:
         print(f"No matching prediction methods for {probabilistic_type}")
         raise NotImplementedError
 
     label_idx = torch.argmax(torch.tensor(glosses_probs)).item()
 
+    if return_margin:
+        return [possible_offsets[label_idx]], prediction_margin(glosses_probs)
+
     return [possible_offsets[label_idx]]
 
 
@@ -144,8 +159,8 @@ def predict(
                 wsd_instance = None if "wsd_instances" not in batch else batch["wsd_instances"][i]
                 element_id = None if "element_ids" not in batch else batch["element_ids"][i]
 
-                predicted_offsets = probabilistic_prediction(
-                    start_logits_i, end_logits_i, glosses_indices, possible_offsets, prediction_type
+                predicted_offsets, margin = probabilistic_prediction(
+                    start_logits_i, end_logits_i, glosses_indices, possible_offsets, prediction_type, return_margin=True
                 )
 
                 predicted_offsets_indices = [glosses_indices[possible_offsets.index(po)] for po in predicted_offsets]
@@ -168,7 +183,8 @@ def predict(
                     predicted_start_indices_logits=start_logits_i,
                     predicted_end_indices_logits=end_logits_i,
                     wsd_instance=wsd_instance,
-                    element_id=element_id
+                    element_id=element_id,
+                    margin=margin,
                 )
 
                 instance_prediction_reports.append(instance_prediction_report)
@@ -1,5 +1,6 @@
 from typing import List, Tuple, Optional, Union
 
+import numpy as np
 import torch
 from transformers import AutoTokenizer, PreTrainedTokenizerFast
 
@@ -13,6 +14,21 @@ def get_tokenizer(transformer_model: str, use_special_tokens: bool) -> "Definiti
     return AutoDefinitionsTokenizer(transformer_model, use_special_tokens)
 
 
+def last_token_indices(token_offsets: np.ndarray, char_offsets: np.ndarray) -> np.ndarray:
+    # index of the last token whose offset equals each character offset, raising KeyError if there is none
+    if np.all(token_offsets[1:] >= token_offsets[:-1]):
+        indices = np.searchsorted(token_offsets, char_offsets, side="right") - 1
+        found = indices >= 0
+        found[found] = token_offsets[indices[found]] == char_offsets[found]
+        if not found.all():
+            raise KeyError(int(char_offsets[~found][0]))
+        return indices
+
+    # offsets that are not sorted are resolved the slow way
+    token_indices = {offset: i for i, offset in enumerate(token_offsets.tolist())}
+    return np.array([token_indices[offset] for offset in char_offsets.tolist()], dtype=np.int64)
+
+
 class DefinitionsTokenizer:
 
     transformer_model: str
@@ -48,63 +64,177 @@ class DefinitionsTokenizer:
 
         return encoding_out.input_ids.squeeze(), encoding_out.encodings[0].offsets, token_type_ids
 
+    def encode_pairs(
+        self, sequences1: List[str], sequences2: List[str]
+    ) -> List[Tuple[torch.LongTensor, np.ndarray, Optional[torch.LongTensor]]]:
+        # as in encode_pair, an empty second sequence is encoded as a single sequence
+        rows_groups = [
+            [i for i, sequence2 in enumerate(sequences2) if sequence2],
+            [i for i, sequence2 in enumerate(sequences2) if not sequence2],
+        ]
+
+        encodings = [None] * len(sequences1)
+        for rows, with_pair in zip(rows_groups, (True, False)):
+            if len(rows) == 0:
+                continue
+
+            encodings_out = self.tokenizer(
+                [sequences1[i] for i in rows],
+                [sequences2[i] for i in rows] if with_pair else None,
+                return_token_type_ids=True,
+                return_offsets_mapping=True,
+            )
+            token_type_ids = encodings_out.get("token_type_ids")
+
+            for j, i in enumerate(rows):
+                encodings[i] = (
+                    torch.tensor(encodings_out["input_ids"][j]),
+                    np.array(encodings_out["offset_mapping"][j], dtype=np.int64).reshape(-1, 2),
+                    torch.tensor(token_type_ids[j]) if token_type_ids is not None else None,
+                )
+
+        return encodings
+
     def prepare_sample(
         self, context_sentence: str, definitions: List[str]
     ) -> Tuple[torch.LongTensor, List[Tuple[int, int]], Optional[torch.LongTensor]]:
+        return self.prepare_samples([context_sentence], [definitions])[0]
+
+    def prepare_samples(
+        self, context_sentences: List[str], definitions: List[List[str]]
+    ) -> List[Tuple[torch.LongTensor, List[Tuple[int, int]], Optional[torch.LongTensor]]]:
+        if len(context_sentences) == 0:
+            return []
         if self.use_special_tokens:
-            return self.prepare_sample_with_st(context_sentence, definitions)
+            return self.prepare_samples_with_st(context_sentences, definitions)
         else:
-            return self.prepare_sample_without_st(context_sentence, definitions)
+            return self.prepare_samples_without_st(context_sentences, definitions)
 
     def prepare_sample_without_st(
         self, context_sentence: str, definitions: List[str]
     ) -> Tuple[torch.LongTensor, List[Tuple[int, int]], Optional[torch.LongTensor]]:
+        return self.prepare_samples_without_st([context_sentence], [definitions])[0]
 
-        definitions_seq = " ".join(definitions)
-        definitions_offsets = []
+    def prepare_samples_without_st(
+        self, context_sentences: List[str], definitions: List[List[str]]
+    ) -> List[Tuple[torch.LongTensor, List[Tuple[int, int]], Optional[torch.LongTensor]]]:
 
-        for i in range(len(definitions)):
-            if i == 0:
-                definitions_offsets.append((0, len(definitions[i])))
-            else:
-                last_definition_start = definitions_offsets[i - 1][1]
-                start = last_definition_start + 1
-                definitions_offsets.append((start, start + len(definitions[i])))
+        encodings = self.encode_pairs(context_sentences, [" ".join(_defs) for _defs in definitions])
 
-        encoded_final_sequence, offsets, token_type_ids = self.encode_pair(context_sentence, definitions_seq)
+        samples = []
+        for (encoded_final_sequence, offsets, token_type_ids), sample_definitions in zip(encodings, definitions):
 
-        context_start_position = [i for i, elem in enumerate(offsets[:-1]) if sum(elem) + sum(offsets[i + 1]) == 0][0]
-        context_offset = context_start_position + 2
-        offsets = offsets[context_offset:-1]
+            # character offsets of the definitions within the space-joined definitions sequence
+            definitions_lengths = np.array([len(_def) for _def in sample_definitions], dtype=np.int64)
+            definitions_ends = np.cumsum(definitions_lengths + 1) - 1
+            definitions_starts = definitions_ends - definitions_lengths
 
-        si2ti = dict()
-        ei2ti = dict()
-        for i, (si, ei) in enumerate(offsets):
-            si2ti[si] = i
-            ei2ti[ei] = i
+            # the definitions sequence starts after the first two consecutive (0, 0) offsets
+            special_offsets = offsets.sum(axis=1) == 0
+            context_start_position = np.flatnonzero(special_offsets[:-1] & special_offsets[1:])[0]
+            context_offset = int(context_start_position) + 2
+            offsets = offsets[context_offset:-1]
 
-        definitions_positions = [
-            (context_offset + si2ti[gsi], context_offset + ei2ti[gei]) for gsi, gei in definitions_offsets
-        ]
+            definitions_positions = list(
+                zip(
+                    (context_offset + last_token_indices(offsets[:, 0], definitions_starts)).tolist(),
+                    (context_offset + last_token_indices(offsets[:, 1], definitions_ends)).tolist(),
+                )
+            )
+
+            samples.append((encoded_final_sequence, definitions_positions, token_type_ids))
 
-        return encoded_final_sequence, definitions_positions, token_type_ids
+        return samples
 
     def prepare_sample_with_st(
         self, context_sentence: str, definitions: List[str]
     ) -> Tuple[torch.LongTensor, List[Tuple[int, int]], Optional[torch.LongTensor]]:
+        return self.prepare_samples_with_st([context_sentence], [definitions])[0]
 
-        definitions_seq = "".join([f"{GLOSS_START_TOKEN} {_def}{GLOSS_END_TOKEN}" for _def in definitions])
-        encoded_final_sequence, _, token_typed_ids = self.encode_pair(context_sentence, definitions_seq)
+    def prepare_samples_with_st(
+        self, context_sentences: List[str], definitions: List[List[str]]
+    ) -> List[Tuple[torch.LongTensor, List[Tuple[int, int]], Optional[torch.LongTensor]]]:
 
-        # removing spaces created with the addition of <classify> and </classify>
-        encoded_final_sequence = encoded_final_sequence[encoded_final_sequence != self.space_token_id]
+        definitions_seqs = [
+            "".join([f"{GLOSS_START_TOKEN} {_def}{GLOSS_END_TOKEN}" for _def in _defs]) for _defs in definitions
+        ]
+
+        samples = []
+        for encoded_final_sequence, _, token_typed_ids in self.encode_pairs(context_sentences, definitions_seqs):
 
-        definitions_positions = zip(
-            (i for i, wid in enumerate(encoded_final_sequence) if wid == self.gloss_start_token_id),
-            (i for i, wid in enumerate(encoded_final_sequence) if wid == self.gloss_end_token_id),
-        )
+            # removing spaces created with the addition of <classify> and </classify>
+            encoded_final_sequence = encoded_final_sequence[encoded_final_sequence != self.space_token_id]
+
+            word_ids = encoded_final_sequence.numpy()
+            definitions_positions = zip(
+                np.flatnonzero(word_ids == self.gloss_start_token_id).tolist(),
+                np.flatnonzero(word_ids == self.gloss_end_token_id).tolist(),
+            )
+
+            samples.append((encoded_final_sequence, list(definitions_positions), token_typed_ids))
+
+        return samples
+
+    def encode_definition(self, definition: str) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+        # ids of a definition as they appear within the space-joined definitions sequence, together with
+        # its (start, end) token span resolved from the offsets the same way prepare_sample_without_st does
+        encoding_out = self.tokenizer(definition, add_special_tokens=False, return_offsets_mapping=True)
+        offsets = np.array(encoding_out["offset_mapping"], dtype=np.int64).reshape(-1, 2)
+
+        starts = np.flatnonzero(offsets[:, 0] == 0)
+        ends = np.flatnonzero(offsets[:, 1] == len(definition))
+        if len(starts) == 0 or len(ends) == 0:
+            return None
+
+        return np.array(encoding_out["input_ids"], dtype=np.int32), (int(starts[-1]), int(ends[-1]))
+
+    def prepare_sample_from_ids(
+        self, context_sentence: str, encoded_definitions: List[Tuple[np.ndarray, Tuple[int, int]]]
+    ) -> Tuple[torch.LongTensor, List[Tuple[int, int]], Optional[torch.LongTensor]]:
+        # same output as prepare_sample_without_st, assembled from pre-tokenized definitions
+        context_ids = self.tokenizer(context_sentence, add_special_tokens=False)["input_ids"]
+        definitions_ids = [ids for ids, _ in encoded_definitions]
+        definitions_seq_ids = np.concatenate(definitions_ids).tolist() if definitions_ids else []
+
+        input_ids = self.tokenizer.build_inputs_with_special_tokens(context_ids, definitions_seq_ids)
+        token_type_ids = self.tokenizer.create_token_type_ids_from_sequences(context_ids, definitions_seq_ids)
+
+        # the definitions are followed by a single closing special token
+        definitions_start = len(self.tokenizer.build_inputs_with_special_tokens(context_ids, [])) - 1
+        lengths = np.array([len(ids) for ids in definitions_ids], dtype=np.int64)
+        offsets = definitions_start + np.cumsum(lengths) - lengths
+        spans = np.array([span for _, span in encoded_definitions], dtype=np.int64).reshape(-1, 2)
+        definitions_positions = [tuple(position) for position in (spans + offsets[:, None]).tolist()]
+
+        return torch.tensor(input_ids), definitions_positions, torch.tensor(token_type_ids)
+
+    @property
+    def supports_definition_ids(self) -> bool:
+        if getattr(self, "_supports_definition_ids", None) is None:
+            self._supports_definition_ids = self.check_definition_ids()
+        return self._supports_definition_ids
+
+    def check_definition_ids(self) -> bool:
+        # prepare_sample_from_ids is only used if it reproduces prepare_sample on a probe sample
+        if self.use_special_tokens:
+            return False
+
+        context_sentence = f"A probe {CLASS_START_TOKEN} sentence {CLASS_END_TOKEN} for the tokenizer."
+        definitions = ["First definition, with punctuation.", "Second (one)", "3rd"]
+        try:
+            expected = self.prepare_sample_without_st(context_sentence, definitions)
+            actual = self.prepare_sample_from_ids(
+                context_sentence, [self.encode_definition(definition) for definition in definitions]
+            )
+        except (AttributeError, NotImplementedError, KeyError, IndexError, TypeError):
+            return False
+
+        if expected[2] is None or actual[2] is None:
+            same_token_types = expected[2] is None and actual[2] is None
+        else:
+            same_token_types = torch.equal(expected[2], actual[2])
 
-        return encoded_final_sequence, list(definitions_positions), token_typed_ids
+        return torch.equal(expected[0], actual[0]) and expected[1] == actual[1] and same_token_types
 
     def save(self, dir_path: str) -> None:
         import os
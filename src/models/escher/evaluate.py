@@ -1,15 +1,30 @@
 import os
 from argparse import ArgumentParser
-from typing import Dict
+from typing import Dict, Optional, Tuple, Union
 
+import numpy as np
 import torch
 from src import candidate_generators
-from src.candidate_generators import TfidfCandidateGenerator
-from src.data.entity import Entity, EntityReader
-from src.data.mention import MentionReader
+from src.candidate_generators import (
+    CANDIDATE_GENERATORS,
+    BaseCandidateEntityGenerator,
+    CachedCandidateGenerator,
+    CascadeCandidateGenerator,
+    TruncatedCandidateGenerator,
+    apply_entity_delta,
+    get_candidate_generator,
+)
+from src.data.delta import VersionedEntityDict, read_delta
+from src.data.entity import EntityReader
+from src.data.mention import MentionReader, MentionStore
+from src.data.snapshot import source_fingerprint
 from src.models.escher.dataset import EscherDataset
 from src.models.escher.esc.esc_pl_module import ESCModule
-from src.models.escher.esc.predict import PredictionReport, predict
+from src.models.escher.esc.predict import (
+    PredictionReport,
+    precision_recall_f1_accuracy_score,
+    predict,
+)
 from src.models.escher.preprocessor import EscherPreprocessor
 from torch.utils.data import DataLoader
 
@@ -26,34 +41,58 @@ def parse_args():
     parser.add_argument("--mentions_path", type=str, default="data/mentions")
     parser.add_argument("--filename", type=str, default="val.json")
     parser.add_argument("--tokens_per_batch", type=int, default=1024)
+    parser.add_argument("--num_workers", type=int, default=0)
+    parser.add_argument("--preprocessing_workers", type=int, default=0)
+    parser.add_argument("--dataset_cache_dir", type=str)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--stream_buffer_size", type=int, default=8192)
     parser.add_argument("--top_k_candidates", type=int, default=16)
+    parser.add_argument(
+        "--candidate_generator",
+        type=str,
+        default="tfidf",
+        choices=CANDIDATE_GENERATORS,
+    )
     parser.add_argument("--documents_path", type=str, default="data/documents")
+    parser.add_argument("--lazy_entities", action="store_true")
+    parser.add_argument("--entity_workers", type=int, default=1)
+    parser.add_argument("--partition_by_corpus", action="store_true")
+    parser.add_argument("--entity_deltas", type=str, nargs="*", default=[])
     parser.add_argument("--mention_window_size", type=int, default=16)
     parser.add_argument("--entity_length", type=int, default=32)
     parser.add_argument("--prediction_type", type=str, default="probabilistic")
     parser.add_argument("--device", type=int, default=0)
     parser.add_argument("--output", type=str)
+    parser.add_argument("--candidate_cache_size", type=int, default=100000)
+    parser.add_argument("--candidate_cache_path", type=str)
+    parser.add_argument("--cascade_top_k", type=int, default=0)
+    parser.add_argument("--adaptive_top_k", type=int, default=0)
+    parser.add_argument("--confidence_margin", type=float, default=0.5)
 
     args = parser.parse_args()
 
+    # The split prediction type picks a gloss without comparing them, so
+    # there is no margin to decide which mentions to rerun
+    if args.adaptive_top_k > 0 and args.prediction_type == "split":
+        parser.error("--adaptive_top_k needs a prediction type with a margin")
+
     return args
 
 
 def get_dataloader(
-    mentions_path: str,
-    filename: str,
+    mention_reader: Union[MentionReader, MentionStore],
     tokens_per_batch: int,
-    entity_dict: Dict[str, Entity],
     preprocessor: EscherPreprocessor,
+    candidate_generator: BaseCandidateEntityGenerator,
     re_init_on_iter: bool = False,
     is_test: bool = False,
-    top_k: int = 64,
+    num_workers: int = 0,
+    preprocessing_workers: int = 0,
+    cache_dir: Optional[str] = None,
+    cache_settings: Optional[Dict[str, object]] = None,
+    stream: bool = False,
+    stream_buffer_size: int = 8192,
 ) -> DataLoader:
-    mention_reader = MentionReader(os.path.join(mentions_path, filename))
-    candidate_generator = TfidfCandidateGenerator(
-        entity_dict=entity_dict, top_k=top_k, filename=filename
-    )
-
     dataset = EscherDataset(
         tokens_per_batch=tokens_per_batch,
         re_init_on_iter=re_init_on_iter,
@@ -61,9 +100,14 @@ def get_dataloader(
         is_test=is_test,
         mention_reader=mention_reader,
         preprocessor=preprocessor,
+        preprocessing_workers=preprocessing_workers,
+        cache_dir=cache_dir,
+        cache_settings=cache_settings,
+        stream=stream,
+        stream_buffer_size=stream_buffer_size,
     )
     dataloader: DataLoader = DataLoader(
-        dataset, batch_size=None, num_workers=0
+        dataset, batch_size=None, num_workers=num_workers
     )
 
     return dataloader
@@ -87,6 +131,64 @@ def get_accuracy(prediction_report: PredictionReport, mention_num: int):
     return accuracy
 
 
+def count_tokens(prediction_report: PredictionReport) -> int:
+    return sum(
+        len(instance.sequence)
+        for instance in prediction_report.instances_prediction_reports
+    )
+
+
+def adaptive_predict(
+    run, candidate_generator, mention_reader, args
+) -> Tuple[PredictionReport, int]:
+    # First pass with the top adaptive_top_k candidates only; mentions
+    # predicted with a margin below confidence_margin, or dropped because
+    # their gold entity was not among the first candidates, are predicted
+    # again with the full candidate list. The margin is a proxy for the
+    # accuracy given up: raising confidence_margin reruns more mentions
+    # and brings the accuracy closer to that of the full lists.
+    first_report = run(
+        TruncatedCandidateGenerator(candidate_generator, args.adaptive_top_k),
+        mention_reader,
+    )
+    confident = {
+        instance.element_id: instance
+        for instance in first_report.instances_prediction_reports
+        if instance.margin is not None
+        and instance.margin >= args.confidence_margin
+    }
+
+    mention_store = mention_reader.read_all()
+    rerun = [
+        i
+        for i, mention_id in enumerate(mention_store.mention_ids)
+        if mention_id not in confident
+    ]
+    print(
+        f"Adaptive top-k: {len(confident)} confident with "
+        f"{args.adaptive_top_k} candidates, {len(rerun)} rerun"
+    )
+
+    instances = list(confident.values())
+    tokens_encoded = count_tokens(first_report)
+    if rerun:
+        second_report = run(
+            candidate_generator, mention_store.select(np.array(rerun))
+        )
+        instances.extend(second_report.instances_prediction_reports)
+        tokens_encoded += count_tokens(second_report)
+
+    scores_report = precision_recall_f1_accuracy_score(
+        y_true=[instance.gold_synsets for instance in instances],
+        y_pred=[instance.predicted_synsets for instance in instances],
+    )
+    prediction_report = PredictionReport(
+        instances_prediction_reports=instances, scores_report=scores_report
+    )
+
+    return prediction_report, tokens_encoded
+
+
 def main():
     args = parse_args()
 
@@ -96,41 +198,115 @@ def main():
     if args.device >= 0:
         model.to(torch.device(args.device))
 
-    entity_reader = EntityReader(args.documents_path)
-    entity_dict = entity_reader.read_all()
+    corpora = None
+    if args.partition_by_corpus:
+        mention_reader = MentionReader(
+            os.path.join(args.mentions_path, args.filename)
+        )
+        corpora = mention_reader.corpora()
+
+    entity_reader = EntityReader(
+        args.documents_path,
+        num_workers=args.entity_workers,
+        corpora=corpora,
+    )
+    if args.lazy_entities:
+        entity_dict = entity_reader.read_store()
+    else:
+        entity_dict = entity_reader.read_all()
+    if args.entity_deltas:
+        entity_dict = VersionedEntityDict(entity_dict)
     preprocessor = EscherPreprocessor(
         mention_window_size=args.mention_window_size,
         entity_length=args.entity_length,
         entity_dict=entity_dict,
+        max_tokens=args.tokens_per_batch,
     )
 
-    dataloader = get_dataloader(
-        mentions_path=args.mentions_path,
-        filename=args.filename,
-        tokens_per_batch=args.tokens_per_batch,
-        entity_dict=entity_dict,
-        preprocessor=preprocessor,
-        re_init_on_iter=False,
-        is_test=True,
-        top_k=args.top_k_candidates,
+    # A single cached generator serves both the dataset and the recall
+    # count below, so every mention is only retrieved once
+    candidate_cache = CachedCandidateGenerator(
+        get_candidate_generator(
+            args.candidate_generator,
+            entity_dict=entity_dict,
+            top_k=args.top_k_candidates,
+            filename=args.filename,
+        ),
+        max_size=args.candidate_cache_size,
+        path=args.candidate_cache_path,
+        settings={
+            "entities": entity_reader.fingerprint(),
+            "mentions": MentionReader(
+                os.path.join(args.mentions_path, args.filename)
+            ).fingerprint(),
+        },
     )
 
-    prediction_report = predict(
-        model=model,
-        data_loader=dataloader,
-        device=args.device,
-        prediction_type=args.prediction_type,
-        evaluate=True,
-    )
+    # Deltas are applied on top of the artifacts built for the base
+    # entities instead of rebuilding them
+    for delta_path in args.entity_deltas:
+        version = apply_entity_delta(
+            entity_dict, candidate_cache, read_delta(delta_path)
+        )
+        print(f"Applied {delta_path}, entity version {version}")
+
+    # Optionally prune the retrieved candidates with a lexical scorer so
+    # that only the best cascade_top_k are encoded by ESCHER
+    candidate_generator = candidate_cache
+    if args.cascade_top_k > 0:
+        candidate_generator = CascadeCandidateGenerator(
+            candidate_cache,
+            top_k=args.cascade_top_k,
+            context_window=args.mention_window_size,
+            entity_length=args.entity_length,
+        )
 
     mention_reader = MentionReader(
         os.path.join(args.mentions_path, args.filename)
     )
-    candidate_generator = TfidfCandidateGenerator(
-        entity_dict=entity_dict,
-        top_k=args.top_k_candidates,
-        filename=args.filename,
-    )
+
+    # Preprocessed datasets are cached under a hash of everything they
+    # depend on, so a new checkpoint is evaluated without preprocessing
+    cache_settings = {
+        "entities": entity_reader.fingerprint(),
+        "entity_deltas": {
+            path: source_fingerprint(path) for path in args.entity_deltas
+        },
+    }
+
+    def run(candidates, mentions) -> PredictionReport:
+        dataloader = get_dataloader(
+            mention_reader=mentions,
+            tokens_per_batch=args.tokens_per_batch,
+            preprocessor=preprocessor,
+            candidate_generator=candidates,
+            re_init_on_iter=False,
+            is_test=True,
+            num_workers=args.num_workers,
+            preprocessing_workers=args.preprocessing_workers,
+            cache_dir=args.dataset_cache_dir,
+            cache_settings=cache_settings,
+            stream=args.stream,
+            stream_buffer_size=args.stream_buffer_size,
+        )
+
+        return predict(
+            model=model,
+            data_loader=dataloader,
+            device=args.device,
+            prediction_type=args.prediction_type,
+            evaluate=True,
+        )
+
+    if args.adaptive_top_k > 0:
+        prediction_report, tokens_encoded = adaptive_predict(
+            run, candidate_generator, mention_reader, args
+        )
+    else:
+        prediction_report = run(candidate_generator, mention_reader)
+        tokens_encoded = count_tokens(prediction_report)
+    print(f"Tokens encoded: {tokens_encoded}")
+
     mention_num = len(mention_reader.read_all())
 
     normalized_mention_num = 0
@@ -142,6 +318,14 @@ def main():
 
     print(f"Mention num: {mention_num}")
     print(f"Normalized mention num: {normalized_mention_num}")
+    # Only lookups made in this process are counted (and saved); those of
+    # DataLoader workers stay in their copies of the cache
+    print(f"Candidate cache: {candidate_cache.stats()}")
+    if isinstance(candidate_generator, CascadeCandidateGenerator):
+        print(f"Cascade: {candidate_generator.stats()}")
+
+    if args.candidate_cache_path is not None:
+        candidate_cache.save()
 
     accuracy = get_accuracy(
         prediction_report=prediction_report,
@@ -1,10 +1,73 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 from src.data.entity import Entity
 from src.data.mention import Mention
 from src.models.base import BasePreprocessor
 
 from .esc.esc_dataset import DataElement
-from .esc.utils.definitions_tokenizer import get_tokenizer
+from .esc.utils.definitions_tokenizer import (
+    DefinitionsTokenizer,
+    get_tokenizer,
+)
+
+EncodedEntity = Tuple[np.ndarray, Tuple[int, int]]
+
+
+class EntityTokenCache:
+    def __init__(self, tokenizer: DefinitionsTokenizer, entity_length: int):
+        # Token ids and token span of the truncated entity texts, valid for
+        # one tokenizer and entity_length. Entries are keyed by document id
+        # and checked against a hash of the text, so modified entities are
+        # re-encoded.
+        self.tokenizer = tokenizer
+        self.entity_length = entity_length
+        self.cache: Dict[str, Tuple[int, Optional[EncodedEntity]]] = {}
+
+    def encode(
+        self, document_id: str, entity_text: str
+    ) -> Optional[EncodedEntity]:
+        text_hash = hash(entity_text)
+        cached = self.cache.get(document_id)
+        if cached is not None and cached[0] == text_hash:
+            return cached[1]
+
+        encoded_entity = None
+        # Empty texts and texts with surrounding whitespace tokenize
+        # differently on their own than inside the joined sequence
+        if entity_text and entity_text == entity_text.strip():
+            encoded_entity = self.tokenizer.encode_definition(entity_text)
+
+        self.cache[document_id] = (text_hash, encoded_entity)
+        return encoded_entity
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+
+class WordOffsetIndex:
+    def __init__(self):
+        # Start offset of every space-separated word of a document, plus a
+        # sentinel one past the end, so that word k spans
+        # text[offsets[k]:offsets[k + 1] - 1]
+        self.index: Dict[str, Tuple[int, np.ndarray]] = {}
+
+    def offsets(self, document_id: str, text: str) -> np.ndarray:
+        text_hash = hash(text)
+        cached = self.index.get(document_id)
+        if cached is not None and cached[0] == text_hash:
+            return cached[1]
+
+        characters = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        offsets = np.concatenate(
+            [[0], np.flatnonzero(characters == ord(" ")) + 1, [len(text) + 1]]
+        ).astype(np.int32)
+
+        self.index[document_id] = (text_hash, offsets)
+        return offsets
+
+    def __len__(self) -> int:
+        return len(self.index)
 
 
 class EscherPreprocessor(BasePreprocessor):
@@ -13,16 +76,37 @@ class EscherPreprocessor(BasePreprocessor):
         mention_window_size: int,
         entity_length: int,
         entity_dict: Dict[str, Entity],
+        tokenizer: Optional[DefinitionsTokenizer] = None,
+        max_tokens: Optional[int] = None,
     ) -> None:
         self.mention_window_size = mention_window_size
         self.entity_length = entity_length
         self.entity_dict = entity_dict
-        self.tokenizer = get_tokenizer("facebook/bart-large", False)
+        if tokenizer is None:
+            tokenizer = get_tokenizer("facebook/bart-large", False)
+        self.tokenizer = tokenizer
+        # Samples longer than this are fitted by truncating the candidate
+        # texts and, if needed, the context window
+        self.max_tokens = self.tokenizer.model_max_length
+        if max_tokens is not None:
+            self.max_tokens = min(max_tokens, self.max_tokens)
+        self.token_cache = EntityTokenCache(self.tokenizer, entity_length)
+        self.word_offsets = WordOffsetIndex()
+
+    def preprocess_mention(
+        self, mention: Mention, mention_window_size: Optional[int] = None
+    ) -> str:
+        if mention_window_size is None:
+            mention_window_size = self.mention_window_size
 
-    def preprocess_mention(self, mention: Mention) -> str:
         mention_entity = self.entity_dict[mention.context_document_id]
         mention_text = mention_entity.text
 
+        if 0 <= mention.start_index <= mention.end_index:
+            return self.mention_window(
+                mention, mention_text, mention_window_size
+            )
+
         # Tokenize
         mention_tokens = mention_text.split(" ")
 
@@ -34,58 +118,300 @@ class EscherPreprocessor(BasePreprocessor):
         )
 
         # Select tokens within the window size
-        window_start = mention.start_index - self.mention_window_size
-        window_end = mention.end_index + self.mention_window_size + 3
+        window_start = mention.start_index - mention_window_size
+        window_end = mention.end_index + mention_window_size + 3
         mention_tokens = mention_tokens[window_start:window_end]
 
         mention_text = " ".join(mention_tokens)
 
         return mention_text
 
-    def preprocess_entity(self, entity: Entity) -> str:
+    def mention_window(
+        self, mention: Mention, mention_text: str, mention_window_size: int
+    ) -> str:
+        # Same window as preprocess_mention, sliced out of the document
+        # through its word offsets instead of splitting all of it
+        offsets = self.word_offsets.offsets(
+            mention.context_document_id, mention_text
+        )
+        num_words = len(offsets) - 1
+
+        # Positions of <classify> and </classify> in the tagged word list,
+        # with list.insert clamping them to its end
+        class_start = min(mention.start_index, num_words)
+        class_end = min(mention.end_index + 2, num_words + 1)
+
+        window_start, window_end, _ = slice(
+            mention.start_index - mention_window_size,
+            mention.end_index + mention_window_size + 3,
+        ).indices(num_words + 2)
+
+        # Words before, between and after the tags as ranges of the tagged
+        # list, each followed by its shift back to document word indices
+        spans = [
+            (window_start, min(window_end, class_start), 0),
+            (
+                max(window_start, class_start + 1),
+                min(window_end, class_end),
+                1,
+            ),
+            (max(window_start, class_end + 1), window_end, 2),
+        ]
+        tags = [(class_start, "<classify>"), (class_end, "</classify>")]
+
+        words = []
+        for i, (start, end, shift) in enumerate(spans):
+            if start < end:
+                words.append(
+                    mention_text[
+                        offsets[start - shift] : offsets[end - shift] - 1
+                    ]
+                )
+            if i < len(tags) and window_start <= tags[i][0] < window_end:
+                words.append(tags[i][1])
+
+        return " ".join(words)
+
+    def preprocess_entity(
+        self, entity: Entity, entity_length: Optional[int] = None
+    ) -> str:
+        if entity_length is None:
+            entity_length = self.entity_length
+
         entity_tokens = entity.text.split(" ")
-        entity_tokens = entity_tokens[: self.entity_length]
+        entity_tokens = entity_tokens[:entity_length]
 
         entity_text = " ".join(entity_tokens)
 
         return entity_text
 
-    def preprocess(
-        self, mention: Mention, candidate_entities: List[Entity]
-    ) -> Optional[DataElement]:
+    def encode_candidates(
+        self, candidate_entities: List[Entity], entity_length: int
+    ) -> Tuple[List[str], Optional[List[EncodedEntity]]]:
         candidate_input = [
-            self.preprocess_entity(entity) for entity in candidate_entities
+            self.preprocess_entity(entity, entity_length)
+            for entity in candidate_entities
         ]
-        candidate_labels = [
-            entity.document_id for entity in candidate_entities
+
+        # Each entity is tokenized once and reused across candidate lists;
+        # samples are then assembled from the cached ids
+        # The cache only holds texts truncated to self.entity_length
+        if (
+            not self.tokenizer.supports_definition_ids
+            or entity_length != self.entity_length
+        ):
+            return candidate_input, None
+
+        encoded_candidates = [
+            self.token_cache.encode(entity.document_id, entity_input)
+            for entity, entity_input in zip(
+                candidate_entities, candidate_input
+            )
+        ]
+        if any(encoded is None for encoded in encoded_candidates):
+            return candidate_input, None
+
+        return candidate_input, encoded_candidates
+
+    def encode_samples(
+        self,
+        mentions: List[Mention],
+        candidates: List[List[Entity]],
+    ):
+        mention_inputs = [
+            self.preprocess_mention(mention) for mention in mentions
+        ]
+        encoded = [
+            self.encode_candidates(candidate_entities, self.entity_length)
+            for candidate_entities in candidates
         ]
 
-        gold_label = mention.label_document_id
-        if gold_label not in candidate_labels:
+        # Samples without cached ids are tokenized together
+        text_rows = [
+            row
+            for row, (_, encoded_candidates) in enumerate(encoded)
+            if encoded_candidates is None
+        ]
+        text_samples = dict(
+            zip(
+                text_rows,
+                self.tokenizer.prepare_samples(
+                    [mention_inputs[row] for row in text_rows],
+                    [encoded[row][0] for row in text_rows],
+                ),
+            )
+        )
+
+        samples = []
+        for row, mention in enumerate(mentions):
+            encoded_candidates = encoded[row][1]
+            if encoded_candidates is not None:
+                sample = self.tokenizer.prepare_sample_from_ids(
+                    mention_inputs[row], encoded_candidates
+                )
+            else:
+                sample = text_samples[row]
+
+            if len(sample[0]) > self.max_tokens:
+                sample = self.fit_to_budget(
+                    mention,
+                    candidates[row],
+                    mention_inputs[row],
+                    encoded_candidates,
+                    sample,
+                )
+            samples.append(sample)
+
+        return samples
+
+    def fit_to_budget(
+        self,
+        mention: Mention,
+        candidate_entities: List[Entity],
+        mention_input: str,
+        encoded_candidates: Optional[List[EncodedEntity]],
+        sample,
+    ):
+        # The context window is halved while the candidates cannot be
+        # fitted next to it
+        mention_window_size = self.mention_window_size
+        while True:
+            fitted_sample = self.fit_sample(
+                mention_input, candidate_entities, encoded_candidates
+            )
+            if fitted_sample is not None or mention_window_size == 0:
+                break
+            mention_window_size //= 2
+            mention_input = self.preprocess_mention(
+                mention, mention_window_size
+            )
+
+        # Samples that cannot be fitted are dropped by the dataset
+        return fitted_sample if fitted_sample is not None else sample
+
+    def fit_sample(
+        self,
+        mention_input: str,
+        candidate_entities: List[Entity],
+        encoded_candidates: Optional[List[EncodedEntity]],
+    ):
+        if encoded_candidates is None:
+            return self.fit_sample_by_words(mention_input, candidate_entities)
+
+        # Water-filling: every candidate keeps up to the same number of
+        # tokens, the largest for which the sequence fits, so that short
+        # descriptions are never cut to make room for long ones. At least
+        # the first token of each description's span is kept.
+        context_length = len(
+            self.tokenizer.prepare_sample_from_ids(mention_input, [])[0]
+        )
+        available = self.max_tokens - context_length
+        lengths = np.array(
+            [len(token_ids) for token_ids, _ in encoded_candidates]
+        )
+        min_lengths = np.minimum(
+            lengths, [span[0] + 1 for _, span in encoded_candidates]
+        )
+
+        def fitted_lengths(cap: int) -> np.ndarray:
+            return np.maximum(np.minimum(lengths, cap), min_lengths)
+
+        if fitted_lengths(0).sum() > available:
             return None
-        gold_idx = candidate_labels.index(gold_label)
 
-        mention_input = self.preprocess_mention(mention)
+        low, high = 0, int(lengths.max(initial=0))
+        while low < high:
+            cap = (low + high + 1) // 2
+            if fitted_lengths(cap).sum() <= available:
+                low = cap
+            else:
+                high = cap - 1
+
+        # Tokens left over by the common cap go, one each, to the best
+        # ranked candidates that were cut
+        candidate_lengths = fitted_lengths(low)
+        remainder = available - int(candidate_lengths.sum())
+        cut = np.flatnonzero(candidate_lengths < lengths)[:remainder]
+        candidate_lengths[cut] += 1
+
+        fitted_candidates = [
+            (token_ids[:length], (start, min(end, length - 1)))
+            for (token_ids, (start, end)), length in zip(
+                encoded_candidates, candidate_lengths.tolist()
+            )
+        ]
+        return self.tokenizer.prepare_sample_from_ids(
+            mention_input, fitted_candidates
+        )
+
+    def fit_sample_by_words(
+        self, mention_input: str, candidate_entities: List[Entity]
+    ):
+        # Same as fit_sample for samples that are encoded from text: the
+        # largest common entity length, in words, that fits
+        sample = None
+        low, high = 0, self.entity_length - 1
+        while low < high:
+            entity_length = (low + high + 1) // 2
+            candidate_input, _ = self.encode_candidates(
+                candidate_entities, entity_length
+            )
+            candidate_sample = self.tokenizer.prepare_sample(
+                mention_input, candidate_input
+            )
+            if len(candidate_sample[0]) <= self.max_tokens:
+                low, sample = entity_length, candidate_sample
+            else:
+                high = entity_length - 1
+
+        return sample
+
+    def preprocess(
+        self, mention: Mention, candidate_entities: List[Entity]
+    ) -> Optional[DataElement]:
+        return self.preprocess_batch([mention], [candidate_entities])[0]
+
+    def preprocess_batch(
+        self, mentions: List[Mention], candidates: List[List[Entity]]
+    ) -> List[Optional[DataElement]]:
+        candidate_labels = [
+            [entity.document_id for entity in candidate_entities]
+            for candidate_entities in candidates
+        ]
+
+        rows = [
+            row
+            for row, mention in enumerate(mentions)
+            if mention.label_document_id in candidate_labels[row]
+        ]
 
         # BART does not make use of token type ids,
         # therefore a list of zeros is returned.
-        (
+        samples = self.encode_samples(
+            [mentions[row] for row in rows], [candidates[row] for row in rows]
+        )
+
+        data_elements: List[Optional[DataElement]] = [None] * len(mentions)
+        for row, (
             encoded_final_sequence,
             candidate_positions,
             token_type_ids,
-        ) = self.tokenizer.prepare_sample(mention_input, candidate_input)
-
-        start_position, end_position = candidate_positions[gold_idx]
-
-        data_element = DataElement(
-            encoded_final_sequence=encoded_final_sequence,
-            possible_offsets=candidate_labels,
-            gloss_positions=candidate_positions,
-            token_type_ids=token_type_ids,
-            gold_labels=[gold_label],
-            start_position=start_position,
-            end_position=end_position,
-            element_id=mention.mention_id
-        )
+        ) in zip(rows, samples):
+            mention = mentions[row]
+            gold_label = mention.label_document_id
+            gold_idx = candidate_labels[row].index(gold_label)
+
+            start_position, end_position = candidate_positions[gold_idx]
+
+            data_elements[row] = DataElement(
+                encoded_final_sequence=encoded_final_sequence,
+                possible_offsets=candidate_labels[row],
+                gloss_positions=candidate_positions,
+                token_type_ids=token_type_ids,
+                gold_labels=[gold_label],
+                start_position=start_position,
+                end_position=end_position,
+                element_id=mention.mention_id
+            )
 
-        return data_element
+        return data_elements
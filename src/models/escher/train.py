@@ -1,12 +1,15 @@
 import os
 from argparse import ArgumentParser
-from typing import Dict
+from typing import Dict, Optional
 
 import gdown
 import pytorch_lightning as pl
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.loggers import WandbLogger
-from src.candidate_generators import TfidfCandidateGenerator
+from src.candidate_generators import (
+    CANDIDATE_GENERATORS,
+    get_candidate_generator,
+)
 from src.data.entity import Entity, EntityReader
 from src.data.mention import MentionReader
 from src.models.escher.dataset import EscherDataset
@@ -21,12 +24,24 @@ def parse_args():
     parser = ArgumentParser()
 
     parser.add_argument("--documents_path", type=str, default="data/documents")
+    parser.add_argument("--lazy_entities", action="store_true")
+    parser.add_argument("--entity_workers", type=int, default=1)
+    parser.add_argument("--partition_by_corpus", action="store_true")
     parser.add_argument("--mentions_path", type=str, default="data/mentions")
     parser.add_argument("--mention_window_size", type=int, default=16)
     parser.add_argument("--entity_length", type=int, default=32)
     parser.add_argument("--top_k_candidates", type=int, default=16)
+    parser.add_argument(
+        "--candidate_generator",
+        type=str,
+        default="tfidf",
+        choices=CANDIDATE_GENERATORS,
+    )
     parser.add_argument("--gpus", type=int, default=0)
     parser.add_argument("--tokens_per_batch", type=int, default=1024)
+    parser.add_argument("--num_workers", type=int, default=0)
+    parser.add_argument("--preprocessing_workers", type=int, default=0)
+    parser.add_argument("--dataset_cache_dir", type=str)
     parser.add_argument("--max_steps", type=int, default=1)
     parser.add_argument("--accumulate_grad_batches", type=int, default=20)
     parser.add_argument("--gradient_clip_val", type=float, default=10.0)
@@ -66,10 +81,18 @@ def get_dataloader(
     re_init_on_iter: bool = False,
     is_test: bool = False,
     top_k: int = 64,
+    num_workers: int = 0,
+    preprocessing_workers: int = 0,
+    candidate_generator_name: str = "tfidf",
+    cache_dir: Optional[str] = None,
+    cache_settings: Optional[Dict[str, object]] = None,
 ) -> DataLoader:
     mention_reader = MentionReader(os.path.join(mentions_path, filename))
-    candidate_generator = TfidfCandidateGenerator(
-        entity_dict=entity_dict, top_k=top_k, filename=filename
+    candidate_generator = get_candidate_generator(
+        candidate_generator_name,
+        entity_dict=entity_dict,
+        top_k=top_k,
+        filename=filename,
     )
 
     dataset = EscherDataset(
@@ -79,9 +102,12 @@ def get_dataloader(
         is_test=is_test,
         mention_reader=mention_reader,
         preprocessor=preprocessor,
+        preprocessing_workers=preprocessing_workers,
+        cache_dir=cache_dir,
+        cache_settings=cache_settings,
     )
     dataloader: DataLoader = DataLoader(
-        dataset, batch_size=None, num_workers=0
+        dataset, batch_size=None, num_workers=num_workers
     )
 
     return dataloader
@@ -94,12 +120,29 @@ def main():
 
     model = ESCModule.load_from_checkpoint(args.escher_ckpt)
 
-    entity_reader = EntityReader(args.documents_path)
-    entity_dict = entity_reader.read_all()
+    corpora = None
+    if args.partition_by_corpus:
+        corpora = set()
+        for filename in ("train.json", "val.json"):
+            mention_reader = MentionReader(
+                os.path.join(args.mentions_path, filename)
+            )
+            corpora.update(mention_reader.corpora())
+
+    entity_reader = EntityReader(
+        args.documents_path,
+        num_workers=args.entity_workers,
+        corpora=corpora,
+    )
+    if args.lazy_entities:
+        entity_dict = entity_reader.read_store()
+    else:
+        entity_dict = entity_reader.read_all()
     preprocessor = EscherPreprocessor(
         mention_window_size=args.mention_window_size,
         entity_length=args.entity_length,
         entity_dict=entity_dict,
+        max_tokens=args.tokens_per_batch,
     )
 
     train_dataloader = get_dataloader(
@@ -111,6 +154,11 @@ def main():
         re_init_on_iter=True,
         is_test=False,
         top_k=args.top_k_candidates,
+        num_workers=args.num_workers,
+        preprocessing_workers=args.preprocessing_workers,
+        candidate_generator_name=args.candidate_generator,
+        cache_dir=args.dataset_cache_dir,
+        cache_settings={"entities": entity_reader.fingerprint()},
     )
 
     val_dataloader = get_dataloader(
@@ -122,6 +170,11 @@ def main():
         re_init_on_iter=False,
         is_test=True,
         top_k=args.top_k_candidates,
+        num_workers=args.num_workers,
+        preprocessing_workers=args.preprocessing_workers,
+        candidate_generator_name=args.candidate_generator,
+        cache_dir=args.dataset_cache_dir,
+        cache_settings={"entities": entity_reader.fingerprint()},
     )
 
     model_checkpoint = ModelCheckpoint(
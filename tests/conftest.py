@@ -0,0 +1,106 @@
+import json
+import random
+
+import pytest
+from src.data.entity import Entity
+from src.data.mention import Mention
+from src.models.escher.esc.utils.definitions_tokenizer import get_tokenizer
+
+WORDS = (
+    "castle dragon sword knight river forest tower wizard ship island "
+    "storm crown battle queen shadow golden iron harbor mountain spirit"
+).split()
+
+
+@pytest.fixture
+def entity_dict():
+    rng = random.Random(0)
+    entities = {}
+    for world in ["alpha", "beta", "gamma"]:
+        for i in range(8):
+            document_id = f"{world}-{i}"
+            entities[document_id] = Entity(
+                title=" ".join(rng.sample(WORDS, 2)),
+                text=" ".join(rng.choices(WORDS, k=rng.randint(5, 40))),
+                document_id=document_id,
+                corpus=world,
+            )
+    return entities
+
+
+@pytest.fixture
+def documents_path(tmp_path, entity_dict):
+    # One JSON lines file per world, as in zeshel's documents directory
+    path = tmp_path / "documents"
+    path.mkdir()
+    for entity in entity_dict.values():
+        with open(path / f"{entity.corpus}.json", "a", encoding="utf-8") as f:
+            record = {
+                "title": entity.title,
+                "text": entity.text,
+                "document_id": entity.document_id,
+            }
+            f.write(json.dumps(record) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def mentions(entity_dict):
+    rng = random.Random(1)
+    entities = list(entity_dict.values())
+    mentions = []
+    for i in range(30):
+        context = rng.choice(entities)
+        label = rng.choice([e for e in entities if e.corpus == context.corpus])
+        start = rng.randrange(len(context.text.split(" ")))
+        mentions.append(
+            Mention(
+                category="LOW_OVERLAP",
+                text=label.title,
+                context_document_id=context.document_id,
+                label_document_id=label.document_id,
+                mention_id=f"m-{i}",
+                corpus=context.corpus,
+                start_index=start,
+                end_index=start,
+            )
+        )
+    return mentions
+
+
+@pytest.fixture(scope="session")
+def tokenizer_path(tmp_path_factory):
+    # A byte-level BART tokenizer with a small vocabulary, written locally
+    # so that the tests need no downloaded model
+    from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+
+    path = tmp_path_factory.mktemp("tokenizer")
+    vocabulary = ["<s>", "<pad>", "</s>", "<unk>"]
+    vocabulary += sorted(set(bytes_to_unicode().values()))
+    merges = []
+    for word in WORDS:
+        symbols = ["Ġ"] + list(word)
+        while len(symbols) > 1:
+            merge = symbols[:2]
+            symbols = ["".join(merge)] + symbols[2:]
+            if symbols[0] not in vocabulary:
+                merges.append(" ".join(merge))
+                vocabulary.append(symbols[0])
+    vocabulary.append("<mask>")
+
+    with open(path / "vocab.json", "w") as f:
+        json.dump({token: i for i, token in enumerate(vocabulary)}, f)
+    with open(path / "merges.txt", "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n" + "\n".join(merges) + "\n")
+    with open(path / "config.json", "w") as f:
+        json.dump({"model_type": "bart"}, f)
+    with open(path / "tokenizer_config.json", "w") as f:
+        json.dump(
+            {"tokenizer_class": "BartTokenizer", "model_max_length": 1024}, f
+        )
+    return str(path)
+
+
+@pytest.fixture
+def tokenizer(tokenizer_path):
+    return get_tokenizer(tokenizer_path, False)
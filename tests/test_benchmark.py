@@ -0,0 +1,59 @@
+from dataclasses import replace
+
+import pytest
+from src.candidate_generators import BaseCandidateEntityGenerator
+from src.candidate_generators.benchmark import benchmark
+
+
+class RankedGenerator(BaseCandidateEntityGenerator):
+    # Places each mention's gold entity at a fixed rank, or leaves it out
+    def __init__(self, entity_dict, gold_ranks):
+        BaseCandidateEntityGenerator.__init__(self, entity_dict)
+        self.gold_ranks = gold_ranks
+
+    def generate(self, mention):
+        rank = self.gold_ranks[mention.mention_id]
+        others = [
+            entity
+            for entity in self.entity_dict.values()
+            if entity.document_id != mention.label_document_id
+        ][:4]
+        if rank is not None:
+            others.insert(rank, self.entity_dict[mention.label_document_id])
+        return others
+
+
+@pytest.fixture
+def ranked_mentions(mentions):
+    corpora = ["alpha", "alpha", "alpha", "alpha", "beta", "beta"]
+    return [
+        replace(mention, corpus=corpus)
+        for mention, corpus in zip(mentions, corpora)
+    ]
+
+
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_recall_at_k(entity_dict, ranked_mentions, batch_size):
+    ranks = [0, 1, 3, None, 0, None]
+    generator = RankedGenerator(
+        entity_dict,
+        {m.mention_id: r for m, r in zip(ranked_mentions, ranks)},
+    )
+    report = benchmark(
+        generator, ranked_mentions, ks=[1, 2, 4], batch_size=batch_size
+    )
+
+    assert report["mentions"] == 6
+    assert report["recall"] == {1: 2 / 6, 2: 3 / 6, 4: 4 / 6}
+    assert report["recall_by_world"] == {
+        "alpha": {1: 1 / 4, 2: 2 / 4, 4: 3 / 4},
+        "beta": {1: 1 / 2, 2: 1 / 2, 4: 1 / 2},
+    }
+    assert report["mean_candidates"] == (5 * 4 + 4 * 2) / 6
+
+
+def test_no_mentions(entity_dict):
+    report = benchmark(RankedGenerator(entity_dict, {}), [], ks=[1, 8])
+    assert report["mentions"] == 0
+    assert report["recall"] == {1: 0.0, 8: 0.0}
+    assert report["recall_by_world"] == {}
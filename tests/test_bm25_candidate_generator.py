@@ -0,0 +1,101 @@
+from dataclasses import replace
+import os
+
+import pytest
+from src.candidate_generators import Bm25CandidateGenerator
+
+
+def document_ids(candidates):
+    return [[entity.document_id for entity in c] for c in candidates]
+
+
+def test_blocks_do_not_change_candidates(entity_dict, mentions):
+    # An unknown world is scored against every document
+    mentions = mentions + [replace(mentions[0], corpus="unknown")]
+    expected = Bm25CandidateGenerator(entity_dict, top_k=5, path=None)
+    blocked = Bm25CandidateGenerator(
+        entity_dict, top_k=5, path=None, block_size=1
+    )
+    assert document_ids(blocked.generate_batch(mentions)) == document_ids(
+        expected.generate_batch(mentions)
+    )
+    assert document_ids(blocked.generate_batch(mentions[-1:]))[0] == [
+        entity.document_id for entity in expected.generate(mentions[-1])
+    ]
+
+
+def test_candidates_stay_in_the_mention_world(entity_dict, mentions):
+    generator = Bm25CandidateGenerator(entity_dict, top_k=5, path=None)
+    for mention, candidates in zip(
+        mentions, generator.generate_batch(mentions)
+    ):
+        assert candidates
+        assert {entity.corpus for entity in candidates} == {mention.corpus}
+
+
+def test_saved_index_is_loaded(tmp_path, entity_dict, monkeypatch):
+    path = str(tmp_path / "bm25.npz")
+    Bm25CandidateGenerator(entity_dict, path=path)
+
+    def fail(self):
+        raise AssertionError("index rebuilt")
+
+    monkeypatch.setattr(Bm25CandidateGenerator, "build_index", fail)
+    Bm25CandidateGenerator(entity_dict, path=path)
+
+
+@pytest.mark.parametrize(
+    "change", [{"text": "castle castle"}, {"title": "new"}, {"corpus": "beta"}]
+)
+def test_saved_index_is_rebuilt_when_content_changes(
+    tmp_path, entity_dict, mentions, change
+):
+    path = str(tmp_path / "bm25.npz")
+    Bm25CandidateGenerator(entity_dict, path=path)
+
+    entity_dict["alpha-0"] = replace(entity_dict["alpha-0"], **change)
+    expected = Bm25CandidateGenerator(entity_dict, top_k=5, path=None)
+    reloaded = Bm25CandidateGenerator(entity_dict, top_k=5, path=path)
+    assert document_ids(reloaded.generate_batch(mentions)) == document_ids(
+        expected.generate_batch(mentions)
+    )
+    assert reloaded.posting_weights.tolist() == (
+        expected.posting_weights.tolist()
+    )
+
+
+def test_saved_index_is_rebuilt_when_parameters_change(tmp_path, entity_dict):
+    path = str(tmp_path / "bm25.npz")
+    Bm25CandidateGenerator(entity_dict, path=path)
+    expected = Bm25CandidateGenerator(entity_dict, k1=2.0, path=None)
+    reloaded = Bm25CandidateGenerator(entity_dict, k1=2.0, path=path)
+    assert reloaded.posting_weights.tolist() == (
+        expected.posting_weights.tolist()
+    )
+
+
+def test_entity_sets_keep_their_own_index(tmp_path, entity_dict, monkeypatch):
+    path = str(tmp_path / "bm25.npz")
+    alpha = {i: e for i, e in entity_dict.items() if e.corpus == "alpha"}
+    Bm25CandidateGenerator(entity_dict, path=path)
+    Bm25CandidateGenerator(alpha, path=path)
+    assert len(os.listdir(tmp_path)) == 2
+
+    def fail(self):
+        raise AssertionError("index rebuilt")
+
+    monkeypatch.setattr(Bm25CandidateGenerator, "build_index", fail)
+    assert (
+        len(Bm25CandidateGenerator(entity_dict, path=path).document_ids) == 24
+    )
+    assert len(Bm25CandidateGenerator(alpha, path=path).document_ids) == 8
+
+
+def test_failed_save_leaves_no_tmp_file(tmp_path, entity_dict, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        Bm25CandidateGenerator(entity_dict, path=str(tmp_path / "bm25.npz"))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,125 @@
+from dataclasses import replace
+import pickle
+
+import pytest
+from src.candidate_generators import (
+    Bm25CandidateGenerator,
+    CachedCandidateGenerator,
+    apply_entity_delta,
+)
+from src.data.delta import EntityDelta, VersionedEntityDict
+
+SETTINGS = {"entities": {"path": "documents", "size": 1}}
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache.json")
+
+
+@pytest.fixture
+def make_cache(entity_dict, cache_path):
+    def make(settings=SETTINGS, max_size=100000, **kwargs):
+        versioned = VersionedEntityDict(entity_dict)
+        generator = Bm25CandidateGenerator(
+            versioned, top_k=5, path=None, **kwargs
+        )
+        cache = CachedCandidateGenerator(
+            generator, max_size=max_size, path=cache_path, settings=settings
+        )
+        return versioned, cache
+
+    return make
+
+
+def test_hits_and_evictions(make_cache, mentions):
+    _, cache = make_cache(max_size=10)
+    cache.generate_batch(mentions[:20])
+    cache.generate_batch(mentions[10:20])
+    assert cache.stats()["hits"] == 10
+    assert cache.stats()["misses"] == 20
+    assert cache.stats()["evictions"] == 10
+    assert cache.stats()["size"] == 10
+
+
+def test_cached_candidates_match_the_generator(make_cache, mentions):
+    _, cache = make_cache()
+    expected = cache.candidate_generator.generate_batch(mentions)
+    cache.generate_batch(mentions)
+    assert cache.generate_batch(mentions) == expected
+
+
+def test_saved_cache_is_loaded(make_cache, mentions):
+    _, cache = make_cache()
+    cache.generate_batch(mentions)
+    cache.save()
+
+    _, cache = make_cache()
+    assert len(cache.cache) == len(mentions)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"settings": {"entities": {"path": "documents", "size": 2}}},
+        {"settings": {}},
+        {"b": 0.5},
+        {"k1": 2.0},
+    ],
+)
+def test_saved_cache_is_ignored_when_settings_change(
+    make_cache, mentions, change
+):
+    _, cache = make_cache()
+    cache.generate_batch(mentions)
+    cache.save()
+
+    _, cache = make_cache(**change)
+    assert len(cache.cache) == 0
+
+
+def test_saved_cache_is_keyed_on_delta_content(
+    make_cache, entity_dict, mentions
+):
+    modified = EntityDelta(
+        upserts=[replace(entity_dict["alpha-0"], text="castle castle")]
+    )
+    deleted = EntityDelta(deletes=["alpha-0"])
+
+    versioned, cache = make_cache()
+    apply_entity_delta(versioned, cache, modified)
+    cache.generate_batch(mentions)
+    cache.save()
+
+    # Before the delta, and after another delta of the same size
+    _, cache = make_cache()
+    assert len(cache.cache) == 0
+    versioned, cache = make_cache()
+    apply_entity_delta(versioned, cache, deleted)
+    assert len(cache.cache) == 0
+
+    versioned, cache = make_cache()
+    apply_entity_delta(versioned, cache, modified)
+    assert len(cache.cache) == len(mentions)
+
+
+def test_applying_a_delta_clears_the_cache(make_cache, mentions):
+    versioned, cache = make_cache()
+    cache.generate_batch(mentions)
+    apply_entity_delta(versioned, cache, EntityDelta(deletes=["alpha-0"]))
+    assert len(cache.cache) == 0
+    for candidates in cache.generate_batch(mentions):
+        assert "alpha-0" not in [entity.document_id for entity in candidates]
+
+
+def test_pickled_copy_keeps_its_entries(make_cache, mentions):
+    _, cache = make_cache()
+    cache.generate_batch(mentions[:10])
+
+    copy = pickle.loads(pickle.dumps(cache))
+    assert list(copy.cache) == list(cache.cache)
+    copy.generate_batch(mentions)
+    assert copy.stats()["hits"] == 10
+    assert copy.stats()["misses"] == 30
+    # Lookups made by the copy are not seen by the original
+    assert cache.stats()["misses"] == 10
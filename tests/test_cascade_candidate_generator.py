@@ -0,0 +1,92 @@
+import pytest
+from src.candidate_generators import (
+    BaseCandidateEntityGenerator,
+    CascadeCandidateGenerator,
+)
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+
+class StaticGenerator(BaseCandidateEntityGenerator):
+    def __init__(self, entity_dict, document_ids):
+        BaseCandidateEntityGenerator.__init__(self, entity_dict)
+        self.document_ids = document_ids
+
+    def generate(self, mention):
+        return [self.entity_dict[i] for i in self.document_ids]
+
+
+@pytest.fixture
+def entities():
+    entities = [
+        Entity("Context", "the dragon flew over the castle", "ctx"),
+        # title 0, context 0
+        Entity("Iron Sword", "a blade", "a"),
+        # title 0, context 0; ties with a
+        Entity("Stone", "bridge", "d"),
+        # title 1/2, context 1/2
+        Entity("Red Dragon", "castle keep", "c"),
+        # title 1, context 2/2
+        Entity("Dragon", "flew over", "b"),
+    ]
+    return {entity.document_id: entity for entity in entities}
+
+
+def mention(label_document_id, mention_id="m"):
+    return Mention(
+        category="LOW_OVERLAP",
+        text="Dragon",
+        context_document_id="ctx",
+        label_document_id=label_document_id,
+        mention_id=mention_id,
+        corpus=None,
+        start_index=1,
+        end_index=1,
+    )
+
+
+def document_ids(candidates):
+    return [entity.document_id for entity in candidates]
+
+
+def test_pruning_order(entities):
+    wrapped = StaticGenerator(entities, ["a", "d", "c", "b"])
+    cascade = CascadeCandidateGenerator(wrapped, top_k=3)
+
+    candidates = cascade.generate(mention("b"))
+    scores = cascade.score(mention("b"), candidates)
+    assert document_ids(candidates) == ["b", "c", "a"]
+    assert scores == [3.0, 1.5, 0.0]
+
+    cascade.top_k = 10
+    assert document_ids(cascade.generate(mention("b"))) == [
+        "b",
+        "c",
+        "a",
+        "d",
+    ]
+
+
+def test_recall_cost(entities):
+    wrapped = StaticGenerator(entities, ["a", "d", "c", "b"])
+    cascade = CascadeCandidateGenerator(wrapped, top_k=3)
+    assert cascade.stats()["recall_cost"] == 0.0
+
+    # Gold kept, gold pruned, gold never retrieved
+    mentions = [
+        mention("b", "m-0"),
+        mention("d", "m-1"),
+        mention("ctx", "m-2"),
+    ]
+    cascade.generate_batch(mentions)
+    expected = {
+        "mentions": 3,
+        "recall_before": 2 / 3,
+        "recall_after": 1 / 3,
+        "recall_cost": 1 / 3,
+    }
+    assert cascade.stats() == expected
+
+    # Seeing the same mentions again leaves the ratios unchanged
+    cascade.generate_batch(mentions)
+    assert cascade.stats() == {**expected, "mentions": 6}
@@ -0,0 +1,116 @@
+from dataclasses import replace
+import multiprocessing
+import pickle
+
+import pytest
+from src.candidate_generators import (
+    Bm25CandidateGenerator,
+    apply_entity_delta,
+)
+from src.data.delta import EntityDelta, VersionedEntityDict
+from src.data.mention import MentionStore
+from src.models.escher.dataset import EscherDataset
+from src.models.escher.preprocessor import EscherPreprocessor
+
+pytestmark = pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="preprocessing workers are forked",
+)
+
+
+@pytest.fixture
+def make_dataset(entity_dict, mentions, tokenizer):
+    entities = VersionedEntityDict(entity_dict)
+    generator = Bm25CandidateGenerator(entities, top_k=8, path=None)
+
+    def make(preprocessing_workers=0, tokens_per_batch=1024, **kwargs):
+        return EscherDataset(
+            tokens_per_batch,
+            True,
+            EscherPreprocessor(8, 24, entities, tokenizer=tokenizer),
+            generator,
+            MentionStore.from_mentions(mentions),
+            tokenizer=tokenizer,
+            is_test=True,
+            generation_batch_size=8,
+            preprocessing_workers=preprocessing_workers,
+            **kwargs,
+        )
+
+    return make
+
+
+def elements(dataset):
+    dataset.init_dataset()
+    return [
+        (e.element_id, e.encoded_final_sequence.tolist(), e.gloss_positions)
+        for e in dataset.data_store
+    ]
+
+
+def test_parallel_preprocessing_matches_serial(make_dataset):
+    dataset = make_dataset(2)
+    try:
+        assert elements(dataset) == elements(make_dataset(0))
+    finally:
+        dataset.close()
+
+
+def test_preprocessing_pool_is_kept_across_epochs(make_dataset):
+    dataset = make_dataset(2)
+    try:
+        first_epoch = elements(dataset)
+        executor = dataset.executor
+        assert elements(dataset) == first_epoch
+        assert dataset.executor is executor
+
+        # Workers forked before a delta hold the old entities
+        entity = dataset.candidate_generator.entity_dict["alpha-7"]
+        apply_entity_delta(
+            dataset.candidate_generator.entity_dict,
+            dataset.candidate_generator,
+            EntityDelta(upserts=[replace(entity, text="castle " * 30)]),
+        )
+        serial = make_dataset(0)
+        assert elements(dataset) == elements(serial) != first_epoch
+        assert dataset.executor is not executor
+
+        assert pickle.loads(pickle.dumps(dataset)).executor is None
+    finally:
+        dataset.close()
+    assert dataset.executor is None
+
+
+def batch_elements(batch):
+    return list(zip(batch["element_ids"], batch["sequences"].tolist()))
+
+
+def test_stream_with_a_large_buffer_matches_materialized(make_dataset):
+    materialized = [batch_elements(batch) for batch in make_dataset()]
+    streamed = make_dataset(stream=True, stream_buffer_size=1000)
+    assert [batch_elements(batch) for batch in streamed] == materialized
+    assert len(materialized) > 1
+
+
+@pytest.mark.parametrize("tokens_per_batch", [180, 400])
+def test_stream_with_a_small_buffer(make_dataset, tokens_per_batch):
+    # Elements have 141 to 201 tokens: with 180 tokens per batch, some are
+    # dropped; with 400, up to two share a batch
+    materialized = make_dataset(tokens_per_batch=tokens_per_batch)
+    expected = sorted(
+        element_id
+        for batch in materialized
+        for element_id in batch["element_ids"]
+    )
+
+    streamed = make_dataset(
+        tokens_per_batch=tokens_per_batch, stream=True, stream_buffer_size=4
+    )
+    element_ids = []
+    for batch in streamed:
+        # Padded to the longest sequence of the batch
+        assert batch["sequences"].numel() <= tokens_per_batch
+        element_ids.extend(batch["element_ids"])
+    assert sorted(element_ids) == expected
+    assert len(set(element_ids)) == len(element_ids)
+    assert streamed.data_store == []
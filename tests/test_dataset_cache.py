@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from src.models.escher.dataset_cache import DatasetCache
+from src.models.escher.esc.esc_dataset import DataElement
+
+SETTINGS = {"split": {"path": "val.json", "size": 1}}
+
+
+def make_elements(count, token_type_ids=True):
+    elements = []
+    for i in range(count):
+        length = 3 + i % 4
+        elements.append(
+            DataElement(
+                encoded_final_sequence=torch.arange(length) + 100 * i,
+                start_position=1,
+                end_position=2 + i % 2,
+                possible_offsets=[f"doc-{i}", f"doc-{i + 1}"],
+                gold_labels=[f"doc-{i}"],
+                gloss_positions=[(1, 2), (2, 2 + i % 2)][: 1 + i % 2],
+                token_type_ids=(
+                    torch.arange(length) % 2 if token_type_ids else None
+                ),
+                element_id=f"m-{i}",
+            )
+        )
+    return elements
+
+
+def assert_equal(read, written):
+    assert len(read) == len(written)
+    for a, b in zip(read, written):
+        assert a.encoded_final_sequence.tolist() == (
+            b.encoded_final_sequence.tolist()
+        )
+        if b.token_type_ids is None:
+            assert a.token_type_ids is None
+        else:
+            assert a.token_type_ids.tolist() == b.token_type_ids.tolist()
+        assert a.gloss_positions == b.gloss_positions
+        assert a.possible_offsets == b.possible_offsets
+        assert a.gold_labels == b.gold_labels
+        assert a.start_position == b.start_position
+        assert a.end_position == b.end_position
+        assert a.element_id == b.element_id
+
+
+@pytest.mark.parametrize("count", [0, 1, 4, 5])
+@pytest.mark.parametrize("token_type_ids", [True, False])
+def test_round_trip(tmp_path, count, token_type_ids):
+    # Shards of two elements, so that 4 and 5 elements end on and across
+    # a shard boundary
+    elements = make_elements(count, token_type_ids)
+    DatasetCache(str(tmp_path), SETTINGS, shard_size=2).write(elements)
+
+    cache = DatasetCache(str(tmp_path), SETTINGS, shard_size=2)
+    assert_equal(cache.read(), elements)
+    # Nothing is left of the temporary directory
+    assert os.listdir(tmp_path) == [os.path.basename(cache.path)]
+
+
+def test_other_settings_miss(tmp_path):
+    DatasetCache(str(tmp_path), SETTINGS).write(make_elements(3))
+    assert DatasetCache(str(tmp_path), {"split": "test.json"}).read() is None
+
+
+@pytest.mark.parametrize(
+    "damage",
+    [
+        lambda path: os.remove(os.path.join(path, "tokens-1.npy")),
+        lambda path: os.remove(os.path.join(path, "labels-0.json")),
+        lambda path: open(os.path.join(path, "offsets-2.npy"), "w").close(),
+        lambda path: open(os.path.join(path, "metadata.json"), "w").close(),
+        lambda path: open(os.path.join(path, "labels-1.json"), "w").write(
+            "[]"
+        ),
+    ],
+)
+def test_damaged_cache_is_a_miss(tmp_path, damage):
+    cache = DatasetCache(str(tmp_path), SETTINGS, shard_size=2)
+    cache.write(make_elements(5))
+    damage(cache.path)
+    assert cache.read() is None
+
+
+def test_failed_write_is_skipped(tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(np, "save", fail)
+    cache = DatasetCache(str(tmp_path), SETTINGS)
+    cache.write(make_elements(3))
+
+    assert os.listdir(tmp_path) == []
+    assert cache.read() is None
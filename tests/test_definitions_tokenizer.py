@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+from src.models.escher.esc.utils.definitions_tokenizer import (
+    GLOSS_END_TOKEN,
+    GLOSS_START_TOKEN,
+    get_tokenizer,
+    last_token_indices,
+)
+from src.models.escher.preprocessor import EscherPreprocessor
+
+
+def reference_sample(tokenizer, context_sentence, definitions):
+    # prepare_sample as it was before batching: one encode_plus per sample
+    # and the offsets resolved through dictionaries
+    if tokenizer.use_special_tokens:
+        definitions_seq = "".join(
+            f"{GLOSS_START_TOKEN} {definition}{GLOSS_END_TOKEN}"
+            for definition in definitions
+        )
+        input_ids, _, token_type_ids = tokenizer.encode_pair(
+            context_sentence, definitions_seq
+        )
+        input_ids = input_ids[input_ids != tokenizer.space_token_id]
+        positions = list(
+            zip(
+                (
+                    i
+                    for i, token_id in enumerate(input_ids)
+                    if token_id == tokenizer.gloss_start_token_id
+                ),
+                (
+                    i
+                    for i, token_id in enumerate(input_ids)
+                    if token_id == tokenizer.gloss_end_token_id
+                ),
+            )
+        )
+        return input_ids, positions, token_type_ids
+
+    definitions_offsets = []
+    for i, definition in enumerate(definitions):
+        start = definitions_offsets[i - 1][1] + 1 if i > 0 else 0
+        definitions_offsets.append((start, start + len(definition)))
+
+    input_ids, offsets, token_type_ids = tokenizer.encode_pair(
+        context_sentence, " ".join(definitions)
+    )
+    context_offset = [
+        i
+        for i, offset in enumerate(offsets[:-1])
+        if sum(offset) + sum(offsets[i + 1]) == 0
+    ][0] + 2
+    start_tokens, end_tokens = {}, {}
+    for i, (start, end) in enumerate(offsets[context_offset:-1]):
+        start_tokens[start] = i
+        end_tokens[end] = i
+
+    positions = [
+        (
+            context_offset + start_tokens[start],
+            context_offset + end_tokens[end],
+        )
+        for start, end in definitions_offsets
+    ]
+    return input_ids, positions, token_type_ids
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "special_tokens"])
+def definitions_tokenizer(request, tokenizer_path):
+    return get_tokenizer(tokenizer_path, request.param)
+
+
+@pytest.fixture
+def samples(entity_dict, mentions, tokenizer):
+    preprocessor = EscherPreprocessor(8, 24, entity_dict, tokenizer)
+    entities = list(entity_dict.values())
+    contexts, definitions = [], []
+    for i, mention in enumerate(mentions):
+        contexts.append(preprocessor.preprocess_mention(mention))
+        definitions.append(
+            [
+                preprocessor.preprocess_entity(entity)
+                for entity in entities[i : i + i % 9]
+            ]
+        )
+    contexts += ["x <classify> y </classify> z"] * 3
+    definitions += [["日本語 テキスト", "é"], ["a,b", "c.", "(d)"], ["single"]]
+    return contexts, definitions
+
+
+def assert_same_sample(sample, expected):
+    assert sample[0].tolist() == expected[0].tolist()
+    assert list(sample[1]) == list(expected[1])
+    if expected[2] is None:
+        assert sample[2] is None
+    else:
+        assert sample[2].tolist() == expected[2].tolist()
+
+
+def test_batched_samples_match_per_sample_encoding(
+    definitions_tokenizer, samples
+):
+    contexts, definitions = samples
+    if not definitions_tokenizer.use_special_tokens:
+        # An empty candidate list has no definitions sequence to locate
+        contexts, definitions = zip(
+            *[(c, d) for c, d in zip(contexts, definitions) if d]
+        )
+
+    batched = definitions_tokenizer.prepare_samples(
+        list(contexts), list(definitions)
+    )
+    assert len(batched) == len(contexts)
+    for sample, context, sample_definitions in zip(
+        batched, contexts, definitions
+    ):
+        expected = reference_sample(
+            definitions_tokenizer, context, sample_definitions
+        )
+        assert_same_sample(sample, expected)
+        assert_same_sample(
+            definitions_tokenizer.prepare_sample(context, sample_definitions),
+            expected,
+        )
+
+
+def test_batch_of_no_samples(definitions_tokenizer):
+    assert definitions_tokenizer.prepare_samples([], []) == []
+
+
+def test_last_token_indices():
+    token_offsets = np.array([0, 0, 2, 5, 5, 9])
+    np.testing.assert_array_equal(
+        last_token_indices(token_offsets, np.array([0, 5, 9, 2])),
+        [1, 4, 5, 2],
+    )
+    with pytest.raises(KeyError):
+        last_token_indices(token_offsets, np.array([3]))
+
+
+def test_last_token_indices_of_unsorted_offsets():
+    token_offsets = np.array([4, 0, 4, 2])
+    np.testing.assert_array_equal(
+        last_token_indices(token_offsets, np.array([4, 0, 2])), [2, 1, 3]
+    )
+    with pytest.raises(KeyError):
+        last_token_indices(token_offsets, np.array([1]))
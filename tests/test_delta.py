@@ -0,0 +1,209 @@
+from dataclasses import asdict, replace
+import json
+import os
+
+import numpy as np
+import pytest
+from src.candidate_generators import (
+    Bm25CandidateGenerator,
+    CachedCandidateGenerator,
+    CascadeCandidateGenerator,
+    FusionCandidateGenerator,
+    TfidfCandidateGenerator,
+    TitleMatchCandidateGenerator,
+    TruncatedCandidateGenerator,
+    apply_entity_delta,
+)
+from src.data.delta import EntityDelta, VersionedEntityDict, read_delta
+from src.data.entity import Entity
+from src.data.mention import Mention
+
+DELETED = ["alpha-0", "beta-2"]
+
+
+@pytest.fixture
+def delta(entity_dict):
+    return EntityDelta(
+        upserts=[
+            replace(
+                entity_dict["alpha-1"],
+                title="zebra unicorn",
+                text="zebra unicorn meadow",
+            ),
+            Entity("zebra", "zebra meadow", "alpha-new", corpus="alpha"),
+        ],
+        deletes=DELETED,
+    )
+
+
+def zebra_mentions():
+    return [
+        Mention(
+            category="LOW_OVERLAP",
+            text=text,
+            context_document_id="alpha-3",
+            label_document_id=label_document_id,
+            mention_id=f"zebra-{i}",
+            corpus="alpha",
+            start_index=0,
+            end_index=0,
+        )
+        for i, (text, label_document_id) in enumerate(
+            [("zebra unicorn", "alpha-1"), ("zebra", "alpha-new")]
+        )
+    ]
+
+
+def test_snapshot(entity_dict, delta):
+    versioned = VersionedEntityDict(entity_dict)
+    before = versioned.snapshot()
+    assert versioned.apply(delta) == 1
+
+    assert "alpha-0" not in versioned and "beta-2" not in versioned
+    with pytest.raises(KeyError):
+        versioned["alpha-0"]
+    assert versioned["alpha-1"].title == "zebra unicorn"
+    assert versioned["alpha-new"].text == "zebra meadow"
+    assert len(versioned) == len(entity_dict) - 1
+    assert set(versioned) == (set(entity_dict) - set(DELETED)) | {"alpha-new"}
+
+    # Readers holding the old snapshot still see the entities before it
+    assert before.version == 0
+    assert before["alpha-1"] == entity_dict["alpha-1"]
+    assert before["alpha-0"] == entity_dict["alpha-0"]
+    assert "alpha-new" not in before
+    assert len(before) == len(list(before)) == len(entity_dict)
+
+
+def test_later_deltas(entity_dict, delta):
+    versioned = VersionedEntityDict(entity_dict)
+    versioned.apply(delta)
+    versioned.apply(
+        EntityDelta(
+            upserts=[entity_dict["alpha-0"]], deletes=["alpha-new", "alpha-1"]
+        )
+    )
+
+    assert versioned.version == 2
+    assert versioned["alpha-0"] == entity_dict["alpha-0"]
+    assert "alpha-new" not in versioned and "alpha-1" not in versioned
+    assert set(versioned) == set(entity_dict) - {"alpha-1", "beta-2"}
+    assert len(versioned) == len(list(versioned)) == len(entity_dict) - 2
+
+
+def test_read_delta(tmp_path, delta):
+    path = str(tmp_path / "delta.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for entity in delta.upserts:
+            f.write(json.dumps(asdict(entity)) + "\n")
+        f.write("\n")
+        for document_id in delta.deletes:
+            record = {"document_id": document_id, "deleted": True}
+            f.write(json.dumps(record) + "\n")
+
+    read = read_delta(path)
+    assert read == delta
+    assert read.fingerprint() == delta.fingerprint()
+    assert read.fingerprint() != EntityDelta(deletes=DELETED).fingerprint()
+
+
+def bm25(entities):
+    return Bm25CandidateGenerator(entities, top_k=5, path=None)
+
+
+GENERATORS = {
+    "bm25": bm25,
+    "title": lambda entities: TitleMatchCandidateGenerator(entities),
+    "title_bm25": lambda entities: TitleMatchCandidateGenerator(
+        entities, bm25(entities)
+    ),
+    "cached": lambda entities: CachedCandidateGenerator(bm25(entities)),
+    "cascade": lambda entities: CascadeCandidateGenerator(
+        bm25(entities), top_k=3
+    ),
+    "truncated": lambda entities: TruncatedCandidateGenerator(
+        bm25(entities), 3
+    ),
+    "fusion": lambda entities: FusionCandidateGenerator(
+        [bm25(entities), TitleMatchCandidateGenerator(entities)], top_k=5
+    ),
+}
+
+
+@pytest.mark.parametrize("name", GENERATORS)
+def test_generators_follow_the_delta(entity_dict, mentions, delta, name):
+    versioned = VersionedEntityDict(entity_dict)
+    generator = GENERATORS[name](versioned)
+    queries = mentions + zebra_mentions()
+    before = generator.generate_batch(queries)
+    assert any(
+        entity.document_id in DELETED
+        for candidates in before
+        for entity in candidates
+    )
+
+    apply_entity_delta(versioned, generator, delta)
+    after = generator.generate_batch(queries)
+    for candidates in after:
+        assert not {entity.document_id for entity in candidates} & set(DELETED)
+
+    zebra = {entity.document_id: entity for c in after[-2:] for entity in c}
+    assert {"alpha-1", "alpha-new"} <= set(zebra)
+    assert zebra["alpha-1"].title == "zebra unicorn"
+
+    if name == "fusion":
+        generator.close()
+
+
+def test_tfidf_follows_the_delta(tmp_path, entity_dict, mentions, delta):
+    path = str(tmp_path / "tfidf_candidates")
+    os.makedirs(path)
+    with open(os.path.join(path, "val.json"), "w") as f:
+        record = {
+            "mention_id": mentions[0].mention_id,
+            "tfidf_candidates": ["alpha-0", "alpha-1", "beta-2", "beta-3"],
+        }
+        f.write(json.dumps(record) + "\n")
+
+    versioned = VersionedEntityDict(entity_dict)
+    generator = TfidfCandidateGenerator(
+        versioned, filename="val.json", path=path
+    )
+    apply_entity_delta(versioned, generator, delta)
+
+    # Precomputed lists cannot gain the added entity
+    candidates = generator.generate(mentions[0])
+    assert [entity.document_id for entity in candidates] == [
+        "alpha-1",
+        "beta-3",
+    ]
+    assert candidates[0].title == "zebra unicorn"
+    assert generator.generate_batch(mentions[:1]) == [candidates]
+
+
+def test_bm25_segment_scores_match_a_full_rebuild(entity_dict, mentions):
+    # Upserting the alpha entities unchanged moves them from the base index
+    # to the segment without changing the corpus statistics, so both must
+    # score them as a rebuilt index does
+    alpha = [e for e in entity_dict.values() if e.corpus == "alpha"]
+    versioned = VersionedEntityDict(entity_dict)
+    generator = bm25(versioned)
+    apply_entity_delta(versioned, generator, EntityDelta(upserts=alpha))
+    _, tombstones, segment = generator.state
+    assert tombstones.sum() == len(alpha)
+    assert [entity.document_id for entity in segment.entities] == [
+        entity.document_id for entity in alpha
+    ]
+
+    rebuilt = bm25(dict(versioned))
+    start, end = rebuilt.corpus_ranges["alpha"]
+    rows = [rebuilt.document_ids.index(e.document_id) for e in alpha]
+    queries = [m for m in mentions if m.corpus == "alpha"] + zebra_mentions()
+    for mention in queries:
+        scores, offset = rebuilt.score(mention)
+        assert offset == start
+        np.testing.assert_allclose(
+            segment.score(generator.query_counts(mention), "alpha"),
+            scores[np.array(rows) - start],
+        )
+        assert generator.generate(mention) == rebuilt.generate(mention)
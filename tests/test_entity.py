@@ -0,0 +1,90 @@
+import json
+import pickle
+
+import pytest
+from src.data.entity import EntityReader
+from src.data.mention import MentionReader
+
+
+def test_store_matches_read_all(documents_path, entity_dict):
+    reader = EntityReader(documents_path, use_snapshots=False)
+    entities = reader.read_all()
+    assert entities == entity_dict
+
+    store = reader.read_store()
+    try:
+        assert len(store) == len(entities)
+        assert sorted(store) == sorted(entities)
+        assert dict(store.items()) == entities
+        for document_id, entity in entities.items():
+            assert document_id in store
+            assert store[document_id] == entity
+        assert "missing" not in store
+        with pytest.raises(KeyError):
+            store["missing"]
+    finally:
+        store.close()
+
+
+def test_store_survives_pickling(documents_path, entity_dict):
+    store = EntityReader(documents_path).read_store()
+    copy = pickle.loads(pickle.dumps(store))
+    try:
+        assert dict(copy.items()) == entity_dict
+    finally:
+        store.close()
+        copy.close()
+
+
+def test_store_skips_blank_lines(tmp_path):
+    path = tmp_path / "documents"
+    path.mkdir()
+    (path / "empty.json").write_text("")
+    (path / "world.json").write_text(
+        '{"title": "A", "text": "a", "document_id": "1"}\n\n'
+        '{"title": "B", "text": "b \\\\\\" c", "document_id": "2"}'
+    )
+    store = EntityReader(str(path)).read_store()
+    try:
+        assert list(store) == ["1", "2"]
+        assert store["2"].text == 'b \\" c'
+        assert store["2"].corpus == "world"
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("use_snapshots", [False, True])
+def test_parallel_read_matches_serial(documents_path, use_snapshots):
+    serial = EntityReader(documents_path, use_snapshots=use_snapshots)
+    parallel = EntityReader(
+        documents_path, use_snapshots=use_snapshots, num_workers=2
+    )
+    expected = list(serial)
+    # Twice, so that the second parallel read comes from the snapshots
+    assert list(parallel) == expected
+    assert list(parallel) == expected
+    assert list(parallel.read_all()) == [e.document_id for e in expected]
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_corpus_filtered_read(
+    documents_path, entity_dict, mentions, tmp_path, num_workers
+):
+    mentions_path = tmp_path / "val.json"
+    with open(mentions_path, "w") as f:
+        for mention in mentions:
+            if mention.corpus != "beta":
+                f.write(json.dumps(mention.__dict__) + "\n")
+    corpora = MentionReader(str(mentions_path)).corpora()
+    assert corpora == {"alpha", "gamma"}
+
+    reader = EntityReader(
+        documents_path, num_workers=num_workers, corpora=corpora
+    )
+    assert sorted(reader.corpus_files()) == ["alpha", "beta", "gamma"]
+    assert reader.read_all() == {
+        document_id: entity
+        for document_id, entity in entity_dict.items()
+        if entity.corpus in corpora
+    }
+    assert sorted(reader.fingerprint()) == reader.files()
@@ -0,0 +1,138 @@
+from argparse import Namespace
+import json
+import sys
+
+import pytest
+from src.candidate_generators import (
+    BaseCandidateEntityGenerator,
+    TruncatedCandidateGenerator,
+)
+from src.data.mention import MentionReader, MentionStore
+
+try:
+    from src.models.escher.esc.predict import (
+        InstancePredictionReport,
+        PredictionReport,
+    )
+    from src.models.escher.evaluate import adaptive_predict, parse_args
+except (ImportError, AttributeError):
+    # ESCModule is written against the pytorch-lightning version pinned in
+    # requirements.txt
+    pytest.skip("needs the pinned pytorch-lightning", allow_module_level=True)
+
+
+class StaticGenerator(BaseCandidateEntityGenerator):
+    def generate(self, mention):
+        return []
+
+
+def report(mention_id, predicted, gold, margin, length):
+    return InstancePredictionReport(
+        sequence=[0] * length,
+        possible_synsets=[predicted, gold],
+        predicted_synsets=[predicted],
+        gold_synsets=[gold],
+        predicted_synsets_indices=[],
+        gold_synsets_indices=[],
+        possible_synsets_indices=[],
+        most_probable_start_index=0,
+        most_probable_end_index=0,
+        predicted_start_indices_logits=None,
+        predicted_end_indices_logits=None,
+        element_id=mention_id,
+        margin=margin,
+    )
+
+
+def test_confident_predictions_are_kept_and_the_rest_rerun(
+    tmp_path, entity_dict, mentions
+):
+    path = str(tmp_path / "val.json")
+    with open(path, "w", encoding="utf-8") as f:
+        for mention in mentions[:6]:
+            f.write(json.dumps(mention.__dict__) + "\n")
+
+    # m-0 and m-1 are confident, m-2 and m-3 are not, m-4 and m-5 were
+    # dropped because their gold entity was not among the first candidates
+    margins = {"m-0": 0.9, "m-1": 0.5, "m-2": 0.49, "m-3": 0.0}
+    calls = []
+
+    def run(candidate_generator, mention_reader):
+        calls.append((candidate_generator, list(mention_reader)))
+        if len(calls) == 1:
+            assert isinstance(candidate_generator, TruncatedCandidateGenerator)
+            instances = [
+                report(i, "wrong", "gold", margin, 10)
+                for i, margin in margins.items()
+            ]
+        else:
+            assert isinstance(mention_reader, MentionStore)
+            instances = [
+                report(m.mention_id, "gold", "gold", 1.0, 100)
+                for m in mention_reader
+            ]
+        return PredictionReport(instances, None)
+
+    generator = StaticGenerator(entity_dict)
+    args = Namespace(adaptive_top_k=2, confidence_margin=0.5)
+    prediction_report, tokens_encoded = adaptive_predict(
+        run, generator, MentionReader(path), args
+    )
+
+    assert len(calls) == 2
+    assert calls[1][0] is generator
+    assert [m.mention_id for m in calls[1][1]] == ["m-2", "m-3", "m-4", "m-5"]
+
+    instances = prediction_report.instances_prediction_reports
+    assert [i.element_id for i in instances] == [f"m-{i}" for i in range(6)]
+    assert [i.predicted_synsets[0] for i in instances] == ["wrong"] * 2 + [
+        "gold"
+    ] * 4
+    assert tokens_encoded == 4 * 10 + 4 * 100
+    assert prediction_report.scores_report.recall == pytest.approx(400 / 6)
+
+
+def test_no_rerun_when_every_mention_is_confident(
+    tmp_path, entity_dict, mentions
+):
+    path = str(tmp_path / "val.json")
+    with open(path, "w", encoding="utf-8") as f:
+        for mention in mentions[:3]:
+            f.write(json.dumps(mention.__dict__) + "\n")
+
+    calls = []
+
+    def run(candidate_generator, mention_reader):
+        calls.append(candidate_generator)
+        return PredictionReport(
+            [
+                report(m.mention_id, "gold", "gold", 1.0, 10)
+                for m in mentions[:3]
+            ],
+            None,
+        )
+
+    args = Namespace(adaptive_top_k=2, confidence_margin=0.5)
+    prediction_report, tokens_encoded = adaptive_predict(
+        run, StaticGenerator(entity_dict), MentionReader(path), args
+    )
+
+    assert len(calls) == 1
+    assert len(prediction_report.instances_prediction_reports) == 3
+    assert tokens_encoded == 30
+
+
+def test_adaptive_top_k_needs_a_margin(monkeypatch):
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "evaluate.py",
+            "--adaptive_top_k",
+            "16",
+            "--prediction_type",
+            "split",
+        ],
+    )
+    with pytest.raises(SystemExit):
+        parse_args()
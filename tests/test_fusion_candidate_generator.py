@@ -0,0 +1,131 @@
+import time
+
+import pytest
+from src.candidate_generators import (
+    BaseCandidateEntityGenerator,
+    FusionCandidateGenerator,
+)
+
+
+class StaticGenerator(BaseCandidateEntityGenerator):
+    def __init__(self, entity_dict, document_ids, delay=0.0):
+        BaseCandidateEntityGenerator.__init__(self, entity_dict)
+        self.document_ids = document_ids
+        self.delay = delay
+        self.calls = 0
+
+    def generate(self, mention):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [self.entity_dict[i] for i in self.document_ids]
+
+
+class FailingGenerator(BaseCandidateEntityGenerator):
+    def generate(self, mention):
+        raise RuntimeError("child failed")
+
+
+def document_ids(candidates):
+    return [entity.document_id for entity in candidates]
+
+
+def fuse(entity_dict, mentions, lists, **kwargs):
+    children = [StaticGenerator(entity_dict, ids) for ids in lists]
+    with FusionCandidateGenerator(children, **kwargs) as fusion:
+        fused = fusion.generate_batch(mentions)
+        assert fused == [fusion.generate(mention) for mention in mentions]
+    return [document_ids(candidates) for candidates in fused]
+
+
+def test_reciprocal_rank_fusion_order(entity_dict, mentions):
+    lists = [
+        ["alpha-0", "alpha-1", "alpha-2"],
+        ["alpha-1", "alpha-2", "alpha-3"],
+    ]
+    fused = fuse(entity_dict, mentions[:3], lists)
+    assert fused == [["alpha-1", "alpha-2", "alpha-0", "alpha-3"]] * 3
+
+
+def test_duplicates_are_merged(entity_dict, mentions):
+    lists = [["alpha-0", "alpha-1"], ["alpha-0"], ["alpha-1", "alpha-0"]]
+    assert fuse(entity_dict, mentions[:1], lists) == [["alpha-0", "alpha-1"]]
+
+
+def test_ties_keep_first_seen_order(entity_dict, mentions):
+    lists = [["alpha-0"], ["beta-0"]]
+    assert fuse(entity_dict, mentions[:1], lists) == [["alpha-0", "beta-0"]]
+
+
+def test_weights(entity_dict, mentions):
+    lists = [["alpha-0", "alpha-1"], ["beta-0", "alpha-1"]]
+    expected = {
+        (1.0, 1.0): ["alpha-1", "alpha-0", "beta-0"],
+        (1.0, 2.0): ["alpha-1", "beta-0", "alpha-0"],
+        (0.0, 1.0): ["beta-0", "alpha-1", "alpha-0"],
+        (1.0, 0.0): ["alpha-0", "alpha-1", "beta-0"],
+    }
+    for weights, fused in expected.items():
+        assert fuse(
+            entity_dict, mentions[:1], lists, weights=list(weights)
+        ) == [fused]
+
+
+def test_top_k(entity_dict, mentions):
+    lists = [["alpha-0", "alpha-1", "alpha-2"], ["alpha-1", "alpha-3"]]
+    assert fuse(entity_dict, mentions[:1], lists, top_k=2) == [
+        ["alpha-1", "alpha-0"]
+    ]
+
+
+def test_weights_must_match_children(entity_dict):
+    children = [StaticGenerator(entity_dict, []) for _ in range(3)]
+    with pytest.raises(ValueError):
+        FusionCandidateGenerator(children, weights=[1.0, 2.0])
+
+
+@pytest.mark.parametrize("latency_budget", [None, 1.0])
+def test_child_errors_are_raised(entity_dict, mentions, latency_budget):
+    children = [
+        StaticGenerator(entity_dict, []),
+        FailingGenerator(entity_dict),
+    ]
+    with FusionCandidateGenerator(
+        children, latency_budget=latency_budget
+    ) as fusion:
+        with pytest.raises(RuntimeError):
+            fusion.generate_batch(mentions[:2])
+
+
+def test_late_child_is_dropped(entity_dict, mentions):
+    fast = StaticGenerator(entity_dict, ["alpha-0", "alpha-1"])
+    slow = StaticGenerator(entity_dict, ["beta-0"], delay=0.5)
+    with FusionCandidateGenerator(
+        [slow, fast], latency_budget=0.05, chunk_size=1
+    ) as fusion:
+        assert [
+            document_ids(candidates)
+            for candidates in fusion.generate_batch(mentions[:2])
+        ] == [["alpha-0", "alpha-1"]] * 2
+        assert fusion.stats() == {
+            "0:StaticGenerator": 2,
+            "1:StaticGenerator": 0,
+        }
+
+
+def test_slow_child_does_not_delay_the_others(entity_dict, mentions):
+    # The slow child is still busy with the first call during the next
+    # ones; the fast child must answer every call in time
+    fast = StaticGenerator(entity_dict, ["alpha-0"])
+    slow = StaticGenerator(entity_dict, ["beta-0"], delay=0.5)
+    with FusionCandidateGenerator(
+        [slow, fast], latency_budget=0.05, chunk_size=1
+    ) as fusion:
+        for _ in range(3):
+            fused = fusion.generate_batch(mentions[:1])
+            assert document_ids(fused[0]) == ["alpha-0"]
+        assert fusion.stats() == {
+            "0:StaticGenerator": 3,
+            "1:StaticGenerator": 0,
+        }
+    assert slow.calls == 1
+    assert fast.calls == 3
@@ -0,0 +1,88 @@
+import bz2
+import json
+
+import pytest
+from src.data.mention import Mention, MentionReader, MentionStore
+
+
+def make_mentions(count):
+    return [
+        Mention(
+            category="LOW_OVERLAP",
+            text=f"mention {i} " + "é" * (i % 5) + "x" * (i * 7 % 23),
+            context_document_id=f"doc-{i % 4}",
+            label_document_id=f"doc-{i % 6}",
+            mention_id=f"m-{i}",
+            corpus=["world a", "world b", "world c"][i % 3],
+            start_index=i,
+            end_index=i + 2,
+        )
+        for i in range(count)
+    ]
+
+
+def write_mentions(path, mentions):
+    with open(path, "w", encoding="utf-8") as f:
+        for mention in mentions:
+            f.write(json.dumps(mention.__dict__, ensure_ascii=False) + "\n")
+
+
+@pytest.fixture
+def mentions():
+    return make_mentions(37)
+
+
+@pytest.fixture
+def mentions_path(tmp_path, mentions):
+    path = str(tmp_path / "val.json")
+    write_mentions(path, mentions)
+    return path
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8, 36, 37, 100])
+def test_shards_cover_every_mention_once(mentions_path, mentions, count):
+    reader = MentionReader(mentions_path)
+    sharded = [
+        mention
+        for index in range(count)
+        for mention in reader.shard(index, count)
+    ]
+    assert sharded == mentions
+
+
+def test_shards_of_a_shard_cover_it(mentions_path):
+    shard = MentionReader(mentions_path).shard(1, 3)
+    nested = [
+        mention for index in range(4) for mention in shard.shard(index, 4)
+    ]
+    assert nested == list(shard)
+
+
+def test_invalid_shard(mentions_path):
+    with pytest.raises(ValueError):
+        MentionReader(mentions_path).shard(3, 3)
+
+
+def test_compressed_file_cannot_be_sharded(tmp_path, mentions):
+    path = str(tmp_path / "val.json.bz2")
+    with bz2.open(path, "wt", encoding="utf-8") as f:
+        for mention in mentions:
+            f.write(json.dumps(mention.__dict__) + "\n")
+
+    assert list(MentionReader(path)) == mentions
+    with pytest.raises(ValueError):
+        MentionReader(path).shard(0, 2)
+
+
+@pytest.mark.parametrize("count", [1, 4, 50])
+def test_store_slices_cover_every_mention_once(mentions, count):
+    store = MentionStore.from_mentions(mentions)
+    sharded = [store[index::count] for index in range(count)]
+    assert sum(len(shard) for shard in sharded) == len(mentions)
+    assert (
+        sorted(
+            (mention for shard in sharded for mention in shard),
+            key=lambda mention: int(mention.mention_id[2:]),
+        )
+        == mentions
+    )
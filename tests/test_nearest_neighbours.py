@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from src.candidate_generators.nearest_neighbours import ExactIndex, IvfIndex
+
+
+@pytest.fixture
+def embeddings():
+    vectors = np.random.default_rng(0).normal(size=(500, 16))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float16)
+
+
+@pytest.fixture
+def queries():
+    return np.random.default_rng(1).normal(size=(6, 16)).astype(np.float32)
+
+
+@pytest.mark.parametrize("start, end", [(0, 500), (100, 140), (7, 8)])
+def test_exact_index_blocks(embeddings, queries, start, end):
+    scores = queries @ np.asarray(embeddings[start:end], np.float32).T
+    expected = np.argsort(-scores, axis=1, kind="stable")[:, :10] + start
+    results = ExactIndex(embeddings, block_size=16).search(
+        queries, 10, start, end
+    )
+    np.testing.assert_array_equal(np.stack(results), expected)
+
+
+@pytest.mark.parametrize("start, end", [(0, 500), (100, 140), (7, 12)])
+def test_ivf_search_stays_in_range_and_finds_k(
+    embeddings, queries, start, end
+):
+    index = IvfIndex.train(embeddings, num_clusters=32, num_probes=1)
+    for ids in index.search(queries, 10, start, end):
+        assert len(ids) == min(10, end - start)
+        assert len(set(ids.tolist())) == len(ids)
+        assert ((ids >= start) & (ids < end)).all()
+
+
+def test_ivf_search_probing_every_list_is_exact(embeddings, queries):
+    index = IvfIndex.train(embeddings, num_clusters=8, num_probes=8)
+    exact = ExactIndex(embeddings).search(queries, 10, 100, 300)
+    for ids, expected in zip(index.search(queries, 10, 100, 300), exact):
+        np.testing.assert_array_equal(ids, expected)
+
+
+def test_ivf_search_of_an_empty_range(embeddings, queries):
+    index = IvfIndex.train(embeddings, num_clusters=8)
+    assert all(len(ids) == 0 for ids in index.search(queries, 10, 50, 50))
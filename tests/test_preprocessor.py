@@ -0,0 +1,201 @@
+from dataclasses import replace
+
+import pytest
+from src.models.escher.preprocessor import EscherPreprocessor
+
+
+def candidate_lists(entity_dict, mentions, top_k):
+    entities = list(entity_dict.values())
+    candidates = []
+    for i, mention in enumerate(mentions):
+        gold = entity_dict[mention.label_document_id]
+        others = [
+            entity
+            for entity in entities[i:] + entities[:i]
+            if entity is not gold
+        ]
+        candidates.append(others[: i % top_k] + [gold] + others[i % top_k :])
+        candidates[-1] = candidates[-1][:top_k]
+    return candidates
+
+
+@pytest.fixture(params=["ids", "words"])
+def make_preprocessor(request, entity_dict, tokenizer):
+    # Samples are fitted from cached token ids or, for tokenizers that do
+    # not support them, by entity length in words
+    if request.param == "words":
+        tokenizer._supports_definition_ids = False
+
+    def make(max_tokens=None):
+        return EscherPreprocessor(
+            16, 32, entity_dict, tokenizer=tokenizer, max_tokens=max_tokens
+        )
+
+    return make
+
+
+def check_element(data_element, candidate_entities, max_tokens):
+    sequence_length = len(data_element.encoded_final_sequence)
+    assert sequence_length <= max_tokens
+    assert data_element.possible_offsets == [
+        entity.document_id for entity in candidate_entities
+    ]
+
+    positions = data_element.gloss_positions
+    assert len(positions) == len(candidate_entities)
+    for (start, end), (next_start, _) in zip(positions, positions[1:]):
+        assert start <= end < next_start
+    assert positions[-1][1] < sequence_length - 1
+
+
+@pytest.mark.parametrize("max_tokens", [120, 200, 400])
+def test_fitted_samples_stay_within_budget(
+    make_preprocessor, entity_dict, mentions, max_tokens
+):
+    preprocessor = make_preprocessor(max_tokens)
+    candidates = candidate_lists(entity_dict, mentions, 8)
+    data_elements = preprocessor.preprocess_batch(mentions, candidates)
+
+    for data_element, candidate_entities in zip(data_elements, candidates):
+        assert data_element is not None
+        check_element(data_element, candidate_entities, max_tokens)
+
+
+def test_samples_within_budget_are_not_changed(
+    make_preprocessor, entity_dict, mentions
+):
+    candidates = candidate_lists(entity_dict, mentions, 8)
+    expected = make_preprocessor().preprocess_batch(mentions, candidates)
+    max_tokens = max(len(e.encoded_final_sequence) for e in expected)
+    fitted = make_preprocessor(max_tokens).preprocess_batch(
+        mentions, candidates
+    )
+
+    for data_element, expected_element in zip(fitted, expected):
+        assert data_element.gloss_positions == (
+            expected_element.gloss_positions
+        )
+        assert data_element.encoded_final_sequence.tolist() == (
+            expected_element.encoded_final_sequence.tolist()
+        )
+
+
+def test_short_candidates_are_kept_whole(
+    make_preprocessor, entity_dict, mentions
+):
+    mention = next(m for m in mentions if m.label_document_id != "alpha-1")
+    entity_dict["alpha-1"] = replace(entity_dict["alpha-1"], text="iron")
+    gold = entity_dict[mention.label_document_id]
+    candidates = [gold, entity_dict["alpha-1"]] + [
+        entity
+        for entity in entity_dict.values()
+        if entity.document_id not in (gold.document_id, "alpha-1")
+    ][:6]
+
+    unfitted = make_preprocessor().preprocess(mention, candidates)
+    fitted = make_preprocessor(
+        len(unfitted.encoded_final_sequence) - 10
+    ).preprocess(mention, candidates)
+
+    def description(data_element, i):
+        start, end = data_element.gloss_positions[i]
+        return data_element.encoded_final_sequence[start : end + 1].tolist()
+
+    assert len(fitted.encoded_final_sequence) < len(
+        unfitted.encoded_final_sequence
+    )
+    assert description(fitted, 1) == description(unfitted, 1)
+
+
+def test_unfittable_sample_is_returned_unchanged(
+    make_preprocessor, entity_dict, mentions
+):
+    candidates = candidate_lists(entity_dict, mentions[:1], 8)
+    expected = make_preprocessor().preprocess_batch(mentions[:1], candidates)
+    fitted = make_preprocessor(8).preprocess_batch(mentions[:1], candidates)
+    assert fitted[0].encoded_final_sequence.tolist() == (
+        expected[0].encoded_final_sequence.tolist()
+    )
+
+
+def test_samples_from_cached_ids_match_text_samples(
+    entity_dict, mentions, tokenizer
+):
+    preprocessor = EscherPreprocessor(16, 32, entity_dict, tokenizer)
+    candidates = candidate_lists(entity_dict, mentions, 8)
+    for mention, candidate_entities in zip(mentions, candidates):
+        mention_input = preprocessor.preprocess_mention(mention)
+        candidate_input, encoded_candidates = preprocessor.encode_candidates(
+            candidate_entities, preprocessor.entity_length
+        )
+        assert encoded_candidates is not None
+
+        expected = tokenizer.prepare_sample(mention_input, candidate_input)
+        sample = tokenizer.prepare_sample_from_ids(
+            mention_input, encoded_candidates
+        )
+        assert sample[0].tolist() == expected[0].tolist()
+        assert sample[1] == expected[1]
+        assert sample[2].tolist() == expected[2].tolist()
+
+
+def test_token_cache_encodes_modified_entities_again(entity_dict, tokenizer):
+    preprocessor = EscherPreprocessor(16, 32, entity_dict, tokenizer)
+    entity = entity_dict["alpha-0"]
+    preprocessor.encode_candidates([entity], preprocessor.entity_length)
+
+    modified = replace(entity, text="storm crown")
+    _, encoded = preprocessor.encode_candidates(
+        [modified], preprocessor.entity_length
+    )
+    assert encoded[0][0].tolist() == (
+        tokenizer.encode_definition("storm crown")[0].tolist()
+    )
+    assert len(preprocessor.token_cache) == 1
+
+
+@pytest.mark.parametrize("text", ["", " leading space", "trailing "])
+def test_token_cache_skips_texts_that_tokenize_differently(
+    entity_dict, tokenizer, text
+):
+    preprocessor = EscherPreprocessor(16, 32, entity_dict, tokenizer)
+    entity = replace(entity_dict["alpha-0"], text=text)
+    _, encoded = preprocessor.encode_candidates(
+        [entity], preprocessor.entity_length
+    )
+    assert encoded is None
+
+
+def split_window(text, start_index, end_index, mention_window_size):
+    # The window as preprocess_mention built it by splitting the document
+    tokens = text.split(" ")
+    tokens.insert(start_index, "<classify>")
+    tokens.insert(end_index + 2, "</classify>")
+    window_start = start_index - mention_window_size
+    window_end = end_index + mention_window_size + 3
+    return " ".join(tokens[window_start:window_end])
+
+
+@pytest.mark.parametrize(
+    "text", ["one", "a b c d e f g h i j", "double  space and  é words "]
+)
+@pytest.mark.parametrize("mention_window_size", [0, 1, 3, 16])
+def test_word_offset_windows_match_split_windows(
+    entity_dict, mentions, tokenizer, text, mention_window_size
+):
+    entity_dict["alpha-0"] = replace(entity_dict["alpha-0"], text=text)
+    preprocessor = EscherPreprocessor(
+        mention_window_size, 32, entity_dict, tokenizer
+    )
+    num_words = len(text.split(" "))
+    for start_index in range(num_words + 3):
+        for end_index in range(start_index, start_index + 4):
+            mention = replace(
+                mentions[0],
+                context_document_id="alpha-0",
+                start_index=start_index,
+                end_index=end_index,
+            )
+            assert preprocessor.preprocess_mention(mention) == split_window(
+                text, start_index, end_index, mention_window_size
+            )
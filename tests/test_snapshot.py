@@ -0,0 +1,63 @@
+import os
+
+import pytest
+from src.data.snapshot import read_snapshot, write_snapshot
+
+FINGERPRINT = {"size": 10, "mtime_ns": 20}
+RECORDS = [
+    ("Title", "Some text", "id-1"),
+    ("", "é 日本語", "id-2"),
+    ("lone \ud800 surrogate", "", "id-3"),
+]
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / "entities.snap")
+    write_snapshot(path, FINGERPRINT, RECORDS, width=3)
+    return path
+
+
+def test_round_trip(snapshot_path):
+    assert read_snapshot(snapshot_path, FINGERPRINT) == RECORDS
+
+
+def test_empty_round_trip(tmp_path):
+    path = str(tmp_path / "empty.snap")
+    write_snapshot(path, FINGERPRINT, [], width=3)
+    assert read_snapshot(path, FINGERPRINT) == []
+
+
+def test_stale_fingerprint_is_a_miss(snapshot_path):
+    assert read_snapshot(snapshot_path, {**FINGERPRINT, "size": 11}) is None
+
+
+def test_missing_file_is_a_miss(tmp_path):
+    assert read_snapshot(str(tmp_path / "missing.snap"), FINGERPRINT) is None
+
+
+@pytest.mark.parametrize("size", [0, 3, 12, 40, -1])
+def test_truncated_file_is_a_miss(snapshot_path, size):
+    with open(snapshot_path, "rb") as f:
+        data = f.read()
+    with open(snapshot_path, "wb") as f:
+        f.write(data[:size])
+    assert read_snapshot(snapshot_path, FINGERPRINT) is None
+
+
+def test_corrupt_file_is_a_miss(snapshot_path):
+    with open(snapshot_path, "r+b") as f:
+        f.seek(12)
+        f.write(b"\xff" * 8)
+    assert read_snapshot(snapshot_path, FINGERPRINT) is None
+
+
+def test_failed_write_leaves_no_files(tmp_path, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    path = str(tmp_path / "entities.snap")
+    with pytest.raises(OSError):
+        write_snapshot(path, FINGERPRINT, RECORDS, width=3)
+    assert os.listdir(tmp_path) == []
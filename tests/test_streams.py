@@ -0,0 +1,114 @@
+import bz2
+import gzip
+import io
+import lzma
+import tarfile
+
+import pytest
+from src.data import streams
+from src.data.entity import EntityReader, EntityStore
+from src.data.mention import MentionReader
+from src.data.streams import iter_archive, open_text
+
+LINES = ["first line\n", "é second line\n", "third\n"]
+
+
+@pytest.mark.parametrize(
+    "extension, opener",
+    [(".gz", gzip.open), (".bz2", bz2.open), (".xz", lzma.open)],
+)
+def test_compressed_files(tmp_path, extension, opener):
+    path = str(tmp_path / f"lines.json{extension}")
+    with opener(path, "wt", encoding="utf-8") as f:
+        f.writelines(LINES)
+
+    with open_text(path, buffer_size=4) as f:
+        assert list(f) == LINES
+
+
+def add_member(tar, name, text):
+    data = text.encode("utf-8")
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture(params=["w", "w:gz", "w:bz2"])
+def archive_path(request, tmp_path):
+    path = str(tmp_path / "data.tar")
+    with tarfile.open(path, request.param) as tar:
+        add_member(tar, "./data/documents/alpha.json", "alpha\n")
+        add_member(tar, "data/documents/beta.json", "".join(LINES))
+        add_member(tar, "data/mentions/val.json", "mention\n")
+    return path
+
+
+def test_archive_member(archive_path):
+    with open_text(archive_path + "::data/documents/beta.json") as f:
+        assert list(f) == LINES
+    with open_text(archive_path + "::./data/documents/alpha.json") as f:
+        assert list(f) == ["alpha\n"]
+
+
+def test_missing_archive_member(archive_path):
+    with pytest.raises(FileNotFoundError):
+        with open_text(archive_path + "::data/documents/gamma.json"):
+            pass
+
+
+def test_archive_is_closed_with_the_member(archive_path, monkeypatch):
+    # The member generators are kept alive, so the archives are only
+    # closed if open_text closes them
+    archives, generators = [], []
+    open_archive = tarfile.open
+
+    def record_archive(*args, **kwargs):
+        archives.append(open_archive(*args, **kwargs))
+        return archives[-1]
+
+    def record_generator(*args, **kwargs):
+        generators.append(iter_archive(*args, **kwargs))
+        return generators[-1]
+
+    monkeypatch.setattr(streams.tarfile, "open", record_archive)
+    monkeypatch.setattr(streams, "iter_archive", record_generator)
+    with open_text(archive_path + "::data/documents/alpha.json") as f:
+        f.readline()
+        assert not archives[0].closed
+    assert archives[0].closed
+
+    with pytest.raises(RuntimeError):
+        with open_text(archive_path + "::data/documents/beta.json"):
+            raise RuntimeError()
+    assert archives[1].closed
+
+
+def test_iter_archive_prefix(archive_path):
+    names = [name for name, _ in iter_archive(archive_path, "data/documents")]
+    assert names == ["data/documents/alpha.json", "data/documents/beta.json"]
+
+
+def test_entities_from_an_archive(tmp_path):
+    path = str(tmp_path / "data.tar.gz")
+    record = '{"title": "A", "text": "a", "document_id": "1"}\n'
+    with tarfile.open(path, "w:gz") as tar:
+        add_member(tar, "documents/alpha.json", record)
+        add_member(tar, "documents/beta.json", record.replace("1", "2"))
+
+    reader = EntityReader(path + "::documents", corpora=["beta"])
+    assert [entity.document_id for entity in reader] == ["2"]
+    with pytest.raises(ValueError):
+        reader.read_store()
+
+
+def test_compressed_sources_cannot_be_sharded_or_mapped(tmp_path):
+    path = str(tmp_path / "alpha.json.gz")
+    with gzip.open(path, "wt") as f:
+        f.write('{"title": "A", "text": "a", "document_id": "1"}\n')
+
+    with pytest.raises(ValueError):
+        MentionReader(path).shard(0, 2)
+    with pytest.raises(ValueError):
+        MentionReader(str(tmp_path / "a.tar::val.json")).shard(1, 2)
+    with pytest.raises(ValueError):
+        EntityStore([path])
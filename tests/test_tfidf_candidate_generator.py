@@ -0,0 +1,113 @@
+from dataclasses import replace
+import json
+import os
+
+import numpy as np
+import pytest
+from src.candidate_generators import TfidfCandidateGenerator
+
+
+def write_candidates(path, lists):
+    with open(os.path.join(path, "val.json"), "w") as f:
+        for mention_id, candidates in lists:
+            record = {"mention_id": mention_id, "tfidf_candidates": candidates}
+            f.write(json.dumps(record) + "\n")
+
+
+@pytest.fixture
+def candidates_path(tmp_path):
+    path = str(tmp_path / "tfidf_candidates")
+    os.makedirs(path)
+    write_candidates(
+        path,
+        [
+            ("m-0", ["alpha-0", "alpha-1", "alpha-2"]),
+            ("m-1", ["beta-3"]),
+            ("m-2", []),
+            ("m-3", ["gamma-0", "gamma-1"]),
+            ("m-1", ["beta-1", "beta-2"]),
+        ],
+    )
+    return path
+
+
+def make_generator(entity_dict, path, top_k=64):
+    return TfidfCandidateGenerator(
+        entity_dict, top_k=top_k, filename="val.json", path=path
+    )
+
+
+def document_ids(candidates):
+    return [[entity.document_id for entity in c] for c in candidates]
+
+
+def test_rows_are_padded(entity_dict, candidates_path):
+    generator = make_generator(entity_dict, candidates_path)
+    matrix = np.asarray(generator.candidate_matrix)
+    assert matrix.shape == (5, 3)
+    assert matrix.dtype == np.int32
+    assert (matrix[1, 1:] == -1).all()
+    assert (matrix[2] == -1).all()
+
+
+def test_lookup(entity_dict, candidates_path, mentions):
+    generator = make_generator(entity_dict, candidates_path)
+    queries = [
+        replace(mentions[0], mention_id=mention_id)
+        for mention_id in ["m-3", "unknown", "m-0", "m-2", "m-1", ""]
+    ]
+    expected = [
+        ["gamma-0", "gamma-1"],
+        [],
+        ["alpha-0", "alpha-1", "alpha-2"],
+        [],
+        # The last list of a repeated mention id wins
+        ["beta-1", "beta-2"],
+        [],
+    ]
+    assert document_ids(generator.generate_batch(queries)) == expected
+    assert [
+        [entity.document_id for entity in generator.generate(query)]
+        for query in queries
+    ] == expected
+    assert generator.find_rows(["unknown", "m-1", "m-10"]).tolist() == [
+        -1,
+        4,
+        -1,
+    ]
+
+
+def test_top_k(entity_dict, candidates_path):
+    generator = make_generator(entity_dict, candidates_path, top_k=2)
+    rows = generator.find_rows(["m-0", "m-1"])
+    assert [
+        [e.document_id for e in generator.lookup(codes, *generator.state)]
+        for codes in generator.candidate_matrix[rows]
+    ] == [["alpha-0", "alpha-1"], ["beta-1", "beta-2"]]
+
+
+def test_matrix_is_rebuilt_when_the_json_is_newer(
+    entity_dict, candidates_path
+):
+    make_generator(entity_dict, candidates_path)
+    write_candidates(candidates_path, [("m-0", ["beta-0"])])
+    matrix_path = os.path.join(candidates_path, "val.candidates.npy")
+    later = os.path.getmtime(matrix_path) + 10
+    os.utime(os.path.join(candidates_path, "val.json"), (later, later))
+
+    generator = make_generator(entity_dict, candidates_path)
+    assert generator.find_rows(["m-0", "m-1"]).tolist() == [0, -1]
+    assert np.asarray(generator.candidate_matrix).shape == (1, 1)
+
+
+def test_matrix_is_reused(entity_dict, candidates_path, monkeypatch):
+    make_generator(entity_dict, candidates_path)
+
+    def fail(self):
+        raise AssertionError("converted again")
+
+    monkeypatch.setattr(TfidfCandidateGenerator, "convert_candidates", fail)
+    make_generator(entity_dict, candidates_path)
+    assert not [
+        name for name in os.listdir(candidates_path) if name.endswith(".tmp")
+    ]
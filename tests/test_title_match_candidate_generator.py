@@ -0,0 +1,91 @@
+from dataclasses import replace
+
+from src.candidate_generators import (
+    BaseCandidateEntityGenerator,
+    TitleIndex,
+    TitleMatchCandidateGenerator,
+)
+from src.candidate_generators.title_index import normalize_title, title_aliases
+from src.data.entity import Entity
+
+
+class StaticGenerator(BaseCandidateEntityGenerator):
+    def __init__(self, entity_dict, document_ids):
+        BaseCandidateEntityGenerator.__init__(self, entity_dict)
+        self.document_ids = document_ids
+        self.calls = 0
+
+    def generate(self, mention):
+        self.calls += 1
+        return [self.entity_dict[i] for i in self.document_ids]
+
+
+def document_ids(candidates):
+    return [entity.document_id for entity in candidates]
+
+
+def test_normalisation():
+    assert normalize_title("  Darth   VADER!") == "darth vader"
+    assert normalize_title("Obi-Wan Kenobi") == "obi wan kenobi"
+    assert normalize_title("...") == ""
+
+
+def test_parenthetical_alias():
+    assert title_aliases("Darth Vader (Legends)") == [
+        "darth vader legends",
+        "darth vader",
+    ]
+    assert title_aliases("Darth Vader") == ["darth vader"]
+    assert title_aliases("(Legends)") == ["legends"]
+
+
+def test_exact_titles_rank_before_aliases():
+    index = TitleIndex(
+        [
+            Entity("Vader (Legends)", "", "a", corpus="star_wars"),
+            Entity("Vader", "", "b", corpus="star_wars"),
+        ]
+    )
+    assert index.lookup("vader", "star_wars") == ["b", "a"]
+    assert index.lookup("Vader (legends)", "star_wars") == ["a"]
+
+
+def test_worlds_are_isolated():
+    index = TitleIndex(
+        [
+            Entity("Vader", "", "a", corpus="star_wars"),
+            Entity("Vader", "", "b", corpus="lego"),
+        ]
+    )
+    assert index.lookup("Vader", "star_wars") == ["a"]
+    assert index.lookup("Vader", "lego") == ["b"]
+    assert index.lookup("Vader", "muppets") == []
+    assert sorted(index.lookup("Vader")) == ["a", "b"]
+
+
+def test_title_matches_come_first_without_duplicates(entity_dict, mentions):
+    mention = replace(mentions[0], text=entity_dict["alpha-3"].title)
+    mention = replace(mention, corpus="alpha")
+    wrapped = StaticGenerator(entity_dict, ["alpha-0", "alpha-3", "beta-1"])
+    generator = TitleMatchCandidateGenerator(entity_dict, wrapped, top_k=3)
+
+    candidates = generator.generate(mention)
+    assert document_ids(candidates)[0] == "alpha-3"
+    assert len(set(document_ids(candidates))) == len(candidates) == 3
+    assert document_ids(candidates)[1:] == ["alpha-0", "beta-1"]
+    assert generator.exact_matches == 1
+
+
+def test_short_circuit(entity_dict, mentions):
+    matched = replace(mentions[0], text=entity_dict["alpha-3"].title)
+    matched = replace(matched, corpus="alpha")
+    unmatched = replace(mentions[1], text="no such title")
+    wrapped = StaticGenerator(entity_dict, ["beta-1"])
+    generator = TitleMatchCandidateGenerator(
+        entity_dict, wrapped, short_circuit=True
+    )
+
+    candidates = generator.generate_batch([matched, unmatched])
+    assert document_ids(candidates[0]) == ["alpha-3"]
+    assert document_ids(candidates[1]) == ["beta-1"]
+    assert wrapped.calls == 1
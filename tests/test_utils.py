@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from src.candidate_generators import (
+    Bm25CandidateGenerator,
+    CachedCandidateGenerator,
+    FusionCandidateGenerator,
+    TruncatedCandidateGenerator,
+)
+from src.candidate_generators.utils import generator_settings, top_k_indices
+
+
+@pytest.mark.parametrize("k", [0, 1, 5, 50, 64, 100])
+def test_top_k_indices_matches_a_full_sort(k):
+    scores = np.random.default_rng(0).normal(size=(7, 64))
+    expected = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    np.testing.assert_array_equal(top_k_indices(scores, k), expected)
+
+
+def test_top_k_indices_breaks_ties_by_index():
+    scores = np.array([[1.0, 3.0, 3.0, 0.0, 3.0], [2.0, 2.0, 2.0, 2.0, 2.0]])
+    np.testing.assert_array_equal(
+        top_k_indices(scores, 5), [[1, 2, 4, 0, 3], [0, 1, 2, 3, 4]]
+    )
+
+
+def test_top_k_indices_of_one_row():
+    np.testing.assert_array_equal(
+        top_k_indices(np.array([0.5, 2.0, -1.0, 1.0]), 2), [1, 3]
+    )
+
+
+def test_top_k_indices_of_no_rows():
+    assert top_k_indices(np.zeros((0, 10)), 3).shape == (0, 3)
+    assert top_k_indices(np.zeros((4, 0)), 3).shape == (4, 0)
+
+
+def test_generator_settings_include_scoring_parameters(entity_dict):
+    bm25 = Bm25CandidateGenerator(entity_dict, k1=1.5, b=0.5, path=None)
+    settings = generator_settings(bm25)
+    assert settings["k1"] == 1.5
+    assert settings["b"] == 0.5
+    assert "num_workers" not in settings
+    assert "block_size" not in settings
+
+
+def test_generator_settings_of_wrapped_generators(entity_dict):
+    bm25 = Bm25CandidateGenerator(entity_dict, path=None)
+    with FusionCandidateGenerator(
+        [bm25, TruncatedCandidateGenerator(bm25, top_k=4)],
+        latency_budget=0.1,
+        chunk_size=8,
+    ) as fusion:
+        settings = generator_settings(CachedCandidateGenerator(fusion))
+
+    fusion_settings = settings["candidate_generator"]
+    assert fusion_settings["chunk_size"] == 8
+    assert fusion_settings["latency_budget"] == 0.1
+    assert fusion_settings["candidate_generator_0"]["k1"] == bm25.k1
+    assert fusion_settings["candidate_generator_1"]["top_k"] == 4
+
+
+def test_generator_settings_leave_out_the_cache_file(entity_dict, tmp_path):
+    bm25 = Bm25CandidateGenerator(entity_dict, path=None)
+    settings = [
+        generator_settings(
+            CachedCandidateGenerator(
+                bm25, max_size=max_size, path=str(tmp_path / name)
+            )
+        )
+        for name, max_size in [("a.json", 10), ("b.json", 100000)]
+    ]
+    assert settings[0] == settings[1]
+    assert "path" not in settings[0] and "max_size" not in settings[0]